@@ -1,91 +1,1550 @@
 # -*- coding: utf-8 -*-
 import random
+import re
 import logging
-import requests
 import json
-import six
-from datetime import datetime
-from typing import Union, List
-
-from ask_sdk_model.dialog import (ElicitSlotDirective, DelegateDirective)
-from ask_sdk_model import (Response, IntentRequest, DialogState, SlotConfirmationStatus, Slot, ui)
+import os
+import queue
+import sys
+import time
+import threading
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Union, List, Tuple
+
+from ask_sdk_model import (Response, ResponseEnvelope, IntentRequest, RequestEnvelope, DialogState, ui)
 from ask_sdk_model.slu.entityresolution import StatusCode
-from ask_sdk.standard import StandardSkillBuilder
 from ask_sdk_core.dispatch_components import (
     AbstractRequestHandler, AbstractExceptionHandler,
-    AbstractRequestInterceptor, AbstractResponseInterceptor)
+    AbstractResponseInterceptor)
+from ask_sdk_core.exceptions import AttributesManagerException
 from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_core.skill import CustomSkill
 from ask_sdk_core.utils import is_request_type, is_intent_name
-from ask_sdk_model import Response, IntentRequest
-from ask_sdk_model.interfaces.connections import SendRequestDirective
-from ask_sdk_model.interfaces.alexa.presentation.apl import (RenderDocumentDirective, ExecuteCommandsDirective, SpeakItemCommand, AutoPageCommand, HighlightMode)
+
+import conversion
+
+# Anything only some requests need (the HTTP client, dialog and APL
+# directives) is imported on first use to keep cold starts short.
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-def http_get(url):
-    """Return a response JSON for a GET call from `request`."""
-    # type: (str, Dict) -> Dict
-    response = requests.get(url)
+class RequestTimings(object):
+    """Phase timings (in ms), the price cache outcome and the response size for one request."""
+    __slots__ = ("name", "started", "phases", "cache", "response_bytes")
+
+    def __init__(self, name):
+        # type: (str) -> None
+        self.name = name
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.cache = None
+        self.response_bytes = None
+
+    def add(self, phase, elapsed_ms):
+        # type: (str, float) -> None
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed_ms
+
+_request_context = threading.local()
+
+def current_timings():
+    """Return the timings of the request running on this thread, if any."""
+    # type: () -> Union[RequestTimings, None]
+    return getattr(_request_context, "timings", None)
+
+class timed(object):
+    """Add the time spent in the block to `phase` of the current request."""
+    __slots__ = ("phase", "started")
+
+    def __init__(self, phase):
+        # type: (str) -> None
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        timings = current_timings()
+        if timings is not None:
+            timings.add(self.phase, (time.perf_counter() - self.started) * 1000.0)
+
+def note_cache_outcome(outcome):
+    """Record where the current request's quote came from: a cache hit, stale, a miss, the table or the stream."""
+    # type: (str) -> None
+    timings = current_timings()
+    if timings is not None:
+        timings.cache = outcome
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "1.5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "3"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", "0.1"))
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.environ.get("BREAKER_RESET", "30"))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open."""
+
+class CircuitBreaker(object):
+    """Stop calling upstream after `threshold` consecutive failures.
+
+    After `reset_after` seconds a single trial call is let through; its
+    outcome closes the breaker again or keeps it open.
+    """
+    def __init__(self, threshold, reset_after):
+        # type: (int, float) -> None
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        # type: () -> bool
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # Half-open: let this caller through, hold the rest back.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        # type: () -> None
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        # type: () -> None
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("Circuit breaker opened after {} failures".format(self.failures))
+                self.opened_at = time.monotonic()
+
+_session = None
+_session_lock = threading.Lock()
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+
+def get_http_session():
+    """Return the container-scoped pooled session, creating it on first use."""
+    # type: () -> requests.Session
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                import requests.adapters
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def _is_retryable(error):
+    # type: (Exception) -> bool
+    import requests
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code >= 500
 
-    if response.status_code < 200 or response.status_code >= 300:
-        response.raise_for_status()
+def http_get(url, circuit=None, retries=HTTP_RETRIES, timeout=None):
+    """Return a response JSON for a GET call from `request`.
 
-    return response.json()
+    `circuit` defaults to the module's breaker and `timeout` to the
+    configured (connect, read) timeouts.
+    """
+    # type: (str, CircuitBreaker, int, Union[float, Tuple[float, float], None]) -> Dict
+    import requests
 
-def get_resolved_value(request, slot_name):
-    """Resolve the slot name from the request using resolutions."""
-    # type: (IntentRequest, str) -> Union[str, None]
-    try:
-        return (request.intent.slots[slot_name].resolutions.resolutions_per_authority[0].values[0].value.name)
-    except (AttributeError, ValueError, KeyError, IndexError):
-        return None
+    circuit = circuit or breaker
+    if not circuit.allow():
+        raise CircuitOpenError("Upstream circuit is open for {}".format(url.split("?")[0]))
 
-def get_spoken_value(request, slot_name):
-    """Resolve the slot to the spoken value."""
-    # type: (IntentRequest, str) -> Union[str, None]
+    attempt = 0
+    while True:
+        try:
+            with timed("upstream"):
+                response = get_http_session().get(url, timeout=timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+            if response.status_code < 200 or response.status_code >= 300:
+                response.raise_for_status()
+
+            result = response.json()
+        except ValueError:
+            # A 200 with an HTML error page or a cut-off body is as broken as a 500.
+            circuit.record_failure()
+            raise
+        except requests.RequestException as e:
+            if attempt >= retries or not _is_retryable(e):
+                circuit.record_failure()
+                raise
+            attempt += 1
+            # Full jitter keeps retries from a burst of requests apart.
+            time.sleep(random.uniform(0, HTTP_BACKOFF * 2 ** attempt))
+            continue
+
+        circuit.record_success()
+        return result
+
+class UpstreamHTTPError(Exception):
+    """A non-2xx answer to an async GET."""
+    def __init__(self, status, url):
+        # type: (int, str) -> None
+        super(UpstreamHTTPError, self).__init__("HTTP {} from {}".format(status, url.split("?")[0]))
+        self.status = status
+
+_async_sessions = {}  # event loop -> aiohttp session
+_ssl_context = None
+
+async def _aiohttp_get(aiohttp, url):
+    # type: (Any, str) -> Tuple[int, bytes]
+    import asyncio
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        session = _async_sessions[loop] = aiohttp.ClientSession(
+            timeout=timeout, connector=aiohttp.TCPConnector(limit_per_host=HTTP_POOL_SIZE))
+
+    async with session.get(url) as response:
+        return response.status, await response.read()
+
+async def _stream_get(url):
+    # type: (str) -> Tuple[int, bytes]
+    """A bare HTTP/1.0 GET over asyncio streams, for hosts without aiohttp."""
+    import asyncio
+    import ssl
+    from urllib.parse import urlsplit
+    global _ssl_context
+
+    parts = urlsplit(url)
+    context = None
+    if parts.scheme == "https":
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context()
+        context = _ssl_context
+    port = parts.port or (443 if context else 80)
+    target = "{}?{}".format(parts.path or "/", parts.query) if parts.query else parts.path or "/"
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=context), HTTP_CONNECT_TIMEOUT)
     try:
-        return request.intent.slots[slot_name].value
-    except (AttributeError, ValueError, KeyError, IndexError):
-        return None
+        writer.write("GET {} HTTP/1.0\r\nHost: {}\r\nAccept: application/json\r\n\r\n".format(
+            target, parts.netloc).encode("ascii"))
+        raw = await asyncio.wait_for(reader.read(), HTTP_READ_TIMEOUT)
+    finally:
+        writer.close()
+
+    head, _, body = raw.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), body
+
+async def async_http_get(url, circuit=None, retries=HTTP_RETRIES):
+    """Return a response JSON for a GET call without blocking the event loop."""
+    # type: (str, CircuitBreaker, int) -> Dict
+    import asyncio
+    try:
+        import aiohttp
+    except ImportError:
+        aiohttp = None
 
-def get_slot_values(filled_slots):
-    """Return slot values with additional info."""
-    # type: (Dict[str, Slot]) -> Dict[str, Any]
-    slot_values = {}
-    logger.info("Filled slots: {}".format(filled_slots))
+    circuit = circuit or breaker
+    if not circuit.allow():
+        raise CircuitOpenError("Upstream circuit is open for {}".format(url.split("?")[0]))
 
-    for key, slot_item in six.iteritems(filled_slots):
-        name = slot_item.name
+    attempt = 0
+    while True:
+        try:
+            if aiohttp is not None:
+                status, body = await _aiohttp_get(aiohttp, url)
+            else:
+                status, body = await _stream_get(url)
+
+            if status < 200 or status >= 300:
+                raise UpstreamHTTPError(status, url)
+
+            result = json.loads(body.decode("utf-8"))
+        except ValueError:
+            circuit.record_failure()
+            raise
+        except (OSError, asyncio.TimeoutError, UpstreamHTTPError) as e:
+            retryable = not isinstance(e, UpstreamHTTPError) or e.status >= 500
+            if attempt >= retries or not retryable:
+                circuit.record_failure()
+                raise
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, HTTP_BACKOFF * 2 ** attempt))
+            continue
+
+        circuit.record_success()
+        return result
+
+# Every coin and currency the skill knows about. The interaction model slot
+# types are generated from these (`python buybitcoin.py write-model`), and the
+# CRYPTO_SYMBOLS/FIAT_SYMBOLS environment variables pick the active subset.
+CRYPTO_CURRENCIES = {
+    "BTC": {"name": "Bitcoin", "unit": "satoshis",
+            "synonyms": ["bitcoins", "b.t.c.", "btc", "bit coin"]},
+    "ETH": {"name": "Ethereum", "unit": None,
+            "synonyms": ["ether", "eth", "e.t.h.", "etherium"]},
+    "LTC": {"name": "Litecoin", "unit": None,
+            "synonyms": ["litecoins", "ltc", "l.t.c.", "lite coin"]},
+}
+
+FIAT_CURRENCIES = {
+    "USD": {"name": "U.S. dollars", "amount_name": "U.S. dollars", "hint_name": "dollars",
+            "synonyms": ["United States dollars", "United States dollar", "U.S.D.", "U.S. dollar",
+                         "U.S. dollars", "US dollars", "US dollar", "dollars", "dollar"]},
+    "EUR": {"name": "Euros", "amount_name": "Euro", "hint_name": "Euro",
+            "synonyms": ["Euros", "Euro"]},
+    "GBP": {"name": "British pounds", "amount_name": "British pounds", "hint_name": "pounds",
+            "synonyms": ["British pounds", "British pound", "G.B.P.", "pounds sterling", "pounds", "pound"]},
+}
+
+CRYPTO_SYMBOLS = os.environ.get("CRYPTO_SYMBOLS", "BTC,ETH,LTC").split(",")
+FIAT_SYMBOLS = os.environ.get("FIAT_SYMBOLS", "USD,EUR,GBP").split(",")
+
+# A symbol must mean one thing, or slot resolution picks whichever it sees first.
+_ambiguous = set(CRYPTO_CURRENCIES) & set(FIAT_CURRENCIES)
+if _ambiguous:
+    raise ValueError("Currency symbols registered as both crypto and fiat: {}".format(", ".join(sorted(_ambiguous))))
+for _symbol in CRYPTO_SYMBOLS:
+    if _symbol not in CRYPTO_CURRENCIES:
+        raise ValueError("Unknown crypto currency symbol: {}".format(_symbol))
+for _symbol in FIAT_SYMBOLS:
+    if _symbol not in FIAT_CURRENCIES:
+        raise ValueError("Unknown fiat currency symbol: {}".format(_symbol))
+
+CRYPTOCOMPARE_API_KEY = os.environ.get("CRYPTOCOMPARE_API_KEY", "4ca8ca1f2f7499823cde74ea2212edbd64d972f770b8d28708224065f262bf46")
+CRYPTOCOMPARE_URL = os.environ.get("CRYPTOCOMPARE_URL", "https://min-api.cryptocompare.com")
+
+def price_source_url(source):
+    # type: (str) -> str
+    """Return the `pricemulti` URL template for an exchange name, or for the base URL of a compatible service."""
+    if "://" in source:
+        return source.rstrip("/") + "/data/pricemulti?fsyms={}&tsyms={}&api_key={}"
+    return CRYPTOCOMPARE_URL + "/data/pricemulti?fsyms={}&tsyms={}&api_key={}&e=" + source
+
+# With more than one source, prices are fetched from all of them at once and
+# aggregated (see QuoteAggregator).
+PRICE_SOURCES = [source for source in os.environ.get("PRICE_SOURCES", "Coinbase").split(",") if source]
+PRICE_QUORUM = int(os.environ.get("PRICE_QUORUM", str(len(PRICE_SOURCES) // 2 + 1)))
+PRICE_SOURCE_DEADLINE = float(os.environ.get("PRICE_SOURCE_DEADLINE", "1.5"))
+PRICE_OUTLIER_TOLERANCE = float(os.environ.get("PRICE_OUTLIER_TOLERANCE", "0.03"))
+PRICE_API_URL = price_source_url(PRICE_SOURCES[0])
+PRICE_CACHE_TTL = float(os.environ.get("PRICE_CACHE_TTL", "15"))
+PRICE_STALE_TTL = float(os.environ.get("PRICE_STALE_TTL", "300"))
+PRICE_AGE_ANNOUNCE = float(os.environ.get("PRICE_AGE_ANNOUNCE", "60"))
+PRICE_MAX_AGE = float(os.environ.get("PRICE_MAX_AGE", "900"))
+
+class StaleQuoteError(Exception):
+    """Raised when the only quote available is older than the hard cutoff."""
+
+class QuoteMatrix(object):
+    """Prices for every crypto/fiat pair, stored row-major in one flat array.
+
+    A lookup is two dict hits and an index into the array.
+    """
+    __slots__ = ("cryptos", "fiats", "_crypto_index", "_fiat_index", "_prices")
+
+    def __init__(self, cryptos, fiats, prices=None):
+        # type: (List[str], List[str], Union[array, None]) -> None
+        self.cryptos = list(cryptos)
+        self.fiats = list(fiats)
+        self._crypto_index = {symbol: i for i, symbol in enumerate(self.cryptos)}
+        self._fiat_index = {symbol: i for i, symbol in enumerate(self.fiats)}
+        self._prices = prices if prices is not None else array("d", [float("nan")] * (len(self.cryptos) * len(self.fiats)))
+
+    @property
+    def prices(self):
+        # type: () -> array
+        """The flat row-major price array, NaN where a pair has no price."""
+        return self._prices
+
+    def set(self, crypto, fiat, price):
+        # type: (str, str, float) -> None
+        self._prices[self._crypto_index[crypto] * len(self.fiats) + self._fiat_index[fiat]] = price
+
+    def price(self, crypto, fiat):
+        # type: (str, str) -> float
+        """Return the price of one `crypto` in `fiat`, raising KeyError if unknown."""
+        price = self._prices[self._crypto_index[crypto] * len(self.fiats) + self._fiat_index[fiat]]
+        if price != price:
+            raise KeyError("{}/{}".format(crypto, fiat))
+        return price
+
+    @classmethod
+    def from_json(cls, result, cryptos, fiats):
+        # type: (Dict[str, Dict[str, float]], List[str], List[str]) -> QuoteMatrix
+        """Build a matrix from a CryptoCompare `pricemulti` response."""
+        if result.get("Response") == "Error":
+            raise ValueError("Price API error: {}".format(result.get("Message")))
+
+        matrix = cls(cryptos, fiats)
+        for crypto in cryptos:
+            for fiat, price in result.get(crypto, {}).items():
+                if fiat in matrix._fiat_index:
+                    matrix.set(crypto, fiat, float(price))
+        return matrix
+
+class Quote(object):
+    """A quote matrix with the time it was fetched and what triggered the fetch.
+
+    `origin` is "request" for a fetch a user request waited on,
+    "background" for a stale-while-revalidate refresh, "prefetch" for a
+    scheduled warm-up, "refresher" for a quote table refresh, "table" for a
+    quote read from the table and "stream" for the live ticker stream.
+    """
+    __slots__ = ("prices", "fetched_at", "origin")
+
+    def __init__(self, prices, fetched_at, origin="request"):
+        # type: (QuoteMatrix, float, str) -> None
+        self.prices = prices
+        self.fetched_at = fetched_at
+        self.origin = origin
+
+    @property
+    def age(self):
+        # type: () -> float
+        return time.time() - self.fetched_at
+
+    @property
+    def id(self):
+        # type: () -> int
+        """Identifies the quote within a session: its fetch time in milliseconds."""
+        return int(self.fetched_at * 1000)
+
+    def price(self, crypto, fiat):
+        # type: (str, str) -> float
+        try:
+            return self.prices.price(crypto, fiat)
+        except KeyError:
+            raise StaleQuoteError("No {}/{} price in the latest quote".format(crypto, fiat))
+
+PRICE_WAIT_TIMEOUT = float(os.environ.get("PRICE_WAIT_TIMEOUT", "4"))
+
+class SingleFlightTimeout(Exception):
+    """Raised to a caller that gave up waiting on someone else's call."""
+
+class _Flight(object):
+    """One call that concurrent callers can wait on."""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """Collapse concurrent calls for the same key into a single call.
+
+    The first caller for a key runs the function; everyone arriving while
+    it runs waits for its result, each for at most their own timeout.
+    """
+    def __init__(self):
+        self.stats = {"calls": 0, "shared": 0, "timeouts": 0}
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, timeout=None):
+        # type: (Hashable, Callable[[], Any], Union[float, None]) -> Any
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if leader:
+            self._run(key, flight, fn)
+        elif not flight.done.wait(timeout):
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise SingleFlightTimeout("Gave up on {!r} after {}s".format(key, timeout))
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def start(self, key, fn):
+        # type: (Hashable, Callable[[], Any]) -> bool
+        """Run `fn` on a background thread unless a call for `key` is in flight."""
+        with self._lock:
+            if key in self._flights:
+                return False
+            flight = self._flights[key] = _Flight()
+            self.stats["calls"] += 1
+
+        threading.Thread(target=self._run, args=(key, flight, fn), daemon=True).start()
+        return True
 
+    def _run(self, key, flight, fn):
+        # type: (Hashable, _Flight, Callable[[], Any]) -> None
         try:
-            status_code = slot_item.resolutions.resolutions_per_authority[0].status.code
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+class AsyncSingleFlight(object):
+    """SingleFlight for coroutines sharing one event loop.
+
+    The call runs as its own task, so a caller that times out or is
+    cancelled does not cancel it for everyone else.
+    """
+    def __init__(self):
+        self.stats = {"calls": 0, "shared": 0, "timeouts": 0}
+        self._tasks = {}
+
+    async def do(self, key, fn, timeout=None):
+        # type: (Hashable, Callable[[], Awaitable], Union[float, None]) -> Any
+        import asyncio
+        task = self._tasks.get(key)
+        if task is None:
+            task = self.start(key, fn)
+        else:
+            self.stats["shared"] += 1
 
-            if status_code == StatusCode.ER_SUCCESS_MATCH:
-                slot_values[name] = {
-                    "synonym": slot_item.value,
-                    "resolved": slot_item.resolutions.resolutions_per_authority[0].values[0].value.name,
-                    "is_validated": True,
-                }
-            elif status_code == StatusCode.ER_SUCCESS_NO_MATCH:
-                slot_values[name] = {
-                    "synonym": slot_item.value,
-                    "resolved": slot_item.value,
-                    "is_validated": False,
-                }
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            if task.done():
+                raise
+            self.stats["timeouts"] += 1
+            raise SingleFlightTimeout("Gave up on {!r} after {}s".format(key, timeout))
+
+    def start(self, key, fn):
+        # type: (Hashable, Callable[[], Awaitable]) -> Any
+        """Schedule `fn` unless a call for `key` is in flight, and return its task."""
+        import asyncio
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.stats["calls"] += 1
+        return task
+
+    def _finish(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the error as retrieved when nobody was left waiting for it.
+            task.exception()
+
+_quote_listeners = []  # type: List[Callable[[Quote], None]]
+
+def add_quote_listener(listener):
+    # type: (Callable[[Quote], None]) -> None
+    """Call `listener(quote)` with every freshly fetched quote, on the thread that fetched it."""
+    _quote_listeners.append(listener)
+
+def notify_quote_listeners(quote):
+    # type: (Quote) -> None
+    for listener in list(_quote_listeners):
+        try:
+            listener(quote)
+        except Exception as e:
+            logger.warning("Quote listener {} failed: {}".format(listener, e))
+
+class PriceCache(object):
+    """Keep the latest quote in the warm container.
+
+    A quote younger than `ttl` is served as is. Up to `stale_ttl` it is
+    still served immediately while a background thread refreshes it, and
+    past that callers block on a refresh. Refreshes go through a
+    SingleFlight, so callers that need one while it is running wait for it
+    (for at most `wait_timeout`) instead of starting their own. No quote
+    older than `max_age` is ever returned.
+
+    With a `fetch_async` coroutine function, `get_async` does the same for
+    callers on an event loop without blocking it.
+
+    `shared` is the SharedQuotes of a quote table another process keeps
+    fresh, if there is one; callers read it before falling back to the cache.
+    """
+    def __init__(self, fetch, ttl, stale_ttl=0.0, max_age=float("inf"), key="prices", flights=None, wait_timeout=None, fetch_async=None,
+                 shared=None):
+        # type: (Callable[[], QuoteMatrix], float, float, float, Hashable, SingleFlight, float, Callable[[], Awaitable], SharedQuotes) -> None
+        self.fetch = fetch
+        self.shared = shared
+        self.fetch_async = fetch_async
+        self.async_flights = AsyncSingleFlight()
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_age = max_age
+        self.key = key
+        self.flights = flights or SingleFlight()
+        self.wait_timeout = wait_timeout
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "refreshes": 0, "errors": 0,
+                      "prefetches": 0, "served_prefetched": 0, "served_synchronous": 0}
+        self._lock = threading.Lock()
+        self._quote = None
+
+    def _lookup(self):
+        # type: () -> Tuple[Union[Quote, None], str]
+        """Return the cached quote and whether it is a hit, stale or a miss."""
+        with self._lock:
+            quote = self._quote
+            age = quote.age if quote is not None else None
+
+            if age is not None and age < self.ttl:
+                outcome = "hit"
+                self.stats["hits"] += 1
+            elif age is not None and age < self.stale_ttl:
+                outcome = "stale"
+                self.stats["stale"] += 1
             else:
-                pass
-
-        except (AttributeError, ValueError, KeyError, IndexError, TypeError) as e:
-            logger.info("Couldn't resolve status_code for slot item: {}".format(slot_item))
-            logger.info(e)
-            slot_values[name] = {
-                "synonym": slot_item.value,
-                "resolved": slot_item.value,
-                "is_validated": False,
-            }
+                self.stats["misses"] += 1
+                self.stats["served_synchronous"] += 1
+                note_cache_outcome("miss")
+                return quote, "miss"
+
+            note_cache_outcome(outcome)
+            if quote.origin == "prefetch":
+                self.stats["served_prefetched"] += 1
+            return quote, outcome
+
+    def _degrade(self, quote, error):
+        # type: (Union[Quote, None], Exception) -> Quote
+        """Fall back to the old quote after a failed refresh, if it is not too old."""
+        if quote is not None and quote.age < self.max_age:
+            logger.warning("Serving {:.0f}s old quote after refresh failed: {}".format(quote.age, error))
+            return quote
+        if quote is not None:
+            raise StaleQuoteError("Newest quote is {:.0f}s old".format(quote.age))
+        raise error
+
+    def get(self):
+        # type: () -> Quote
+        quote, outcome = self._lookup()
+        if outcome == "stale":
+            self.flights.start(self.key, self._revalidate)
+        if outcome != "miss":
+            return quote
+
+        try:
+            return self.flights.do(self.key, self._refresh, self.wait_timeout)
+        except Exception as e:
+            return self._degrade(quote, e)
+
+    async def get_async(self):
+        # type: () -> Tuple[Quote, str]
+        """Return the quote and the cache outcome, awaiting a refresh if needed."""
+        quote, outcome = self._lookup()
+        if outcome == "stale":
+            self.async_flights.start(self.key, self._revalidate_async)
+        if outcome != "miss":
+            return quote, outcome
+
+        try:
+            return await self.async_flights.do(self.key, self._refresh_async, self.wait_timeout), outcome
+        except Exception as e:
+            return self._degrade(quote, e), outcome
+
+    def prefetch(self):
+        # type: () -> Quote
+        """Refresh the quote now, whatever its age, for a scheduled warm-up."""
+        quote = self.flights.do(self.key, lambda: self._refresh("prefetch"))
+
+        with self._lock:
+            self.stats["prefetches"] += 1
+        return quote
+
+    def _refresh(self, origin="request"):
+        # type: (str) -> Quote
+        try:
+            quote = Quote(self.fetch(), time.time(), origin)
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+
+        with self._lock:
+            self._quote = quote
+            self.stats["refreshes"] += 1
+        logger.info("Price cache refreshed: {}".format(self.stats))
+        notify_quote_listeners(quote)
+
+        return quote
+
+    async def prefetch_async(self):
+        # type: () -> Quote
+        quote = await self.async_flights.do(self.key, lambda: self._refresh_async("prefetch"))
+
+        with self._lock:
+            self.stats["prefetches"] += 1
+        return quote
+
+    async def _refresh_async(self, origin="request"):
+        # type: (str) -> Quote
+        try:
+            quote = Quote(await self.fetch_async(), time.time(), origin)
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+
+        with self._lock:
+            self._quote = quote
+            self.stats["refreshes"] += 1
+        logger.info("Price cache refreshed: {}".format(self.stats))
+        notify_quote_listeners(quote)
+
+        return quote
+
+    async def _revalidate_async(self):
+        # type: () -> None
+        try:
+            await self._refresh_async("background")
+        except Exception as e:
+            logger.warning("Background price refresh failed: {}".format(e))
+
+    def _revalidate(self):
+        # type: () -> None
+        try:
+            self._refresh("background")
+        except Exception as e:
+            logger.warning("Background price refresh failed: {}".format(e))
+
+    def invalidate(self):
+        # type: () -> None
+        with self._lock:
+            self._quote = None
+
+class QuorumError(Exception):
+    """Raised when too few price sources answered before the deadline."""
+
+class PriceSource(object):
+    """One exchange or provider, with a circuit breaker of its own."""
+    def __init__(self, name):
+        # type: (str) -> None
+        self.name = name
+        self.url = price_source_url(name)
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET)
+
+    def _url(self, cryptos, fiats):
+        # type: (List[str], List[str]) -> str
+        return self.url.format(",".join(cryptos), ",".join(fiats), CRYPTOCOMPARE_API_KEY)
+
+    def fetch(self, cryptos, fiats, deadline):
+        # type: (List[str], List[str], float) -> QuoteMatrix
+        # No retries: the other sources are the fallback.
+        result = http_get(self._url(cryptos, fiats), self.breaker, retries=0,
+                          timeout=(min(HTTP_CONNECT_TIMEOUT, deadline), deadline))
+        return QuoteMatrix.from_json(result, cryptos, fiats)
+
+    async def fetch_async(self, cryptos, fiats):
+        # type: (List[str], List[str]) -> QuoteMatrix
+        result = await async_http_get(self._url(cryptos, fiats), self.breaker, retries=0)
+        return QuoteMatrix.from_json(result, cryptos, fiats)
+
+def _median(values):
+    # type: (List[float]) -> float
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+class QuoteAggregator(object):
+    """Fetch from every source at once and combine the first answers that agree.
+
+    Per pair, prices further than `tolerance` from the median are dropped
+    and the median of the rest is the price. As soon as `quorum` sources
+    agree on every pair, the slower ones are no longer waited for, so a
+    fetch usually takes as long as the quorum-th fastest source. When the
+    answers disagree, more sources are waited for, up to `deadline`
+    seconds; after that the median of whatever answered is used, as long
+    as at least `quorum` sources did.
+    """
+    def __init__(self, sources, quorum, deadline, tolerance):
+        # type: (List[PriceSource], int, float, float) -> None
+        if not 1 <= quorum <= len(sources):
+            raise ValueError("Quorum must be between 1 and {}, got {}".format(len(sources), quorum))
+        self.sources = sources
+        self.quorum = quorum
+        self.deadline = deadline
+        self.tolerance = tolerance
+        self.stats = {"fetches": 0, "quorum_errors": 0, "disagreements": 0, "outliers": 0}
+        self.source_stats = {source.name: {"answers": 0, "errors": 0} for source in sources}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+
+    def _executor(self):
+        # type: () -> ThreadPoolExecutor
+        # Stragglers keep their threads past the quorum, so there is room for
+        # the next fetch. A forked child gets a pool of its own.
+        if self._pool is None or self._pool_pid != os.getpid():
+            from concurrent.futures import ThreadPoolExecutor
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=4 * len(self.sources), thread_name_prefix="price-source")
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _collect(self, source, future):
+        # type: (PriceSource, Any) -> Union[QuoteMatrix, None]
+        try:
+            matrix = future.result()
+        except Exception as e:
+            logger.warning("Price source {} failed: {}".format(source.name, e))
+            with self._lock:
+                self.source_stats[source.name]["errors"] += 1
+            return None
+        with self._lock:
+            self.source_stats[source.name]["answers"] += 1
+        return matrix
+
+    def fetch(self, cryptos, fiats):
+        # type: (List[str], List[str]) -> QuoteMatrix
+        from concurrent.futures import wait, FIRST_COMPLETED
+
+        give_up = time.monotonic() + self.deadline
+        pool = self._executor()
+        pending = {pool.submit(source.fetch, cryptos, fiats, self.deadline): source for source in self.sources}
+        answers = []
+        combined = None
+        while pending:
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                matrix = self._collect(pending.pop(future), future)
+                if matrix is not None:
+                    answers.append(matrix)
+            if len(answers) >= self.quorum:
+                combined = self.combine(answers, cryptos, fiats)
+                if combined[2]:
+                    break
+
+        return self._finish(answers, combined, pending.values())
+
+    async def fetch_async(self, cryptos, fiats):
+        # type: (List[str], List[str]) -> QuoteMatrix
+        import asyncio
+
+        give_up = time.monotonic() + self.deadline
+        pending = {asyncio.ensure_future(source.fetch_async(cryptos, fiats)): source for source in self.sources}
+        answers = []
+        combined = None
+        try:
+            while pending:
+                remaining = give_up - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    matrix = self._collect(pending.pop(task), task)
+                    if matrix is not None:
+                        answers.append(matrix)
+                if len(answers) >= self.quorum:
+                    combined = self.combine(answers, cryptos, fiats)
+                    if combined[2]:
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return self._finish(answers, combined, pending.values())
+
+    def combine(self, answers, cryptos, fiats):
+        # type: (List[QuoteMatrix], List[str], List[str]) -> Tuple[QuoteMatrix, int, bool]
+        """Return the per-pair median of the answers after dropping outliers, the
+        number of outliers, and whether `quorum` answers agreed on every pair."""
+        matrix = QuoteMatrix(cryptos, fiats)
+        outliers = 0
+        settled = True
+        for i in range(len(matrix.prices)):
+            prices = [answer.prices[i] for answer in answers if answer.prices[i] == answer.prices[i]]
+            if not prices:
+                continue
+            median = _median(prices)
+            agreeing = [price for price in prices if abs(price - median) <= self.tolerance * median]
+            outliers += len(prices) - len(agreeing)
+            settled = settled and len(agreeing) >= self.quorum
+            matrix.prices[i] = _median(agreeing) if agreeing else median
+        return matrix, outliers, settled
+
+    def _finish(self, answers, combined, late):
+        # type: (List[QuoteMatrix], Union[Tuple[QuoteMatrix, int, bool], None], Iterable[PriceSource]) -> QuoteMatrix
+        with self._lock:
+            self.stats["fetches"] += 1
+            if combined is None:
+                self.stats["quorum_errors"] += 1
+                raise QuorumError("{} of {} price sources answered, {} needed; no answer from {}".format(
+                    len(answers), len(self.sources), self.quorum, ", ".join(source.name for source in late) or "none"))
+
+            matrix, outliers, settled = combined
+            self.stats["outliers"] += outliers
+            if not settled:
+                self.stats["disagreements"] += 1
+        if not settled:
+            logger.warning("Price sources disagree, using the median of {} answers".format(len(answers)))
+        elif outliers:
+            logger.info("Dropped {} outlying prices".format(outliers))
+        return matrix
+
+price_aggregator = None
+if len(PRICE_SOURCES) > 1:
+    price_aggregator = QuoteAggregator([PriceSource(source) for source in PRICE_SOURCES], PRICE_QUORUM,
+                                       PRICE_SOURCE_DEADLINE, PRICE_OUTLIER_TOLERANCE)
+
+def fetch_prices(cryptos=None, fiats=None):
+    """Fetch all configured pairs with one multi-symbol request, or from every source when there are several."""
+    # type: (List[str], List[str]) -> QuoteMatrix
+    cryptos = cryptos or CRYPTO_SYMBOLS
+    fiats = fiats or FIAT_SYMBOLS
+    if price_aggregator is not None:
+        with timed("upstream"):
+            return price_aggregator.fetch(cryptos, fiats)
+    result = http_get(PRICE_API_URL.format(",".join(cryptos), ",".join(fiats), CRYPTOCOMPARE_API_KEY))
+    return QuoteMatrix.from_json(result, cryptos, fiats)
+
+async def fetch_prices_async(cryptos=None, fiats=None):
+    """Same as `fetch_prices`, on the event loop."""
+    # type: (List[str], List[str]) -> QuoteMatrix
+    cryptos = cryptos or CRYPTO_SYMBOLS
+    fiats = fiats or FIAT_SYMBOLS
+    if price_aggregator is not None:
+        return await price_aggregator.fetch_async(cryptos, fiats)
+    result = await async_http_get(PRICE_API_URL.format(",".join(cryptos), ",".join(fiats), CRYPTOCOMPARE_API_KEY))
+    return QuoteMatrix.from_json(result, cryptos, fiats)
+
+# Under several workers on one host, a refresher process keeps a shared
+# quote table fresh (see quotetable.py) and the workers read it instead of
+# each fetching on their own.
+QUOTE_TABLE_PATH = os.environ.get("QUOTE_TABLE_PATH")
+QUOTE_REFRESH_INTERVAL = float(os.environ.get("QUOTE_REFRESH_INTERVAL", str(PRICE_CACHE_TTL)))
+
+class SharedQuotes(object):
+    """Quotes read lock-free from a quote table another process writes.
+
+    The table is opened on first use, and a Quote is only rebuilt when the
+    table's sequence number has moved on.
+    """
+    def __init__(self, path):
+        # type: (str) -> None
+        self.path = path
+        self._reader = None
+        self._seq = None
+        self._quote = None
+        self._stuck_seq = None
+
+    def get(self):
+        # type: () -> Union[Quote, None]
+        """Return the table's quote, or None if there is no table yet."""
+        from quotetable import QuoteTableReader, QuoteTableError
+
+        reader = self._reader
+        if reader is None:
+            try:
+                reader = self._reader = QuoteTableReader(self.path)
+            except (OSError, QuoteTableError):
+                return None
+
+        if reader.seq == self._seq:
+            return self._quote
 
-    return slot_values
+        try:
+            result = reader.read()
+        except QuoteTableError as e:
+            # A refresher that died mid-write leaves the table unreadable
+            # until the next one publishes; the price cache takes over.
+            if self._stuck_seq != reader.seq:
+                self._stuck_seq = reader.seq
+                logger.warning("Not reading the quote table: {}".format(e))
+            return None
+        if result is None:
+            return None
+        seq, fetched_at, prices = result
+        quote = Quote(QuoteMatrix(reader.cryptos, reader.fiats, prices), fetched_at, "table")
+        self._quote, self._seq = quote, seq
+        return quote
+
+price_flights = SingleFlight()
+price_cache = PriceCache(fetch_prices, PRICE_CACHE_TTL, PRICE_STALE_TTL, PRICE_MAX_AGE,
+                         key=(tuple(CRYPTO_SYMBOLS), tuple(FIAT_SYMBOLS)), flights=price_flights,
+                         wait_timeout=PRICE_WAIT_TIMEOUT, fetch_async=fetch_prices_async,
+                         shared=SharedQuotes(QUOTE_TABLE_PATH) if QUOTE_TABLE_PATH else None)
+
+def get_table_quote():
+    """Return the shared table's quote if there is one young enough to serve."""
+    # type: () -> Union[Quote, None]
+    shared = price_cache.shared
+    if shared is None:
+        return None
+    quote = shared.get()
+    if quote is None or quote.age >= PRICE_STALE_TTL:
+        return None
+    note_cache_outcome("table")
+    return quote
+
+def refresh_quote_table(writer, interval=QUOTE_REFRESH_INTERVAL, stop=None):
+    """Publish fresh prices to a quote table every `interval` seconds until `stop` is set.
+
+    With QUOTE_STREAM_URL set, every tick from the stream is published instead.
+    """
+    # type: (QuoteTableWriter, float, threading.Event) -> None
+    stop = stop or threading.Event()
+    if QUOTE_STREAM_URL:
+        stream = QuoteStream(QUOTE_STREAM_URL, writer.cryptos, writer.fiats, "refresher",
+                             on_update=lambda matrix, at: writer.publish(matrix.prices, at))
+        stream.run(stop)
+        return
+
+    while not stop.is_set():
+        started = time.time()
+        try:
+            quote = Quote(fetch_prices(), time.time(), "refresher")
+            writer.publish(quote.prices.prices, quote.fetched_at)
+            notify_quote_listeners(quote)
+        except Exception as e:
+            logger.warning("Quote table refresh failed: {}".format(e))
+        stop.wait(max(0.0, interval - (time.time() - started)))
+
+# On a long-lived host, prices can come from a streaming ticker feed instead
+# of being pulled on demand.
+QUOTE_STREAM_URL = os.environ.get("QUOTE_STREAM_URL")
+QUOTE_STREAM_BACKOFF_MAX = float(os.environ.get("QUOTE_STREAM_BACKOFF_MAX", "30"))
+QUOTE_STREAM_NOTIFY_INTERVAL = 1.0
+
+_decode_json = json.JSONDecoder().raw_decode
+
+class QuoteStream(object):
+    """Live prices from a streaming ticker feed, kept in an in-memory matrix.
+
+    A thread holds one streaming GET open to `url`. The feed sends one
+    JSON tick per line, {"crypto": "BTC", "fiat": "USD", "price": 9000.5},
+    plain or as server-sent events, in chunked transfer encoding. Blank
+    lines and SSE comments are heartbeats. On every (re)connect the matrix
+    is first seeded with a regular fetch, so pairs that rarely tick still
+    have a price. Reconnects back off exponentially with full jitter, and
+    a feed silent for PRICE_CACHE_TTL seconds counts as dropped.
+
+    `on_update(matrix, at)` is called on the stream's thread after every
+    line; quote listeners are notified at most once a second.
+    """
+    def __init__(self, url, cryptos, fiats, origin="stream", on_update=None):
+        # type: (str, List[str], List[str], str, Union[Callable[[QuoteMatrix, float], Any], None]) -> None
+        self.url = url
+        self.matrix = QuoteMatrix(cryptos, fiats)
+        self.origin = origin
+        self.on_update = on_update
+        self.connected = False
+        self.updated_at = 0.0
+        self.stats = {"connects": 0, "ticks": 0, "heartbeats": 0, "ignored": 0, "errors": 0}
+        self._version = 0
+        self._quote = None
+        self._quote_version = None
+        self._notified_at = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        # type: () -> QuoteStream
+        """Start the stream thread unless it is running. A forked child starts its own."""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self.run, name="quote-stream", daemon=True)
+                    self._thread.start()
+        return self
+
+    def stop(self):
+        # type: () -> None
+        self._stop.set()
+
+    def get(self):
+        # type: () -> Union[Quote, None]
+        """Return the live quote, or None while the stream is down or silent."""
+        if not self.connected or time.time() - self.updated_at >= PRICE_CACHE_TTL:
+            return None
+        if self._quote_version != self._version:
+            # Copying the array holds the GIL, so no tick lands halfway.
+            version = self._version
+            quote = Quote(QuoteMatrix(self.matrix.cryptos, self.matrix.fiats, array("d", self.matrix.prices)),
+                          self.updated_at, self.origin)
+            self._quote, self._quote_version = quote, version
+        return self._quote
+
+    def apply(self, line):
+        # type: (bytes) -> None
+        """Apply one line of the feed."""
+        if line[:5] == b"data:":
+            line = line[5:].strip()
+        if not line or line[:1] == b":":
+            self.stats["heartbeats"] += 1
+        else:
+            try:
+                # raw_decode on text skips the encoding sniffing json.loads does on bytes.
+                tick = _decode_json(line.decode("utf-8"))[0]
+                self.matrix.set(tick["crypto"], tick["fiat"], float(tick["price"]))
+                self.stats["ticks"] += 1
+            except (ValueError, KeyError, TypeError):
+                self.stats["ignored"] += 1
+                return
+
+        self.updated_at = time.time()
+        self._version += 1
+        if self.on_update is not None:
+            self.on_update(self.matrix, self.updated_at)
+        if self.updated_at - self._notified_at >= QUOTE_STREAM_NOTIFY_INTERVAL and _quote_listeners:
+            self._notified_at = self.updated_at
+            notify_quote_listeners(Quote(QuoteMatrix(self.matrix.cryptos, self.matrix.fiats, array("d", self.matrix.prices)),
+                                         self.updated_at, self.origin))
+
+    def _seed(self):
+        # type: () -> None
+        try:
+            fresh = fetch_prices(self.matrix.cryptos, self.matrix.fiats)
+        except Exception as e:
+            logger.warning("Could not seed the quote stream, waiting for ticks: {}".format(e))
+            return
+        for i, price in enumerate(fresh.prices):
+            if price == price:
+                self.matrix.prices[i] = price
+
+    def run(self, stop=None):
+        # type: (Union[threading.Event, None]) -> None
+        """Stream until `stop` (or `self.stop()`) is set, reconnecting as needed."""
+        import requests
+
+        stop = stop or self._stop
+        session = requests.Session()
+        attempt = 0
+        while not stop.is_set():
+            response = None
+            try:
+                self._seed()
+                response = session.get(self.url, stream=True, timeout=(HTTP_CONNECT_TIMEOUT, PRICE_CACHE_TTL))
+                response.raise_for_status()
+                self.stats["connects"] += 1
+                self.connected = True
+                self.updated_at = time.time()
+                self._version += 1
+                logger.info("Quote stream connected to {}".format(self.url.split("?")[0]))
+
+                for line in response.iter_lines():
+                    self.apply(line)
+                    attempt = 0
+                    if stop.is_set():
+                        break
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("Quote stream dropped: {}".format(e))
+            finally:
+                self.connected = False
+                if response is not None:
+                    response.close()
+
+            if not stop.is_set():
+                attempt += 1
+                stop.wait(random.uniform(0, min(QUOTE_STREAM_BACKOFF_MAX, HTTP_BACKOFF * 2 ** attempt)))
+        session.close()
+
+quote_stream = QuoteStream(QUOTE_STREAM_URL, CRYPTO_SYMBOLS, FIAT_SYMBOLS) if QUOTE_STREAM_URL else None
+
+def get_stream_quote():
+    """Return the live stream's quote, starting the stream on first use."""
+    # type: () -> Union[Quote, None]
+    if quote_stream is None:
+        return None
+    quote = quote_stream.start().get()
+    if quote is not None:
+        note_cache_outcome("stream")
+    return quote
+
+def get_local_quote():
+    """Return a quote that needs no network I/O, from the shared table or the live stream."""
+    # type: () -> Union[Quote, None]
+    return get_table_quote() or get_stream_quote()
+
+# Every fetched quote can be appended to a local price history (see
+# pricehistory.py), which answers questions about past prices without an
+# upstream call.
+PRICE_HISTORY_PATH = os.environ.get("PRICE_HISTORY_PATH")
+
+class PriceHistoryRecorder(object):
+    """A quote listener that appends every quote to the price history.
+
+    Only one process may write a history directory; the others log it once
+    and leave it to the writer. Where a shared quote table exists, its
+    refresher is the writer and the workers' own fetches are not recorded.
+    """
+    def __init__(self, path):
+        # type: (str) -> None
+        self.path = path
+        self._writer = None
+        self._disabled = False
+        self._lock = threading.Lock()
+
+    def __call__(self, quote):
+        # type: (Quote) -> None
+        if self._disabled or (price_cache.shared is not None and quote.origin != "refresher"):
+            return
+
+        with self._lock:
+            if self._writer is None:
+                from pricehistory import PriceHistoryWriter, PriceHistoryError
+                try:
+                    self._writer = PriceHistoryWriter(self.path)
+                except PriceHistoryError as e:
+                    logger.info("Not recording the price history: {}".format(e))
+                    self._disabled = True
+                    return
+            self._writer.record(quote.prices.cryptos, quote.prices.fiats, quote.prices.prices, quote.fetched_at)
+
+_price_history = None
+
+def get_price_series(crypto, fiat):
+    """Return the recorded history of a pair, or None if there is none."""
+    # type: (str, str) -> Union[PriceSeries, None]
+    global _price_history
+    if not PRICE_HISTORY_PATH:
+        return None
+    if _price_history is None:
+        from pricehistory import PriceHistory
+        _price_history = PriceHistory(PRICE_HISTORY_PATH)
+    return _price_history.series(crypto, fiat)
+
+if PRICE_HISTORY_PATH:
+    add_quote_listener(PriceHistoryRecorder(PRICE_HISTORY_PATH))
+
+# Users' price alerts (see pricealerts.py) are checked against every
+# fetched quote, and the ones it crosses are POSTed to ALERT_WEBHOOK_URL in
+# batches for whatever sends the notifications. PRICE_ALERTS_PATH must be
+# a directory every process taking requests can reach.
+PRICE_ALERTS_PATH = os.environ.get("PRICE_ALERTS_PATH")
+ALERT_WEBHOOK_URL = os.environ.get("ALERT_WEBHOOK_URL")
+ALERT_BATCH_SIZE = int(os.environ.get("ALERT_BATCH_SIZE", "100"))
+ALERT_BATCH_INTERVAL = float(os.environ.get("ALERT_BATCH_INTERVAL", "1.0"))
+
+def deliver_alerts(alerts):
+    # type: (List[Alert]) -> None
+    """Send a batch of fired alerts to the webhook in one POST, or log it without one."""
+    batch = [{"id": alert.id, "userId": alert.user_id, "crypto": alert.crypto, "fiat": alert.fiat,
+              "direction": alert.direction, "threshold": alert.threshold} for alert in alerts]
+    if not ALERT_WEBHOOK_URL:
+        logger.info("%s", StructuredMessage({"alerts": batch}, event="priceAlerts", count=len(batch)))
+        return
+    response = get_http_session().post(ALERT_WEBHOOK_URL, json={"alerts": batch},
+                                       timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    response.raise_for_status()
+
+class PriceAlertEvaluator(object):
+    """A quote listener that fires the price alerts each quote crosses.
+
+    As with the price history, one process evaluates a directory and the
+    others log it once and leave it to that one. Quotes are handed to a
+    background thread, so a refresh (or the event loop it ran on) never
+    waits on the alert book. Each quote is evaluated as a move from the
+    newest quote evaluated before it; one fetched earlier that arrives late
+    is skipped. Fired alerts go to `sink`, by default a NotificationBatcher
+    posting them to the webhook.
+    """
+    def __init__(self, path, sink=None):
+        # type: (str, Callable[[List[Alert]], None]) -> None
+        self.path = path
+        self.sink = sink
+        self._engine = None
+        self._disabled = False
+        self._previous = None  # type: Union[Quote, None]
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __call__(self, quote):
+        # type: (Quote) -> None
+        if self._disabled or (price_cache.shared is not None and quote.origin != "refresher"):
+            return
+        self._start()
+        self._queue.put(quote)
+
+    def _start(self):
+        # type: () -> None
+        """Start the evaluation thread unless it is running. A forked child starts its own."""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="price-alerts", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        # type: () -> None
+        while True:
+            quote = self._queue.get()
+            if quote is None:
+                return
+            try:
+                self.evaluate(quote)
+            except Exception as e:
+                logger.warning("Price alert evaluation failed: {}".format(e))
+
+    def _open(self):
+        # type: () -> bool
+        if self._engine is None and not self._disabled:
+            from pricealerts import NotificationBatcher, PriceAlertEngine, PriceAlertError
+            sink = self.sink or NotificationBatcher(
+                deliver_alerts, ALERT_BATCH_SIZE, ALERT_BATCH_INTERVAL,
+                on_error=lambda e: logger.warning("Price alert delivery failed: {}".format(e)))
+            try:
+                self._engine = PriceAlertEngine(self.path, sink)
+            except PriceAlertError as e:
+                logger.info("Not evaluating price alerts: {}".format(e))
+                self._disabled = True
+        return self._engine is not None
+
+    def evaluate(self, quote):
+        # type: (Quote) -> int
+        """Fire the alerts crossed since the previous quote and return how many fired."""
+        if not self._open():
+            return 0
+        previous = self._previous
+        if previous is not None and quote.fetched_at <= previous.fetched_at:
+            return 0
+        self._previous = quote
+
+        # The first quote, or one for other pairs, only sets where prices stand.
+        prices = quote.prices
+        if previous is None or (previous.prices.cryptos, previous.prices.fiats) != (prices.cryptos, prices.fiats):
+            return 0
+        fired = self._engine.evaluate(prices.cryptos, prices.fiats, previous.prices.prices, prices.prices)
+        if fired:
+            logger.info("{} price alerts fired".format(fired))
+        return fired
+
+    def close(self, timeout=None):
+        # type: (Union[float, None]) -> None
+        """Evaluate what is queued, then stop the thread."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+_alert_log = None
+
+def get_alert_log():
+    """Return the log new price alerts are appended to, or None if alerts are off."""
+    # type: () -> Union[AlertLog, None]
+    global _alert_log
+    if not PRICE_ALERTS_PATH:
+        return None
+    if _alert_log is None:
+        from pricealerts import AlertLog
+        _alert_log = AlertLog(PRICE_ALERTS_PATH)
+    return _alert_log
+
+if PRICE_ALERTS_PATH:
+    add_quote_listener(PriceAlertEvaluator(PRICE_ALERTS_PATH))
+
+class PrefetchedQuote(object):
+    """The quote (or the error) an async caller got before dispatching."""
+    __slots__ = ("quote", "error", "outcome", "wait_ms")
+
+    def __init__(self, quote, error, outcome, wait_ms):
+        # type: (Union[Quote, None], Union[Exception, None], str, float) -> None
+        self.quote = quote
+        self.error = error
+        self.outcome = outcome
+        self.wait_ms = wait_ms
+
+def get_quote():
+    """Return the quote for the current request.
+
+    Under `async_lambda_handler` it was fetched before dispatch, so the
+    handlers never block on the network. Otherwise it comes from the shared
+    quote table or the live stream when there is one, and from this
+    process's cache if not.
+    """
+    # type: () -> Quote
+    prefetched = getattr(_request_context, "prefetched", None)
+    if prefetched is None:
+        return get_local_quote() or price_cache.get()
+
+    note_cache_outcome(prefetched.outcome)
+    timings = current_timings()
+    if timings is not None and prefetched.outcome == "miss":
+        timings.add("upstream", prefetched.wait_ms)
+    if prefetched.error is not None:
+        raise prefetched.error
+    return prefetched.quote
+
+class UnsupportedPairError(Exception):
+    """Raised when the requested coin or currency is not configured."""
+
+def _normalize(text):
+    # type: (str) -> str
+    """Lowercase and drop everything but letters and digits: "U.S.D." -> "usd"."""
+    return "".join(c for c in text.lower() if c.isalnum())
+
+class ResolvedSlots(object):
+    """The slots of a conversion request, with the coin and currency as symbols."""
+    __slots__ = ("crypto", "fiat", "integer", "decimal", "spoken_crypto", "spoken_fiat", "date")
+
+    def __init__(self, crypto, fiat, integer, decimal, spoken_crypto, spoken_fiat, date=None):
+        # type: (Union[str, None], Union[str, None], Union[str, None], Union[str, None], Union[str, None], Union[str, None], Union[str, None]) -> None
+        self.crypto = crypto
+        self.fiat = fiat
+        self.integer = integer
+        self.decimal = decimal
+        self.spoken_crypto = spoken_crypto
+        self.spoken_fiat = spoken_fiat
+        self.date = date
+
+    def pair(self):
+        # type: () -> Tuple[str, str]
+        """Return the (crypto, fiat) symbols, raising UnsupportedPairError unless both are configured."""
+        if self.crypto not in CRYPTO_SYMBOLS or self.fiat not in FIAT_SYMBOLS:
+            raise UnsupportedPairError("{}/{}".format(self.spoken_crypto or "", self.spoken_fiat or ""))
+        return self.crypto, self.fiat
+
+def _matched_value(slot):
+    # type: (Slot) -> Union[Any, None]
+    """Return the value entity resolution matched for a slot, or None."""
+    resolutions = slot.resolutions
+    if resolutions is None or not resolutions.resolutions_per_authority:
+        return None
+    authority = resolutions.resolutions_per_authority[0]
+    if authority.status is None or authority.status.code != StatusCode.ER_SUCCESS_MATCH or not authority.values:
+        return None
+    return authority.values[0].value
+
+class SlotResolver(object):
+    """Resolve the crypto and fiat slots to symbols, compiled once at cold start.
+
+    Every value name, id and synonym of the slot types is normalized into
+    one dictionary per slot. An entity resolution match is looked up there
+    by id or name; without one, the spoken value is, so "bit coin" or
+    "U.S.D." resolve without another dialog turn.
+
+    A type may be listed more than once, e.g. as deployed and as generated
+    from the registry; its values are merged and the first listing wins
+    where they disagree. A value without an id takes the symbol of any
+    value with an id that shares one of its names.
+    """
+    SLOT_TYPES = {"crypto": "cryptoCoin", "fiat": "fiatCoin"}
+
+    def __init__(self, slot_types):
+        # type: (List[Dict[str, Any]]) -> None
+        self.indexes = {}
+        self.canonical = {}
+        for slot_name, type_name in self.SLOT_TYPES.items():
+            values = []
+            for slot_type in slot_types:
+                if slot_type["name"] == type_name:
+                    for value in slot_type.get("values", []):
+                        name = value["name"]["value"]
+                        values.append((value.get("id"), name, [name] + value["name"].get("synonyms", [])))
+            symbols = {}
+            for value_id, _, aliases in values:
+                if value_id:
+                    for alias in [value_id] + aliases:
+                        symbols.setdefault(_normalize(alias), value_id)
+
+            index = self.indexes[slot_name] = {}
+            for value_id, name, aliases in values:
+                symbol = value_id or next((symbols[_normalize(alias)] for alias in aliases
+                                           if _normalize(alias) in symbols), name)
+                self.canonical.setdefault(symbol, name)
+                for alias in [symbol] + aliases:
+                    index.setdefault(_normalize(alias), symbol)
+
+    @classmethod
+    def from_interaction_model(cls, file_path):
+        # type: (str) -> SlotResolver
+        """Compile from the interaction model, or from the currency registry if it is not deployed."""
+        try:
+            with open(file_path) as f:
+                slot_types = json.load(f)["interactionModel"]["languageModel"]["types"]
+        except (IOError, ValueError, KeyError) as e:
+            logger.warning("Resolving slots from the registry, could not read {}: {}".format(file_path, e))
+            slot_types = []
+        return cls(slot_types + build_slot_types(list(CRYPTO_CURRENCIES), list(FIAT_CURRENCIES)))
+
+    def lookup(self, slot_name, slot):
+        # type: (str, Slot) -> Union[str, None]
+        """Return the symbol for a crypto or fiat slot, or None."""
+        if slot is None:
+            return None
+        index = self.indexes[slot_name]
+
+        value = _matched_value(slot)
+        if value is not None:
+            symbol = index.get(_normalize(value.id or "")) or index.get(_normalize(value.name or ""))
+            if symbol is not None:
+                return symbol
+
+        if slot.value:
+            return index.get(_normalize(slot.value))
+        return None
+
+    def resolve(self, slots):
+        # type: (Dict[str, Slot]) -> ResolvedSlots
+        slots = slots or {}
+        crypto = slots.get("crypto")
+        fiat = slots.get("fiat")
+        integer = slots.get("integer")
+        decimal = slots.get("decimal")
+        date_slot = slots.get("date")
+
+        return ResolvedSlots(self.lookup("crypto", crypto), self.lookup("fiat", fiat),
+                             integer.value if integer is not None else None,
+                             decimal.value if decimal is not None else None,
+                             crypto.value if crypto is not None else None,
+                             fiat.value if fiat is not None else None,
+                             date_slot.value if date_slot is not None else None)
+
+    def canonicalize(self, intent):
+        # type: (Intent) -> Intent
+        """Replace crypto/fiat values that only we could resolve with their canonical value, in place."""
+        for slot_name in self.SLOT_TYPES:
+            slot = (intent.slots or {}).get(slot_name)
+            if slot is None or not slot.value or _matched_value(slot) is not None:
+                # Alexa already resolved it.
+                continue
+            symbol = self.lookup(slot_name, slot)
+            if symbol is not None and slot.value != self.canonical[symbol]:
+                slot.value = self.canonical[symbol]
+        return intent
+
+def _spoken_list(names):
+    # type: (List[str]) -> str
+    if len(names) == 1:
+        return names[0]
+    return "{} or {}".format(", ".join(names[:-1]), names[-1])
+
+def describe_quote_age(quote):
+    """Return a spoken note on the quote age once it is worth mentioning."""
+    # type: (Quote) -> str
+    age = quote.age
+    if age < PRICE_AGE_ANNOUNCE:
+        return ""
+    if age < 120:
+        return " Heads up, this price is about a minute old."
+    return " Heads up, this price is about {} minutes old.".format(int(age // 60))
+
+def stale_quote_speech(crypto, fiat):
+    # type: (Union[str, None], Union[str, None]) -> str
+    """Apologize for having no fresh price, naming the coin and currency when they are known."""
+    coin = CRYPTO_CURRENCIES[crypto]["name"] if crypto in CRYPTO_CURRENCIES else "crypto"
+    money = " in {}".format(FIAT_CURRENCIES[fiat]["name"]) if fiat in FIAT_CURRENCIES else ""
+    return "Sorry, I can't get a fresh {} price{} right now. Please ask me again in a minute.".format(coin, money)
 
 def get_random_yes_no_question():
     """Return random question for YES/NO answering."""
@@ -115,12 +1574,623 @@ def get_random_goodbye():
                 "It's been a while since I checked my portfolio. I'll do that now! Adios!"]
     return random.choice(goodbyes)
 
+WELCOMES = ["What a <prosody volume='loud'>great</prosody> day for crypto! How can I help?",
+            "<prosody volume='x-loud'>Hello</prosody>, <prosody volume='loud'>fellow</prosody> cryptopian! How can I assist?",
+            "<prosody volume='x-loud'>Hi</prosody> there! Not a day without crypto, am I right? How can I help?",
+            "Well <prosody volume='loud'>hello</prosody> <prosody volume='loud'>there</prosody>, my sweet little crypto nerd! How can I assist?",
+            "<prosody volume='x-loud'>Greetings</prosody> from planet crypto! How can I help?",
+            "<prosody volume='x-loud'>Bonjour</prosody>, my crypto friend! How can I assist?",
+            "<prosody volume='x-loud'>Howdy</prosody>, my precious <prosody volume='loud'>crypto</prosody> geek! How can I help?",
+            "<prosody volume='x-loud'>Greetings</prosody>, my <prosody volume='loud'>crypto</prosody> comrade! How can I assist?",
+            "Look who it <prosody volume='loud'>is</prosody>, my crypto buddy! How can I help?",
+            "<prosody volume='x-loud'>Cheers</prosody>, my <prosody volume='loud'>crypto</prosody> soul mate! How can I assist?",
+            "<prosody volume='x-loud'>Hello</prosody>, crypto partner! Nice to hear you! How can I help?",
+            "<prosody volume='x-loud'>Hey!</prosody> Your crypto cousin here! How can I assist?",
+            "<prosody volume='x-loud'>Hola</prosody>, my dearest crypto amigo! How can I help?",
+            "<prosody volume='x-loud'>Ciao</prosody>, my beloved <prosody volume='loud'>crypto</prosody> novice! How can I assist?",
+            "<prosody volume='x-loud'>Aloha</prosody>, my cherished <prosody volume='loud'>crypto</prosody> addict! How can I help?",
+            "<prosody volume='x-loud'>Welcome</prosody>, my dear <prosody volume='loud'>crypto</prosody> buddy! How can I assist?",
+            "It's great to hear you, my sweet crypto geek! How can I help?",
+            "So nice to hear you, my lovely <prosody volume='loud'>crypto</prosody> noob! How can I assist?"]
+
+HELP_SPEECH = "Well, my little crypto friend, you basically have two options. You can ask me, for instance, 'How much is 2.5 Bitcoin in U.S. dollars?', or, something like 'How many Bitcoin can I buy for 100 Euro?'. So, how can I help you?"
+
+APPLAUSE = "<audio src='soundbank://soundlibrary/human/amzn_sfx_crowd_applause_03'/>"
+
+def how_much_speech(crypto, fiat, crypto_units, quote):
+    # type: (str, str, int, Quote) -> Tuple[str, str, str]
+    """Return the speech, the fiat result and the crypto amount for a HowMuch answer."""
+    fiat_units = conversion.QuoteConverter(quote.price(crypto, fiat)).to_fiat(crypto_units)
+
+    number = conversion.format_amount(crypto_units, conversion.CRYPTO_DECIMALS)
+    result = conversion.format_fixed(fiat_units, conversion.FIAT_DECIMALS, 1)
+
+    speech = "{} {} is worth {} {}.{} {}".format(number, CRYPTO_CURRENCIES[crypto]["name"], result, FIAT_CURRENCIES[fiat]["name"], describe_quote_age(quote), APPLAUSE)
+    return speech, result, number
+
+def how_many_speech(crypto, fiat, fiat_units, quote):
+    # type: (str, str, int, Quote) -> Tuple[str, str, str]
+    """Return the speech, the crypto result and the fiat amount for a HowMany answer."""
+    coin = CRYPTO_CURRENCIES[crypto]
+    money = FIAT_CURRENCIES[fiat]
+    crypto_units = conversion.QuoteConverter(quote.price(crypto, fiat)).to_crypto(fiat_units)
+
+    number = conversion.format_amount(fiat_units, conversion.FIAT_DECIMALS)
+
+    if crypto_units < 10 ** conversion.CRYPTO_DECIMALS:
+        amount = conversion.format_amount(crypto_units, conversion.CRYPTO_DECIMALS)
+
+        if coin["unit"]:
+            speech = "For {} {} you can buy {} {}, or, to be more precise, {} {}.{} {}".format(number, money["amount_name"], amount, coin["name"], crypto_units, coin["unit"], describe_quote_age(quote), APPLAUSE)
+        else:
+            speech = "For {} {} you can buy {} {}.{} {}".format(number, money["amount_name"], amount, coin["name"], describe_quote_age(quote), APPLAUSE)
+
+    else:
+        amount = conversion.format_fixed(crypto_units, conversion.CRYPTO_DECIMALS, 3, strip=True)
+        speech = "For {} {} you can buy approximately {} {}.{} {}".format(number, money["amount_name"], amount, coin["name"], describe_quote_age(quote), APPLAUSE)
+
+    return speech, amount, number
+
+def parse_date_slot(value, now=None):
+    # type: (str, Union[float, None]) -> Union[Tuple[int, int, str, str], None]
+    """Turn an AMAZON.DATE value into (start, end, kind, spoken), in UTC epoch seconds.
+
+    Days, weeks, weekends, months and years are understood; decades,
+    seasons and anything else return None.
+    """
+    today = datetime.fromtimestamp(now or time.time(), timezone.utc).date()
+    parts = value.split("-")
+    try:
+        if value == "PRESENT_REF":
+            kind, first, last = "day", today, today
+        elif len(parts) == 1 and len(value) == 4 and value.isdigit():
+            kind, first, last = "year", date(int(value), 1, 1), date(int(value), 12, 31)
+        elif len(parts) == 2 and parts[1].isdigit():
+            first = date(int(parts[0]), int(parts[1]), 1)
+            kind, last = "month", (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        elif len(parts) in (2, 3) and parts[1].startswith("W"):
+            monday = date.fromisocalendar(int(parts[0]), int(parts[1][1:]), 1)
+            if len(parts) == 3 and parts[2] == "WE":
+                kind, first, last = "weekend", monday + timedelta(days=5), monday + timedelta(days=6)
+            elif len(parts) == 2:
+                kind, first, last = "week", monday, monday + timedelta(days=6)
+            else:
+                return None
+        elif len(parts) == 3 and all(part.isdigit() for part in parts):
+            first = last = date(int(parts[0]), int(parts[1]), int(parts[2]))
+            kind = "day"
+        else:
+            return None
+    except ValueError:
+        return None
+
+    current = first <= today <= last
+    if kind == "day":
+        if first == today:
+            spoken = "today"
+        elif first == today - timedelta(days=1):
+            spoken = "yesterday"
+        else:
+            spoken = "on {} {}".format(first.strftime("%B"), first.day)
+    elif kind in ("week", "weekend"):
+        spoken = "this {}".format(kind) if current else "{} the {} of {} {}".format(
+            "in" if kind == "week" else "on", kind, first.strftime("%B"), first.day)
+    elif kind == "month":
+        spoken = "this month" if current else "in {} {}".format(first.strftime("%B"), first.year)
+    else:
+        spoken = "this year" if current else "in {}".format(first.year)
+
+    start = int(datetime(first.year, first.month, first.day, tzinfo=timezone.utc).timestamp())
+    end = int(datetime(last.year, last.month, last.day, tzinfo=timezone.utc).timestamp()) + 24 * 3600
+    return start, end, kind, spoken
+
+HISTORY_INTENTS = frozenset(["CryptoPriceOnDate", "CryptoPriceChange"])
+
+def _format_price(price):
+    # type: (float) -> str
+    return conversion.format_fixed(conversion.price_to_fixed(price), conversion.PRICE_DECIMALS, 1)
+
+def history_speech(intent, crypto, fiat, date_value, now=None):
+    # type: (str, str, str, Union[str, None], Union[float, None]) -> Tuple[str, str]
+    """Return the speech and card title for a question about past prices.
+
+    Without a title, the speech is a question back to the user. Answered from the recorded price history alone: a binary search for the
+    period and a scan of its samples.
+    """
+    coin = CRYPTO_CURRENCIES[crypto]["name"]
+    money = FIAT_CURRENCIES[fiat]["name"]
+    now = now or time.time()
+
+    if date_value is None and intent == "CryptoPriceOnDate":
+        return "For which day, week, month or year would you like the {} price?".format(coin), ""
+    period = parse_date_slot(date_value or "PRESENT_REF", now)
+    if period is None:
+        return "Sorry, I can only look back a day, a week, a month or a year at a time. Which one do you mean?", ""
+    start, end, kind, spoken = period
+
+    series = get_price_series(crypto, fiat)
+    prices = series.range(start * 1000, end * 1000)[1] if series is not None else ()
+    if not prices or (intent == "CryptoPriceChange" and len(prices) < 2):
+        return "Sorry, I don't have enough {} prices in {} for that {} yet.".format(coin, money, kind), ""
+
+    ongoing = end > now
+    spoken = spoken[0].upper() + spoken[1:]
+    last = _format_price(prices[-1])
+    if intent == "CryptoPriceOnDate":
+        low, high = min(prices), max(prices)
+        speech = "{}, {} {} {} {}.".format(spoken, coin, "is at" if ongoing else "closed at", last, money)
+        if low != high:
+            speech += " It ranged from {} to {}.".format(_format_price(low), _format_price(high))
+        return speech, "{} {}".format(last, fiat)
+
+    change = prices[-1] - prices[0]
+    if change == 0:
+        return "{}, {} {} at {} {}.".format(spoken, coin, "hasn't moved" if ongoing else "didn't move", last, money), "0% {}".format(crypto)
+    percent = "{:.1f}".format(abs(change) / prices[0] * 100)
+    if ongoing:
+        speech = "{}, {} is {} {} {}, or {} percent, at {} {}.".format(
+            spoken, coin, "up" if change > 0 else "down", _format_price(abs(change)), money, percent, last, money)
+    else:
+        speech = "{}, {} went {} {} {}, or {} percent, to {} {}.".format(
+            spoken, coin, "up" if change > 0 else "down", _format_price(abs(change)), money, percent, last, money)
+    return speech, "{}{}% {}".format("+" if change > 0 else "-", percent, crypto)
+
+REPEAT_CACHE_SIZE = int(os.environ.get("REPEAT_CACHE_SIZE", "512"))
+
+# What the skill last said, kept in the session as a bare JSON array instead
+# of the rendered speech. `amount` is the integer units the user asked about
+# (or the welcome variant, or the date slot of a history question),
+# `quote_id` the Quote.id it was priced with.
+LastAnswer = namedtuple("LastAnswer", "intent crypto fiat amount quote_id said_at")
+
+class ResponseCache(object):
+    """A thread-safe LRU of rendered speech, keyed by LastAnswer."""
+    def __init__(self, maxsize):
+        # type: (int) -> None
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # type: (LastAnswer) -> Union[str, None]
+        with self._lock:
+            speech = self._entries.get(key)
+            if speech is not None:
+                self._entries.move_to_end(key)
+            return speech
+
+    def put(self, key, speech):
+        # type: (LastAnswer, str) -> None
+        with self._lock:
+            self._entries[key] = speech
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+repeat_cache = ResponseCache(REPEAT_CACHE_SIZE)
+
+# The cache is shared by every user of the container, and nothing in a
+# LastAnswer tells one user's portfolio from another's.
+PER_USER_INTENTS = frozenset(["PortfolioValueIntent"])
+
+def remember(handler_input, answer, speech):
+    # type: (HandlerInput, LastAnswer, str) -> None
+    """Note what was said in the session, and keep the speech around for a Repeat."""
+    handler_input.attributes_manager.session_attributes["last"] = list(answer)
+    if answer.intent not in PER_USER_INTENTS:
+        repeat_cache.put(answer, speech)
+
+def render_last_answer(answer, holdings=None):
+    # type: (LastAnswer, Union[Dict[str, int], None]) -> str
+    """Say the last answer again, from the cache or rebuilt from the session state.
+
+    A rebuilt conversion is priced with the current quote; the one it was
+    first priced with lived in another container. A portfolio is rebuilt
+    from `holdings`, the session's copy, and never cached.
+    """
+    shared = answer.intent not in PER_USER_INTENTS
+    speech = repeat_cache.get(answer) if shared else None
+    if speech is not None:
+        return speech
+
+    if answer.intent == "LaunchRequest":
+        speech = WELCOMES[answer.amount % len(WELCOMES)]
+    elif answer.intent == "AMAZON.HelpIntent":
+        speech = HELP_SPEECH
+    elif answer.intent == "HowMuchIsCryptoInFiat":
+        speech = how_much_speech(answer.crypto, answer.fiat, answer.amount, get_quote())[0]
+    elif answer.intent == "HowManyCryptoCanIBuy":
+        speech = how_many_speech(answer.crypto, answer.fiat, answer.amount, get_quote())[0]
+    elif answer.intent in HISTORY_INTENTS:
+        speech = history_speech(answer.intent, answer.crypto, answer.fiat, answer.amount)[0]
+    elif answer.intent == "SetPriceAlertIntent":
+        speech = alert_speech(answer.crypto, answer.fiat, answer.amount, get_quote().price(answer.crypto, answer.fiat))
+    elif answer.intent == "SetHoldingsIntent":
+        speech = holding_speech(answer.crypto, answer.amount)
+    elif answer.intent == "PortfolioValueIntent":
+        speech = portfolio_speech(holdings or {}, answer.fiat, get_quote())[0]
+    else:
+        raise ValueError("Nothing to repeat for {}".format(answer.intent))
+
+    if shared:
+        repeat_cache.put(answer, speech)
+    return speech
+
+def alert_direction(fiat_units, price):
+    # type: (int, float) -> str
+    """An alert fires when the price crosses the threshold, from whichever side it is on now."""
+    return "above" if fiat_units / float(10 ** conversion.FIAT_DECIMALS) > price else "below"
+
+def alert_speech(crypto, fiat, fiat_units, price):
+    # type: (str, str, int, float) -> str
+    return "OK, I'll tell you when {} goes {} {} {}. It's at {} now.".format(
+        CRYPTO_CURRENCIES[crypto]["name"], alert_direction(fiat_units, price),
+        conversion.format_amount(fiat_units, conversion.FIAT_DECIMALS), FIAT_CURRENCIES[fiat]["name"], _format_price(price))
+
+HOLDINGS_KEY = "holdings"
+HOLDINGS_DIRTY_KEY = "holdingsDirty"
+
+def load_holdings(handler_input):
+    # type: (HandlerInput) -> Dict[str, int]
+    """Return the user's holdings in crypto units, keyed by symbol.
+
+    They are read from persistent storage on the first turn of a session
+    that needs them and ride along in the session attributes from then on,
+    so the rest of the session reads nothing. Without a persistence
+    adapter they last as long as the session.
+    """
+    session_attributes = handler_input.attributes_manager.session_attributes
+    holdings = session_attributes.get(HOLDINGS_KEY)
+    if holdings is None:
+        try:
+            stored = handler_input.attributes_manager.persistent_attributes.get(HOLDINGS_KEY) or {}
+        except AttributesManagerException:
+            stored = {}
+        # DynamoDB hands numbers back as Decimal.
+        holdings = session_attributes[HOLDINGS_KEY] = {
+            symbol: int(units) for symbol, units in stored.items() if symbol in CRYPTO_CURRENCIES}
+    return holdings
+
+def set_holding(handler_input, crypto, crypto_units):
+    # type: (HandlerInput, str, int) -> None
+    """Change one holding in the session; it is written back when the session ends."""
+    holdings = load_holdings(handler_input)
+    if crypto_units:
+        holdings[crypto] = crypto_units
+    else:
+        holdings.pop(crypto, None)
+    handler_input.attributes_manager.session_attributes[HOLDINGS_DIRTY_KEY] = True
+
+def save_holdings(handler_input):
+    # type: (HandlerInput) -> bool
+    """Write the session's holdings back in a single put if they changed. Returns whether it wrote."""
+    session_attributes = handler_input.attributes_manager.session_attributes
+    if not session_attributes.get(HOLDINGS_DIRTY_KEY):
+        return False
+
+    # The holdings are all we persist, so the item is replaced outright
+    # instead of being read back first.
+    try:
+        handler_input.attributes_manager.persistent_attributes = {HOLDINGS_KEY: session_attributes[HOLDINGS_KEY]}
+        handler_input.attributes_manager.save_persistent_attributes()
+    except AttributesManagerException:
+        return False
+    session_attributes[HOLDINGS_DIRTY_KEY] = False
+    return True
+
+def holding_speech(crypto, crypto_units):
+    # type: (str, int) -> str
+    coin = CRYPTO_CURRENCIES[crypto]["name"]
+    if not crypto_units:
+        return "Got it, you don't hold any {}.".format(coin)
+    return "Got it, you hold {} {}.".format(conversion.format_amount(crypto_units, conversion.CRYPTO_DECIMALS), coin)
+
+def portfolio_speech(holdings, fiat, quote):
+    # type: (Dict[str, int], str, Quote) -> Tuple[str, str]
+    """Return the speech and the fiat total for what the holdings are worth."""
+    if not holdings:
+        return "You haven't told me what you hold yet. Try saying, I hold 0.5 {}.".format(
+            CRYPTO_CURRENCIES[CRYPTO_SYMBOLS[0]]["name"]), ""
+
+    parts = []
+    fiat_units = 0
+    for crypto in CRYPTO_SYMBOLS:
+        crypto_units = holdings.get(crypto)
+        if crypto_units:
+            fiat_units += conversion.QuoteConverter(quote.price(crypto, fiat)).to_fiat(crypto_units)
+            parts.append("{} {}".format(conversion.format_amount(crypto_units, conversion.CRYPTO_DECIMALS),
+                                        CRYPTO_CURRENCIES[crypto]["name"]))
+
+    total = conversion.format_fixed(fiat_units, conversion.FIAT_DECIMALS, 1)
+    speech = "Your {} {} worth {} {}.{}".format(
+        " and ".join([", ".join(parts[:-1]), parts[-1]]) if len(parts) > 1 else parts[0],
+        "are" if len(parts) > 1 else "is", total, FIAT_CURRENCIES[fiat]["name"], describe_quote_age(quote))
+    return speech, total
+
 def _load_apl_document(file_path):
     # type: (str) -> Dict[str, Any]
     """Load the apl json document at the path into a dict object."""
     with open(file_path) as f:
         return json.load(f)
 
+class APLDocumentRegistry(object):
+    """Load each APL document once per container and share it.
+
+    Documents handed out by `get` are shared between requests and must be
+    treated as read-only.
+    """
+    def __init__(self, base_dir):
+        # type: (str) -> None
+        self.base_dir = base_dir
+        self._documents = {}
+        self._serialized = {}
+        self._ids = set()
+
+    def load(self, name):
+        # type: (str) -> Dict[str, Any]
+        return self.register(name, _load_apl_document(os.path.join(self.base_dir, name)))
+
+    def register(self, name, document):
+        # type: (str, Dict[str, Any]) -> Dict[str, Any]
+        """Serve `document` as `name` from now on."""
+        if not isinstance(document, dict) or document.get("type") != "APL" or "mainTemplate" not in document:
+            raise ValueError("{} is not an APL document".format(name))
+
+        self._documents[name] = document
+        self._serialized[name] = json.dumps(document, separators=(",", ":"))
+        self._ids.add(id(document))
+        return document
+
+    def get(self, name):
+        # type: (str) -> Dict[str, Any]
+        document = self._documents.get(name)
+        if document is None:
+            document = self.load(name)
+        return document
+
+    def get_json(self, name):
+        # type: (str) -> str
+        """Return the document already encoded as compact JSON."""
+        if name not in self._serialized:
+            self.load(name)
+        return self._serialized[name]
+
+    def share(self, fragment):
+        # type: (Dict[str, Any]) -> Dict[str, Any]
+        """Mark a constant JSON fragment as safe to reuse across responses."""
+        self._ids.add(id(fragment))
+        return fragment
+
+    def is_registered(self, obj):
+        # type: (Any) -> bool
+        return id(obj) in self._ids
+
+    def name_of(self, obj):
+        # type: (Any) -> Union[str, None]
+        """Return the name a document is served as, or None for anything else."""
+        for name, document in self._documents.items():
+            if document is obj:
+                return name
+        return None
+
+def compact_apl_document(document):
+    # type: (Any) -> Any
+    """Return a copy of an APL document without the "description" entries, which devices ignore."""
+    if isinstance(document, dict):
+        return {key: compact_apl_document(value) for key, value in document.items() if key != "description"}
+    if isinstance(document, list):
+        return [compact_apl_document(value) for value in document]
+    return document
+
+def split_apl_package(document, name, source, version="1.0.0"):
+    # type: (Dict[str, Any], str, str, str) -> Tuple[Dict[str, Any], Dict[str, Any]]
+    """Split a document into a package of its resources, styles and layouts, and the rest importing it from `source`.
+
+    The package is imported after the document's other imports, so its
+    definitions still win over theirs, as they did inline.
+    """
+    package = {"type": "APL", "version": document["version"]}
+    for key in ("resources", "styles", "layouts"):
+        if key in document:
+            package[key] = document[key]
+
+    slim = {key: value for key, value in document.items() if key not in package or key in ("type", "version")}
+    slim["import"] = list(document.get("import", [])) + [{"name": name, "version": version, "source": source}]
+    return package, slim
+
+APL_DOCUMENT = "aplbuybitcoin.json"
+# Where `python buybitcoin.py apl-package` output is hosted. When set, the
+# document's resources, styles and layouts are left to the package, which a device
+# downloads once and caches, instead of riding along in every response.
+APL_PACKAGE_URL = os.environ.get("APL_PACKAGE_URL")
+APL_PACKAGE_NAME = "buybitcoin-styles"
+
+apl_documents = APLDocumentRegistry(os.path.dirname(os.path.abspath(__file__)))
+_apl_document = compact_apl_document(_load_apl_document(os.path.join(apl_documents.base_dir, APL_DOCUMENT)))
+apl_package, _apl_slim = split_apl_package(_apl_document, APL_PACKAGE_NAME, APL_PACKAGE_URL or "")
+apl_documents.register(APL_DOCUMENT, _apl_slim if APL_PACKAGE_URL else _apl_document)
+
+class SkillSerializer(DefaultSerializer):
+    """Serializer that passes registered APL documents through untouched.
+
+    The static documents and shared fragments are already plain
+    JSON-compatible dicts, so walking and copying them on every response
+    is wasted work. So is serializing a response twice: the response
+    ResponseOptimizer measured, and the envelope MeteredSkill measured
+    and logged, are reused.
+    """
+    def serialize(self, obj):
+        # type: (Any) -> Any
+        if isinstance(obj, dict) and apl_documents.is_registered(obj):
+            return obj
+        if type(obj) is Response or type(obj) is ResponseEnvelope:
+            serialized = getattr(_request_context, "serialized_response", None)
+            if serialized is not None and serialized[0] is obj:
+                _request_context.serialized_response = None
+                return serialized[1]
+        return super(SkillSerializer, self).serialize(obj)
+
+def supports_apl(handler_input):
+    """Return True if the requesting device can render APL."""
+    # type: (HandlerInput) -> bool
+    return handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl is not None
+
+BACKGROUND_URL = "https://yakkie.app/wp-content/uploads/2019/09/bbback.png"
+LOGO_URL = "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png"
+CARD_IMAGE_URL = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
+
+def _build_hints(cryptos, fiats):
+    # type: (List[str], List[str]) -> Dict[Tuple[str, str, str], str]
+    hints = {}
+    for crypto in cryptos:
+        for fiat in fiats:
+            name = CRYPTO_CURRENCIES[crypto]["name"]
+            money = FIAT_CURRENCIES[fiat]["hint_name"]
+            hints["HowMany", crypto, fiat] = "Try, \"How many {} can I buy with 100 {}?\"".format(name, money)
+            hints["HowMuch", crypto, fiat] = "Try, \"How much is 2.5 {} in {}?\"".format(name, money)
+    return hints
+
+HINTS = _build_hints(CRYPTO_SYMBOLS, FIAT_SYMBOLS)
+
+class ResponseRenderer(object):
+    """Render the visual part of a response from precomputed templates.
+
+    Everything but the two text lines and the hint is built once, so a
+    response only allocates the few dicts that actually change. APL
+    devices get the document with a `bodyTemplate6Data` datasource, all
+    others a standard card with the same two lines.
+    """
+    def __init__(self, document_name, background_url, logo_url, card_image_url):
+        # type: (str, str, str, str) -> None
+        self.document_name = document_name
+        self.logo_url = logo_url
+        # The document only reads the first source, and one URL serves
+        # every screen size.
+        self.background_image = apl_documents.share({
+            "sources": [
+                {
+                    "url": background_url
+                }
+            ]
+        })
+        self.card_image = ui.Image(small_image_url=card_image_url, large_image_url=card_image_url)
+
+    def datasources(self, primary_text, secondary_text, hint_text):
+        # type: (str, str, str) -> Dict[str, Any]
+        return {
+            "bodyTemplate6Data": {
+                "type": "object",
+                "backgroundImage": self.background_image,
+                "textContent": {
+                    "primaryText": {
+                        "type": "PlainText",
+                        "text": primary_text
+                    },
+                    "secondaryText": {
+                        "type": "PlainText",
+                        "text": secondary_text
+                    }
+                },
+                "logoUrl": self.logo_url,
+                "hintText": hint_text
+            }
+        }
+
+    def render(self, handler_input, speech, reprompt, primary_text, secondary_text, hint_text):
+        # type: (HandlerInput, str, str, str, str, str) -> Response
+        with timed("render"):
+            response_builder = handler_input.response_builder.speak(speech).ask(reprompt)
+
+            if supports_apl(handler_input):
+                from ask_sdk_model.interfaces.alexa.presentation.apl import RenderDocumentDirective
+                response_builder.add_directive(
+                    RenderDocumentDirective(
+                        token="pagerToken",
+                        document=apl_documents.get(self.document_name),
+                        datasources=self.datasources(primary_text, secondary_text, hint_text)))
+            else:
+                response_builder.set_card(
+                    ui.StandardCard(title=primary_text, text=secondary_text, image=self.card_image))
+
+            return response_builder.response
+
+    def downgrade(self, response):
+        # type: (Response) -> bool
+        """Swap a response's APL document for a card with the same two lines. Returns whether it did."""
+        directives = response.directives or []
+        for i, directive in enumerate(directives):
+            if directive.object_type == "Alexa.Presentation.APL.RenderDocument" and directive.datasources:
+                text = directive.datasources["bodyTemplate6Data"]["textContent"]
+                del directives[i]
+                response.card = ui.StandardCard(title=text["primaryText"]["text"], text=text["secondaryText"]["text"],
+                                                image=self.card_image)
+                return True
+        return False
+
+renderer = ResponseRenderer(APL_DOCUMENT, BACKGROUND_URL, LOGO_URL, CARD_IMAGE_URL)
+
+# Responses larger than this many bytes of compact JSON get a card instead
+# of their APL document; 0 turns the check off.
+RESPONSE_BYTE_BUDGET = int(os.environ.get("RESPONSE_BYTE_BUDGET", "24576"))
+
+_PROSODY_BREAK = re.compile(r"(<prosody ([^>]*)>[^<]*)</prosody>(\s*)<prosody \2>")
+_REPEATED_AUDIO = re.compile(r"(<audio [^>]*/>)(?:\s*\1)+")
+_SPACES = re.compile(r"\s{2,}")
+_SPEAK_PADDING = re.compile(r"(<speak>)\s+|\s+(</speak>)")
+
+def normalize_ssml(ssml):
+    # type: (str) -> str
+    """Merge neighbouring <prosody> tags with the same attributes, play a sound once and squeeze whitespace.
+
+    "<prosody volume='loud'>hello</prosody> <prosody volume='loud'>there</prosody>"
+    becomes "<prosody volume='loud'>hello there</prosody>".
+    """
+    merged = 1
+    while merged:
+        ssml, merged = _PROSODY_BREAK.subn(r"\1\3", ssml)
+    ssml = _REPEATED_AUDIO.sub(r"\1", ssml)
+    return _SPEAK_PADDING.sub(r"\1\2", _SPACES.sub(" ", ssml))
+
+def serialize_once(obj):
+    # type: (Union[Response, ResponseEnvelope]) -> Tuple[Dict[str, Any], int]
+    """Serialize a finished response or envelope and return it with its size as compact JSON, in bytes.
+
+    The result is kept for the thread until `obj` is serialized again,
+    which reuses it instead of walking `obj` twice. An envelope reuses the
+    kept response inside it the same way.
+    """
+    serialized = skill.serializer.serialize(obj)
+    _request_context.serialized_response = (obj, serialized)
+    # json.dumps escapes everything outside ASCII, so characters are bytes.
+    return serialized, len(json.dumps(serialized, separators=(",", ":")))
+
+def response_size(response):
+    # type: (Response) -> int
+    """Return the size of a finished response as compact JSON, in bytes."""
+    _request_context.serialized_response = None
+    return serialize_once(response)[1]
+
+class ResponseOptimizer(AbstractResponseInterceptor):
+    """Normalize the SSML of every response and hold it to RESPONSE_BYTE_BUDGET.
+
+    A response over the budget gets a card in place of its APL document.
+    """
+    def process(self, handler_input, response):
+        # type: (HandlerInput, Response) -> None
+        if response is None:
+            return
+
+        with timed("render"):
+            for speech in (response.output_speech, response.reprompt.output_speech if response.reprompt else None):
+                if speech is not None and getattr(speech, "ssml", None):
+                    speech.ssml = normalize_ssml(speech.ssml)
+
+            size = response_size(response)
+            if RESPONSE_BYTE_BUDGET and size > RESPONSE_BYTE_BUDGET and renderer.downgrade(response):
+                logger.warning("Response of {} bytes is over the {} byte budget, sent a card instead of APL".format(
+                    size, RESPONSE_BYTE_BUDGET))
+                response_size(response)
+
 class LaunchRequestHandler(AbstractRequestHandler):
     def can_handle(self, handler_input):
         # type: (HandlerInput) -> bool
@@ -130,25 +2200,6 @@ class LaunchRequestHandler(AbstractRequestHandler):
         # type: (HandlerInput) -> Response
         logger.info("In LaunchRequestHandler")
 
-        welcomes = ["What a <prosody volume='loud'>great</prosody> day for crypto! How can I help?",
-                    "<prosody volume='x-loud'>Hello</prosody>, <prosody volume='loud'>fellow</prosody> cryptopian! How can I assist?",
-                    "<prosody volume='x-loud'>Hi</prosody> there! Not a day without crypto, am I right? How can I help?",
-                    "Well <prosody volume='loud'>hello</prosody> <prosody volume='loud'>there</prosody>, my sweet little crypto nerd! How can I assist?",
-                    "<prosody volume='x-loud'>Greetings</prosody> from planet crypto! How can I help?",
-                    "<prosody volume='x-loud'>Bonjour</prosody>, my crypto friend! How can I assist?",
-                    "<prosody volume='x-loud'>Howdy</prosody>, my precious <prosody volume='loud'>crypto</prosody> geek! How can I help?",
-                    "<prosody volume='x-loud'>Greetings</prosody>, my <prosody volume='loud'>crypto</prosody> comrade! How can I assist?",
-                    "Look who it <prosody volume='loud'>is</prosody>, my crypto buddy! How can I help?",
-                    "<prosody volume='x-loud'>Cheers</prosody>, my <prosody volume='loud'>crypto</prosody> soul mate! How can I assist?",
-                    "<prosody volume='x-loud'>Hello</prosody>, crypto partner! Nice to hear you! How can I help?",
-                    "<prosody volume='x-loud'>Hey!</prosody> Your crypto cousin here! How can I assist?",
-                    "<prosody volume='x-loud'>Hola</prosody>, my dearest crypto amigo! How can I help?",
-                    "<prosody volume='x-loud'>Ciao</prosody>, my beloved <prosody volume='loud'>crypto</prosody> novice! How can I assist?",
-                    "<prosody volume='x-loud'>Aloha</prosody>, my cherished <prosody volume='loud'>crypto</prosody> addict! How can I help?",
-                    "<prosody volume='x-loud'>Welcome</prosody>, my dear <prosody volume='loud'>crypto</prosody> buddy! How can I assist?",
-                    "It's great to hear you, my sweet crypto geek! How can I help?",
-                    "So nice to hear you, my lovely <prosody volume='loud'>crypto</prosody> noob! How can I assist?"]
-
         nice_fallbacks = ["Excuse me, I was checking my portfolio. Can you say it again?",
                           "<say-as interpret-as='interjection'>Damn</say-as>, my <prosody volume='loud'>wallet</prosody> looks so good! Can you repeat?",
                           "Sorry, I didn't get that. I was stacking satoshis. Can you rephrase?",
@@ -160,61 +2211,12 @@ class LaunchRequestHandler(AbstractRequestHandler):
                           "Excuse me, Satoshi keeps calling me. Please repeat!",
                           "Oups, you caught me checking my <prosody volume='loud'>crypto</prosody> stack. Say that again, please!"]
 
-        speech = random.choice(welcomes)
+        variant = random.randrange(len(WELCOMES))
+        speech = WELCOMES[variant]
         reprompt = random.choice(nice_fallbacks)
-        handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
-
-        if handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl:
-            return handler_input.response_builder.speak(speech).ask(reprompt).add_directive(
-                                RenderDocumentDirective(
-                                    token="pagerToken",
-                                    document=_load_apl_document("aplbuybitcoin.json"),
-                                    datasources={
-                                        "bodyTemplate6Data": {
-                                            "type": "object",
-                                            "objectId": "bt6Sample",
-                                            "backgroundImage": {
-                                                "sources": [
-                                                    {
-                                                        "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                        "size": "small",
-                                                        "widthPixels": 0,
-                                                        "heightPixels": 0
-                                                    },
-                                                    {
-                                                        "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                        "size": "large",
-                                                        "widthPixels": 0,
-                                                        "heightPixels": 0
-                                                    }
-                                                ]
-                                            },
-                                            "textContent": {
-                                                "primaryText": {
-                                                    "type": "PlainText",
-                                                    "text": "Hi"
-                                                },
-                                                "secondaryText": {
-                                                    "type": "PlainText",
-                                                    "text": ""
-                                                }
-                                            },
-                                            "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
-                                            "hintText": "Try, \"How many Bitcoin can I buy with 100 dollars?\""
-                                        }
-                                    }
-                                )
-                    ).response
+        remember(handler_input, LastAnswer("LaunchRequest", None, None, variant, None, int(time.time())), speech)
 
-        else:
-            return handler_input.response_builder.speak(speech).ask(reprompt).set_card(
-                ui.StandardCard(
-                    title = "Hi",
-                    text = "",
-                    image = ui.Image(
-                        small_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png",
-                        large_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
-                    ))).response
+        return renderer.render(handler_input, speech, reprompt, "Hi", "", HINTS["HowMany", CRYPTO_SYMBOLS[0], FIAT_SYMBOLS[0]])
 
 class InProgressHowMuchIntent(AbstractRequestHandler):
     def can_handle(self, handler_input):
@@ -225,8 +2227,9 @@ class InProgressHowMuchIntent(AbstractRequestHandler):
     def handle(self, handler_input):
         # type: (HandlerInput) -> Response
         logger.info("In InProgressHowMuchIntent")
-        current_intent = handler_input.request_envelope.request.intent
+        current_intent = slot_resolver.canonicalize(handler_input.request_envelope.request.intent)
 
+        from ask_sdk_model.dialog import DelegateDirective
         return handler_input.response_builder.add_directive(
             DelegateDirective(
                 updated_intent = current_intent
@@ -239,148 +2242,31 @@ class HowMuchIsCryptoInFiat(AbstractRequestHandler):
     def handle(self, handler_input):
         logger.info("In HowMuchIsCryptoInFiat")
 
-        price_api_link = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD,EUR&api_key=4ca8ca1f2f7499823cde74ea2212edbd64d972f770b8d28708224065f262bf46&e=Coinbase"
-        price_api_result = http_get(price_api_link)
-
-        price_usd = list(price_api_result.values())[0]
-        price_eur = list(price_api_result.values())[1]
-
-        filled_slots = handler_input.request_envelope.request.intent.slots
-        slot_values = get_slot_values(filled_slots)
-        #print(slot_values)
-
-        if slot_values['integer']['resolved'] == None:
-            slot_values['integer']['resolved'] = '0'
-
-        elif slot_values['decimal']['resolved'] == None:
-            slot_values['decimal']['resolved'] = '0'
-
-        number = float(slot_values['integer']['resolved'] + "." + slot_values['decimal']['resolved'])
-
-        result_usd = number * price_usd
-        result_eur = number * price_eur
-
-        if slot_values['fiat']['resolved'] == 'USD':
-            speech = "{} {} is worth {} U.S. dollars. <audio src='soundbank://soundlibrary/human/amzn_sfx_crowd_applause_03'/>".format(number, slot_values['crypto']['resolved'], "%.1f" % result_usd)
-            handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
-
-            if handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl:
-                return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).add_directive(
-                                RenderDocumentDirective(
-                                    token="pagerToken",
-                                    document=_load_apl_document("aplbuybitcoin.json"),
-                                    datasources={
-                                        "bodyTemplate6Data": {
-                                            "type": "object",
-                                            "objectId": "bt6Sample",
-                                            "backgroundImage": {
-                                                "sources": [
-                                                    {
-                                                        "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                        "size": "small",
-                                                        "widthPixels": 0,
-                                                        "heightPixels": 0
-                                                    },
-                                                    {
-                                                        "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                        "size": "large",
-                                                        "widthPixels": 0,
-                                                        "heightPixels": 0
-                                                    }
-                                                ]
-                                            },
-                                            "textContent": {
-                                                "primaryText": {
-                                                    "type": "PlainText",
-                                                    "text": str("%.1f" % result_usd) + " USD"
-                                                },
-                                                "secondaryText": {
-                                                    "type": "PlainText",
-                                                    "text": str(number) + " BTC"
-                                                }
-                                            },
-                                            "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
-                                            "hintText": "Try, \"How many Bitcoin can I buy with 100 dollars?\""
-                                        }
-                                    }
-                                )
-                    ).response
-            else:
-                return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).set_card(
-                ui.StandardCard(
-                    title = str("%.1f" % result_usd) + " USD",
-                    text = str(number) + " BTC",
-                    image = ui.Image(
-                        small_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png",
-                        large_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
-                    ))).response
-
-        elif slot_values['fiat']['resolved'] == 'EUR':
-            speech = "{} {} is worth {} Euros. <audio src='soundbank://soundlibrary/human/amzn_sfx_crowd_applause_03'/>".format(number, slot_values['crypto']['resolved'], "%.1f" % result_eur)
-            handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
-
-            if handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl:
-                return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).add_directive(
-                                RenderDocumentDirective(
-                                    token="pagerToken",
-                                    document=_load_apl_document("aplbuybitcoin.json"),
-                                    datasources={
-                                        "bodyTemplate6Data": {
-                                            "type": "object",
-                                            "objectId": "bt6Sample",
-                                            "backgroundImage": {
-                                                "sources": [
-                                                    {
-                                                        "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                        "size": "small",
-                                                        "widthPixels": 0,
-                                                        "heightPixels": 0
-                                                    },
-                                                    {
-                                                        "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                        "size": "large",
-                                                        "widthPixels": 0,
-                                                        "heightPixels": 0
-                                                    }
-                                                ]
-                                            },
-                                            "textContent": {
-                                                "primaryText": {
-                                                    "type": "PlainText",
-                                                    "text": str("%.1f" % result_eur) + " EUR"
-                                                },
-                                                "secondaryText": {
-                                                    "type": "PlainText",
-                                                    "text": str(number) + " BTC"
-                                                }
-                                            },
-                                            "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
-                                            "hintText": "Try, \"How many Bitcoin can I buy with 100 euro?\""
-                                        }
-                                    }
-                                )
-                    ).response
-            else:
-                return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).set_card(
-                ui.StandardCard(
-                    title = str("%.1f" % result_eur) + " EUR",
-                    text = str(number) + " BTC",
-                    image = ui.Image(
-                        small_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png",
-                        large_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
-                    ))).response
+        quote = get_quote()
+
+        slots = slot_resolver.resolve(handler_input.request_envelope.request.intent.slots)
+
+        crypto, fiat = slots.pair()
+        crypto_units = conversion.parse_amount(slots.integer, slots.decimal, conversion.CRYPTO_DECIMALS)
+
+        speech, result, number = how_much_speech(crypto, fiat, crypto_units, quote)
+        remember(handler_input, LastAnswer("HowMuchIsCryptoInFiat", crypto, fiat, crypto_units, quote.id, int(time.time())), speech)
+
+        return renderer.render(handler_input, "{} {}".format(speech, get_random_yes_no_question()), get_random_yes_no_question(),
+                               "{} {}".format(result, fiat), "{} {}".format(number, crypto), HINTS["HowMany", crypto, fiat])
 
 class InProgressHowManyIntent(AbstractRequestHandler):
     def can_handle(self, handler_input):
         # type: (HandlerInput) -> bool
-        return (is_intent_name("HowManyIsCryptoInFiat")(handler_input)
+        return (is_intent_name("HowManyCryptoCanIBuy")(handler_input)
                 and handler_input.request_envelope.request.dialog_state != DialogState.COMPLETED)
 
     def handle(self, handler_input):
         # type: (HandlerInput) -> Response
-        logger.info("In InProgressHowMuchIntent")
-        current_intent = handler_input.request_envelope.request.intent
+        logger.info("In InProgressHowManyIntent")
+        current_intent = slot_resolver.canonicalize(handler_input.request_envelope.request.intent)
 
+        from ask_sdk_model.dialog import DelegateDirective
         return handler_input.response_builder.add_directive(
             DelegateDirective(
                 updated_intent = current_intent
@@ -393,254 +2279,128 @@ class HowManyCryptoCanIBuy(AbstractRequestHandler):
     def handle(self, handler_input):
         logger.info("In HowManyCryptoCanIBuy")
 
-        price_api_link = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD,EUR&api_key=4ca8ca1f2f7499823cde74ea2212edbd64d972f770b8d28708224065f262bf46&e=Coinbase"
-        price_api_result = http_get(price_api_link)
+        quote = get_quote()
 
-        price_usd = list(price_api_result.values())[0]
-        price_eur = list(price_api_result.values())[1]
+        slots = slot_resolver.resolve(handler_input.request_envelope.request.intent.slots)
 
-        filled_slots = handler_input.request_envelope.request.intent.slots
-        slot_values = get_slot_values(filled_slots)
-        #print(slot_values)
+        crypto, fiat = slots.pair()
+        fiat_units = conversion.parse_amount(slots.integer, slots.decimal, conversion.FIAT_DECIMALS)
 
-        if slot_values['integer']['resolved'] == None:
-            slot_values['integer']['resolved'] = '0'
+        speech, amount, number = how_many_speech(crypto, fiat, fiat_units, quote)
+        remember(handler_input, LastAnswer("HowManyCryptoCanIBuy", crypto, fiat, fiat_units, quote.id, int(time.time())), speech)
 
-        elif slot_values['decimal']['resolved'] == None:
-            slot_values['decimal']['resolved'] = '0'
+        return renderer.render(handler_input, "{} {}".format(speech, get_random_yes_no_question()), get_random_yes_no_question(),
+                               "{} {}".format(amount, crypto), "{} {}".format(number, fiat), HINTS["HowMuch", crypto, fiat])
 
-        if slot_values['decimal']['resolved'] == '0':
-            number = int(slot_values['integer']['resolved'])
-        else:
-            number = float(slot_values['integer']['resolved'] + "." + slot_values['decimal']['resolved'])
-
-        howmany_usd = number / price_usd
-        howmany_eur = number / price_eur
-
-        if (howmany_usd < 1) or (howmany_eur < 1):
-            howmany_sat_usd = int(float("%.8f" % howmany_usd) * 10**8)
-            howmany_sat_eur = int(float("%.8f" % howmany_eur) * 10**8)
-
-            if slot_values['fiat']['resolved'] == 'USD':
-                speech = "For {} U.S. dollars you can buy {} {}, or, to be more precise, {} satoshis. <audio src='soundbank://soundlibrary/human/amzn_sfx_crowd_applause_03'/>".format(number, ("%.8f" % howmany_usd).rstrip("0"), slot_values['crypto']['resolved'], howmany_sat_usd)
-                handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
-
-                if handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).add_directive(
-                                    RenderDocumentDirective(
-                                        token="pagerToken",
-                                        document=_load_apl_document("aplbuybitcoin.json"),
-                                        datasources={
-                                            "bodyTemplate6Data": {
-                                                "type": "object",
-                                                "objectId": "bt6Sample",
-                                                "backgroundImage": {
-                                                    "sources": [
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "small",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        },
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "large",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        }
-                                                    ]
-                                                },
-                                                "textContent": {
-                                                    "primaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str("%.8f" % howmany_usd).rstrip("0") + " BTC"
-                                                    },
-                                                    "secondaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str(number) + " USD"
-                                                    }
-                                                },
-                                                "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
-                                                "hintText": "Try, \"How much is 2.5 Bitcoin in dollars?\""
-                                            }
-                                        }
-                                    )
-                        ).response
-                else:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).set_card(
-                    ui.StandardCard(
-                        title = str("%.8f" % howmany_usd).rstrip("0") + " BTC",
-                        text = str(number) + " USD",
-                        image = ui.Image(
-                            small_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png",
-                            large_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
-                        ))).response
-
-            elif slot_values['fiat']['resolved'] == 'EUR':
-                speech = "For {} Euro you can buy {} {}, or, to be more precise, {} satoshis. <audio src='soundbank://soundlibrary/human/amzn_sfx_crowd_applause_03'/>".format(number, ("%.8f" % howmany_eur).rstrip("0"), slot_values['crypto']['resolved'], howmany_sat_eur)
-                handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
-
-                if handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).add_directive(
-                                    RenderDocumentDirective(
-                                        token="pagerToken",
-                                        document=_load_apl_document("aplbuybitcoin.json"),
-                                        datasources={
-                                            "bodyTemplate6Data": {
-                                                "type": "object",
-                                                "objectId": "bt6Sample",
-                                                "backgroundImage": {
-                                                    "sources": [
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "small",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        },
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "large",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        }
-                                                    ]
-                                                },
-                                                "textContent": {
-                                                    "primaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str("%.8f" % howmany_eur).rstrip("0") + " BTC"
-                                                    },
-                                                    "secondaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str(number) + " EUR"
-                                                    }
-                                                },
-                                                "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
-                                                "hintText": "Try, \"How much is 2.5 Bitcoin in Euro?\""
-                                            }
-                                        }
-                                    )
-                        ).response
-                else:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).set_card(
-                    ui.StandardCard(
-                        title = str("%.8f" % howmany_eur).rstrip("0") + " BTC",
-                        text = str(number) + " EUR",
-                        image = ui.Image(
-                            small_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png",
-                            large_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
-                        ))).response
+class PriceHistoryHandler(AbstractRequestHandler):
+    """What a coin was worth, or how it moved, over a past day, week, month or year."""
+    def can_handle(self, handler_input):
+        # type: (HandlerInput) -> bool
+        request = handler_input.request_envelope.request
+        return isinstance(request, IntentRequest) and request.intent.name in HISTORY_INTENTS
 
-        else:
-            if slot_values['fiat']['resolved'] == 'USD':
-                speech = "For {} U.S. dollars you can buy approximately {} {}. <audio src='soundbank://soundlibrary/human/amzn_sfx_crowd_applause_03'/>".format(number, ("%.3f" % howmany_usd).rstrip("0"), slot_values['crypto']['resolved'])
-                handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
-
-                if handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).add_directive(
-                                    RenderDocumentDirective(
-                                        token="pagerToken",
-                                        document=_load_apl_document("aplbuybitcoin.json"),
-                                        datasources={
-                                            "bodyTemplate6Data": {
-                                                "type": "object",
-                                                "objectId": "bt6Sample",
-                                                "backgroundImage": {
-                                                    "sources": [
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "small",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        },
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "large",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        }
-                                                    ]
-                                                },
-                                                "textContent": {
-                                                    "primaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str("%.3f" % howmany_usd).rstrip("0") + " BTC"
-                                                    },
-                                                    "secondaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str(number) + " USD"
-                                                    }
-                                                },
-                                                "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
-                                                "hintText": "Try, \"How much is 2.5 Bitcoin in dollars?\""
-                                            }
-                                        }
-                                    )
-                        ).response
-                else:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).set_card(
-                    ui.StandardCard(
-                        title = str("%.3f" % howmany_usd).rstrip("0") + " BTC",
-                        text = str(number) + " USD",
-                        image = ui.Image(
-                            small_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png",
-                            large_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
-                        ))).response
-
-            elif slot_values['fiat']['resolved'] == 'EUR':
-                speech = "For {} Euro you can buy approximately {} {}. <audio src='soundbank://soundlibrary/human/amzn_sfx_crowd_applause_03'/>".format(number, ("%.3f" % howmany_eur).rstrip("0"), slot_values['crypto']['resolved'])
-                handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
-
-                if handler_input.request_envelope.context.system.device.supported_interfaces.alexa_presentation_apl:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).add_directive(
-                                    RenderDocumentDirective(
-                                        token="pagerToken",
-                                        document=_load_apl_document("aplbuybitcoin.json"),
-                                        datasources={
-                                            "bodyTemplate6Data": {
-                                                "type": "object",
-                                                "objectId": "bt6Sample",
-                                                "backgroundImage": {
-                                                    "sources": [
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "small",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        },
-                                                        {
-                                                            "url": "https://yakkie.app/wp-content/uploads/2019/09/bbback.png",
-                                                            "size": "large",
-                                                            "widthPixels": 0,
-                                                            "heightPixels": 0
-                                                        }
-                                                    ]
-                                                },
-                                                "textContent": {
-                                                    "primaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str("%.3f" % howmany_eur).rstrip("0") + " BTC"
-                                                    },
-                                                    "secondaryText": {
-                                                        "type": "PlainText",
-                                                        "text": str(number) + " EUR"
-                                                    }
-                                                },
-                                                "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
-                                                "hintText": "Try, \"How much is 2.5 Bitcoin in Euro?\""
-                                            }
-                                        }
-                                    )
-                        ).response
-                else:
-                    return handler_input.response_builder.speak("{} {}".format(speech, get_random_yes_no_question())).ask(get_random_yes_no_question()).set_card(
-                    ui.StandardCard(
-                        title = str("%.3f" % howmany_eur).rstrip("0") + " BTC",
-                        text = str(number) + " EUR",
-                        image = ui.Image(
-                            small_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png",
-                            large_image_url = "https://yakkie.app/wp-content/uploads/2019/09/bbcard.png"
-                        ))).response
+    def handle(self, handler_input):
+        # type: (HandlerInput) -> Response
+        intent = handler_input.request_envelope.request.intent
+        logger.info("In PriceHistoryHandler: {}".format(intent.name))
+
+        slots = slot_resolver.resolve(intent.slots)
+        if slots.spoken_fiat is None:
+            slots.fiat = FIAT_SYMBOLS[0]
+        crypto, fiat = slots.pair()
+
+        speech, title = history_speech(intent.name, crypto, fiat, slots.date)
+        remember(handler_input, LastAnswer(intent.name, crypto, fiat, slots.date, None, int(time.time())), speech)
+        if not title:
+            return handler_input.response_builder.speak(speech).ask(speech).response
+
+        return renderer.render(handler_input, "{} {}".format(speech, get_random_yes_no_question()), get_random_yes_no_question(),
+                               title, "{} {}".format(crypto, slots.date or "today"), HINTS["HowMuch", crypto, fiat])
+
+class SetPriceAlertHandler(AbstractRequestHandler):
+    """Notify the user when a coin crosses a price, in the first configured currency unless told."""
+    def can_handle(self, handler_input):
+        # type: (HandlerInput) -> bool
+        return is_intent_name("SetPriceAlertIntent")(handler_input)
+
+    def handle(self, handler_input):
+        # type: (HandlerInput) -> Response
+        logger.info("In SetPriceAlertHandler")
+
+        slots = slot_resolver.resolve(handler_input.request_envelope.request.intent.slots)
+        if slots.spoken_fiat is None:
+            slots.fiat = FIAT_SYMBOLS[0]
+        crypto, fiat = slots.pair()
+        fiat_units = conversion.parse_amount(slots.integer, slots.decimal, conversion.FIAT_DECIMALS)
+
+        alert_log = get_alert_log()
+        if alert_log is None:
+            speech = "Sorry, I can't set price alerts yet. What else would you like to know?"
+            return handler_input.response_builder.speak(speech).ask(speech).response
+        if not fiat_units:
+            speech = "Tell me the price as well. For instance, say, tell me when {} crosses 50000 {}.".format(
+                CRYPTO_CURRENCIES[crypto]["name"], FIAT_CURRENCIES[fiat]["name"])
+            return handler_input.response_builder.speak(speech).ask(speech).response
+
+        quote = get_quote()
+        price = quote.price(crypto, fiat)
+        alert_log.append(handler_input.request_envelope.context.system.user.user_id, crypto, fiat,
+                         alert_direction(fiat_units, price), fiat_units / float(10 ** conversion.FIAT_DECIMALS))
+
+        speech = alert_speech(crypto, fiat, fiat_units, price)
+        remember(handler_input, LastAnswer("SetPriceAlertIntent", crypto, fiat, fiat_units, quote.id, int(time.time())), speech)
+
+        return renderer.render(handler_input, "{} {}".format(speech, get_random_yes_no_question()), get_random_yes_no_question(),
+                               "{} {}".format(conversion.format_amount(fiat_units, conversion.FIAT_DECIMALS), fiat),
+                               "{} alert".format(crypto), HINTS["HowMuch", crypto, fiat])
+
+class SetHoldingsHandler(AbstractRequestHandler):
+    """Remember how much of a coin the user holds, for PortfolioValueIntent."""
+    def can_handle(self, handler_input):
+        # type: (HandlerInput) -> bool
+        return is_intent_name("SetHoldingsIntent")(handler_input)
+
+    def handle(self, handler_input):
+        # type: (HandlerInput) -> Response
+        logger.info("In SetHoldingsHandler")
+
+        slots = slot_resolver.resolve(handler_input.request_envelope.request.intent.slots)
+        if slots.crypto not in CRYPTO_SYMBOLS:
+            raise UnsupportedPairError("{}/".format(slots.spoken_crypto or ""))
+        crypto_units = conversion.parse_amount(slots.integer, slots.decimal, conversion.CRYPTO_DECIMALS)
+
+        set_holding(handler_input, slots.crypto, crypto_units)
+        speech = holding_speech(slots.crypto, crypto_units)
+        remember(handler_input, LastAnswer("SetHoldingsIntent", slots.crypto, None, crypto_units, None, int(time.time())), speech)
+
+        return renderer.render(handler_input, "{} {}".format(speech, get_random_yes_no_question()), get_random_yes_no_question(),
+                               "{} {}".format(conversion.format_amount(crypto_units, conversion.CRYPTO_DECIMALS), slots.crypto),
+                               "Holdings", HINTS["HowMuch", slots.crypto, FIAT_SYMBOLS[0]])
+
+class PortfolioValueHandler(AbstractRequestHandler):
+    """What the user's holdings are worth, in the asked or the first configured currency."""
+    def can_handle(self, handler_input):
+        # type: (HandlerInput) -> bool
+        return is_intent_name("PortfolioValueIntent")(handler_input)
+
+    def handle(self, handler_input):
+        # type: (HandlerInput) -> Response
+        logger.info("In PortfolioValueHandler")
+
+        slots = slot_resolver.resolve(handler_input.request_envelope.request.intent.slots)
+        fiat = slots.fiat if slots.spoken_fiat is not None else FIAT_SYMBOLS[0]
+        if fiat not in FIAT_SYMBOLS:
+            raise UnsupportedPairError("/{}".format(slots.spoken_fiat))
+
+        holdings = load_holdings(handler_input)
+        quote = get_quote()
+        speech, total = portfolio_speech(holdings, fiat, quote)
+        remember(handler_input, LastAnswer("PortfolioValueIntent", None, fiat, None, quote.id, int(time.time())), speech)
+        if not total:
+            return handler_input.response_builder.speak(speech).ask(speech).response
+
+        return renderer.render(handler_input, "{} {}".format(speech, get_random_yes_no_question()), get_random_yes_no_question(),
+                               "{} {}".format(total, fiat), "Portfolio", HINTS["HowMuch", CRYPTO_SYMBOLS[0], fiat])
 
 class RepeatHandler(AbstractRequestHandler):
     """Repeat last fact/legend."""
@@ -651,7 +2411,14 @@ class RepeatHandler(AbstractRequestHandler):
     def handle(self, handler_input):
         logger.info("In RepeatHandler")
 
-        return handler_input.response_builder.speak("{}".format(handler_input.attributes_manager.session_attributes["lastSpeech"])).response
+        session_attributes = handler_input.attributes_manager.session_attributes
+        if "last" in session_attributes:
+            speech = render_last_answer(LastAnswer(*session_attributes["last"]), session_attributes.get(HOLDINGS_KEY))
+        else:
+            # Sessions started before the state was made compact.
+            speech = session_attributes["lastSpeech"]
+
+        return handler_input.response_builder.speak(speech).response
 
 class HelpIntentHandler(AbstractRequestHandler):
     def can_handle(self, handler_input):
@@ -661,9 +2428,8 @@ class HelpIntentHandler(AbstractRequestHandler):
         # type: (HandlerInput) -> Response
         logger.info("In HelpIntentHandler")
 
-        speech = "Well, my little crypto friend, you basically have two options. You can ask me, for instance, 'How much is 2.5 Bitcoin in U.S. dollars?', or, something like 'How many Bitcoin can I buy for 100 Euro?'. So, how can I help you?"
-
-        handler_input.attributes_manager.session_attributes["lastSpeech"] = speech
+        speech = HELP_SPEECH
+        remember(handler_input, LastAnswer("AMAZON.HelpIntent", None, None, None, None, int(time.time())), speech)
 
         return handler_input.response_builder.speak(speech).ask(speech).response
 
@@ -722,33 +2488,528 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
 
         return handler_input.response_builder.response
 
-class RequestLogger(AbstractRequestInterceptor):
-    """Log the request envelope."""
-    def process(self, handler_input):
-        # type: (HandlerInput) -> None
-        logger.info("Request Envelope: {}".format(handler_input.request_envelope))
+class StaleQuoteExceptionHandler(AbstractExceptionHandler):
+    def can_handle(self, handler_input, exception):
+        # type: (HandlerInput, Exception) -> bool
+        return isinstance(exception, (StaleQuoteError, CircuitOpenError, SingleFlightTimeout, QuorumError))
+
+    def handle(self, handler_input, exception):
+        # type: (HandlerInput, Exception) -> Response
+        logger.warning("Refusing to quote: {}".format(exception))
+
+        request = handler_input.request_envelope.request
+        crypto = fiat = None
+        if isinstance(request, IntentRequest) and request.intent.name == "AMAZON.RepeatIntent":
+            last = handler_input.attributes_manager.session_attributes.get("last")
+            if last:
+                answer = LastAnswer(*last)
+                crypto, fiat = answer.crypto, answer.fiat
+        elif isinstance(request, IntentRequest):
+            slots = slot_resolver.resolve(request.intent.slots)
+            crypto, fiat = slots.crypto, slots.fiat
+        speech = stale_quote_speech(crypto, fiat)
+
+        return handler_input.response_builder.speak(speech).ask(get_random_yes_no_question()).response
+
+class UnsupportedPairExceptionHandler(AbstractExceptionHandler):
+    def can_handle(self, handler_input, exception):
+        # type: (HandlerInput, Exception) -> bool
+        return isinstance(exception, UnsupportedPairError)
 
-class ResponseLogger(AbstractResponseInterceptor):
-    """Log the response envelope."""
+    def handle(self, handler_input, exception):
+        # type: (HandlerInput, Exception) -> Response
+        logger.info("Unsupported pair: {}".format(exception))
+
+        speech = "Sorry, I can only convert {} to {}. What would you like to know?".format(
+            _spoken_list([CRYPTO_CURRENCIES[symbol]["name"] for symbol in CRYPTO_SYMBOLS]),
+            _spoken_list([FIAT_CURRENCIES[symbol]["name"] for symbol in FIAT_SYMBOLS]))
+
+        return handler_input.response_builder.speak(speech).ask(speech).response
+
+def _parse_sample_rates(spec):
+    # type: (str) -> Dict[str, float]
+    """Parse "LaunchRequest=1,HowManyCryptoCanIBuy=0.2,*=0.05" into a dict."""
+    rates = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, _, rate = item.partition("=")
+            rates[name.strip()] = float(rate)
+    return rates
+
+LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "*=0.1"))
+LOG_MAX_STRING = int(os.environ.get("LOG_MAX_STRING", "256"))
+LOG_MAX_PAYLOAD = int(os.environ.get("LOG_MAX_PAYLOAD", "8192"))
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "") == "1"
+LOG_REDACTED_KEYS = frozenset(["apiAccessToken", "accessToken", "consentToken", "userId", "deviceId", "personId"])
+
+_log_sampler = random.Random()
+_log_serializer = SkillSerializer()
+
+def should_sample(name):
+    """Decide whether the request or intent called `name` gets payload logging."""
+    # type: (str) -> bool
+    rate = LOG_SAMPLE_RATES.get(name, LOG_SAMPLE_RATES.get("*", 1.0))
+    return rate >= 1.0 or (rate > 0 and _log_sampler.random() < rate)
+
+def _redact(value):
+    # type: (Any) -> Any
+    """Return a copy of a serialized payload with secrets masked and long strings cut."""
+    if isinstance(value, dict):
+        # The APL document is the same in every response; name it instead.
+        if apl_documents.is_registered(value) and apl_documents.name_of(value) is not None:
+            return "<APL document {}>".format(apl_documents.name_of(value))
+        return {key: "<redacted>" if key in LOG_REDACTED_KEYS else _redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact(item) for item in value]
+    if isinstance(value, str) and len(value) > LOG_MAX_STRING:
+        return "{}...<{} chars>".format(value[:LOG_MAX_STRING], len(value))
+    return value
+
+class StructuredMessage(object):
+    """A log message that renders as one JSON line when, and only if, it is emitted.
+
+    Pass it as a logging argument (`logger.info("%s", message)`), so that
+    the payload is serialized, redacted and truncated by the handler that
+    writes it instead of on the request path.
+    """
+    __slots__ = ("fields", "payload")
+
+    def __init__(self, payload=None, **fields):
+        # type: (Any, Any) -> None
+        self.fields = fields
+        self.payload = payload
+
+    def __str__(self):
+        # type: () -> str
+        fields = dict(self.fields)
+        if self.payload is not None:
+            # A payload serialized for sending is logged as it is.
+            payload = self.payload if isinstance(self.payload, dict) else _log_serializer.serialize(self.payload)
+            payload = _redact(payload)
+            text = json.dumps(payload, separators=(",", ":"), default=str)
+            if len(text) > LOG_MAX_PAYLOAD:
+                payload = {"truncated": len(text), "head": text[:LOG_MAX_PAYLOAD]}
+            fields["payload"] = payload
+        return json.dumps(fields, separators=(",", ":"), default=str)
+
+def get_request_name(handler_input):
+    """Return the intent name, or the request type for non-intent requests."""
+    # type: (HandlerInput) -> str
+    return _request_name(handler_input.request_envelope.request)
+
+def _request_name(request):
+    # type: (Request) -> str
+    intent = getattr(request, "intent", None)
+    return intent.name if intent is not None else request.object_type
+
+def enable_async_logging():
+    """Hand log records to a background thread instead of writing them inline.
+
+    Records are queued unformatted, so payload rendering happens on the
+    listener thread as well.
+    """
+    # type: () -> None
+    import atexit
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+
+    class DeferredQueueHandler(QueueHandler):
+        def prepare(self, record):
+            return record
+
+    handlers = logging.getLogger().handlers or [logging.StreamHandler()]
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(DeferredQueueHandler(records))
+    logger.propagate = False
+
+if LOG_ASYNC:
+    enable_async_logging()
+
+class HoldingsWriteBehind(AbstractResponseInterceptor):
+    """Save changed holdings once, on the response that ends the session.
+
+    A reply that neither reprompts, keeps the session open nor delegates
+    to the dialog lets the session close without a SessionEndedRequest
+    ever reaching us, so any such response counts as the end.
+    """
     def process(self, handler_input, response):
         # type: (HandlerInput, Response) -> None
-        logger.info("Response: {}".format(response))
-
-sb = StandardSkillBuilder()
+        if response is not None and (response.reprompt is not None or response.should_end_session is False or
+                                     any(directive.object_type.startswith("Dialog.") for directive in response.directives or [])):
+            return
+        if save_holdings(handler_input):
+            logger.info("Saved holdings at the end of the session")
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "BuyBitcoin")
+EMIT_METRICS = os.environ.get("EMIT_METRICS", "1" if "AWS_LAMBDA_FUNCTION_NAME" in os.environ else "0") == "1"
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", "10000"))
+
+class LatencyStats(object):
+    """Keep the most recent phase timings per request name for percentiles."""
+    def __init__(self, window):
+        # type: (int) -> None
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        # type: (RequestTimings) -> None
+        with self._lock:
+            for phase, elapsed_ms in timings.phases.items():
+                samples = self._samples.get((timings.name, phase))
+                if samples is None:
+                    samples = self._samples[timings.name, phase] = deque(maxlen=self.window)
+                samples.append(elapsed_ms)
+
+    def summary(self):
+        # type: () -> Dict[str, Dict[str, Dict[str, float]]]
+        """Return count and p50/p95/p99 in ms for every request name and phase."""
+        with self._lock:
+            snapshot = {key: sorted(samples) for key, samples in self._samples.items()}
+
+        summary = {}
+        for (name, phase), samples in snapshot.items():
+            summary.setdefault(name, {})[phase] = {
+                "count": len(samples),
+                "p50": samples[int(0.50 * (len(samples) - 1))],
+                "p95": samples[int(0.95 * (len(samples) - 1))],
+                "p99": samples[int(0.99 * (len(samples) - 1))],
+            }
+        return summary
+
+    def reset(self):
+        # type: () -> None
+        with self._lock:
+            self._samples.clear()
+
+latency_stats = LatencyStats(METRICS_WINDOW)
+
+_PHASE_METRICS = (("dispatch", "Dispatch"), ("upstream", "UpstreamFetch"), ("render", "Render"))
+# One count per quote source, so that every priced request adds 1 to exactly one of them.
+_CACHE_METRICS = (("hit", "PriceCacheHit"), ("stale", "PriceCacheStale"), ("miss", "PriceCacheMiss"),
+                  ("table", "PriceTableHit"), ("stream", "PriceStreamHit"))
+
+def format_emf(timings):
+    """Return the timings as one CloudWatch embedded metric format line."""
+    # type: (RequestTimings) -> str
+    record = {"Intent": timings.name}
+    metrics = []
+    for phase, metric in _PHASE_METRICS:
+        if phase in timings.phases:
+            record[metric] = round(timings.phases[phase], 3)
+            metrics.append({"Name": metric, "Unit": "Milliseconds"})
+    if timings.cache is not None:
+        for outcome, metric in _CACHE_METRICS:
+            record[metric] = 1 if timings.cache == outcome else 0
+            metrics.append({"Name": metric, "Unit": "Count"})
+    if timings.response_bytes is not None:
+        record["ResponseBytes"] = timings.response_bytes
+        metrics.append({"Name": "ResponseBytes", "Unit": "Bytes"})
+
+    record["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{"Namespace": METRICS_NAMESPACE, "Dimensions": [["Intent"]], "Metrics": metrics}]
+    }
+    return json.dumps(record, separators=(",", ":"))
+
+# EMF lines must be the whole log event, so they go through a logger of their
+# own that writes the bare line to stdout instead of the root handler's format.
+metrics_logger = logging.getLogger(__name__ + ".metrics")
+metrics_logger.setLevel(logging.INFO)
+metrics_logger.propagate = False
+_metrics_handler = logging.StreamHandler(sys.stdout)
+_metrics_handler.setFormatter(logging.Formatter("%(message)s"))
+metrics_logger.addHandler(_metrics_handler)
+
+def finish_timings():
+    """Finish timing the request running on this thread and emit its metrics."""
+    # type: () -> None
+    timings = current_timings()
+    if timings is None:
+        return
+    _request_context.timings = None
+
+    timings.add("dispatch", (time.perf_counter() - timings.started) * 1000.0)
+    latency_stats.record(timings)
+
+    if EMIT_METRICS:
+        metrics_logger.info(format_emf(timings))
+
+class MeteredSkill(CustomSkill):
+    """A skill that times, sizes and logs every invocation, however it ends.
+
+    The SDK skips the response interceptors when a handler raises, so this
+    is done around `invoke` instead: requests that end in an exception
+    handler are measured too, and their timings never linger on the thread
+    for the next request. The response envelope is serialized here, once:
+    its size is what is sent, the sampled response log gets the serialized
+    payload, and the caller serializing the envelope gets it back.
+    """
+    def invoke(self, request_envelope, context):
+        # type: (RequestEnvelope, Any) -> ResponseEnvelope
+        name = _request_name(request_envelope.request)
+        request_id = request_envelope.request.request_id
+        _request_context.timings = timings = RequestTimings(name)
+        try:
+            sampled = logger.isEnabledFor(logging.INFO) and should_sample(name)
+            if sampled:
+                logger.info("%s", StructuredMessage(request_envelope, event="request", name=name, requestId=request_id))
+
+            response_envelope = super(MeteredSkill, self).invoke(request_envelope=request_envelope, context=context)
+            serialized, timings.response_bytes = serialize_once(response_envelope)
+
+            if sampled:
+                logger.info("%s", StructuredMessage(serialized, event="response", name=name, requestId=request_id,
+                                                    bytes=timings.response_bytes))
+            return response_envelope
+        finally:
+            finish_timings()
+
+SKILL_BUILDER_MODE = os.environ.get("SKILL_BUILDER_MODE", "core")
+PERSISTENCE_TABLE = os.environ.get("PERSISTENCE_TABLE")
+PERSISTENCE_ENDPOINT = os.environ.get("PERSISTENCE_ENDPOINT")
+
+def create_skill_builder(mode, table_name=None, endpoint_url=None):
+    """Return the skill builder for `mode`, with persistence only if asked for.
+
+    "core" is the plain ask_sdk_core builder. It gets a DynamoDB
+    persistence adapter only when `table_name` is set, so boto3 is not
+    even imported otherwise. "standard" is ask_sdk's StandardSkillBuilder,
+    which also adds the default API client. `endpoint_url` points the
+    adapter at DynamoDB Local or another stand-in instead of AWS.
+    """
+    # type: (str, Union[str, None], Union[str, None]) -> SkillBuilder
+    dynamodb = {}
+    if table_name and endpoint_url:
+        import boto3
+        dynamodb["dynamodb_resource"] = boto3.resource("dynamodb", endpoint_url=endpoint_url)
+
+    if mode == "standard":
+        from ask_sdk.standard import StandardSkillBuilder
+        return StandardSkillBuilder(table_name=table_name, dynamodb_client=dynamodb.get("dynamodb_resource"))
+
+    if mode != "core":
+        raise ValueError("Unknown SKILL_BUILDER_MODE: {}".format(mode))
+
+    if table_name:
+        from ask_sdk_core.skill_builder import CustomSkillBuilder
+        from ask_sdk_dynamodb.adapter import DynamoDbAdapter
+        return CustomSkillBuilder(persistence_adapter=DynamoDbAdapter(table_name=table_name, **dynamodb))
+
+    from ask_sdk_core.skill_builder import SkillBuilder
+    return SkillBuilder()
+
+sb = create_skill_builder(SKILL_BUILDER_MODE, PERSISTENCE_TABLE, PERSISTENCE_ENDPOINT)
 
 sb.add_request_handler(LaunchRequestHandler())
 sb.add_request_handler(InProgressHowMuchIntent())
 sb.add_request_handler(InProgressHowManyIntent())
 sb.add_request_handler(HowMuchIsCryptoInFiat())
 sb.add_request_handler(HowManyCryptoCanIBuy())
+sb.add_request_handler(PriceHistoryHandler())
+sb.add_request_handler(SetPriceAlertHandler())
+sb.add_request_handler(SetHoldingsHandler())
+sb.add_request_handler(PortfolioValueHandler())
 sb.add_request_handler(HelpIntentHandler())
 sb.add_request_handler(FallbackIntentHandler())
 sb.add_request_handler(SessionEndedHandler())
 sb.add_request_handler(RepeatHandler())
+sb.add_exception_handler(StaleQuoteExceptionHandler())
+sb.add_exception_handler(UnsupportedPairExceptionHandler())
 sb.add_exception_handler(CatchAllExceptionHandler())
-sb.add_global_request_interceptor(RequestLogger())
-sb.add_global_response_interceptor(ResponseLogger())
+sb.add_global_response_interceptor(HoldingsWriteBehind())
+sb.add_global_response_interceptor(ResponseOptimizer())
+
+skill = MeteredSkill(skill_configuration=sb.skill_configuration)
+skill.serializer = SkillSerializer()
+
+def warmup_handler(event, context):
+    """Entry point for a scheduled trigger that keeps the price table warm."""
+    # type: (Dict[str, Any], Any) -> Dict[str, Any]
+    quote = price_cache.prefetch()
+    logger.info("Warm-up refreshed prices: {}".format(price_cache.stats))
+
+    return {"fetchedAt": quote.fetched_at, "stats": dict(price_cache.stats)}
+
+def lambda_handler(event, context):
+    """Entry point for AWS Lambda, reusing the skill built at cold start."""
+    # type: (Dict[str, Any], Any) -> Dict[str, Any]
+    if event.get("source") == "aws.events":
+        # A scheduled rule pointed at the skill function itself.
+        return warmup_handler(event, context)
+
+    request_envelope = skill.serializer.deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
+    response_envelope = skill.invoke(request_envelope=request_envelope, context=context)
+    return skill.serializer.serialize(response_envelope)
+
+PRICED_INTENTS = frozenset(["HowMuchIsCryptoInFiat", "HowManyCryptoCanIBuy", "PortfolioValueIntent",
+                            "SetPriceAlertIntent"])
+# Until their dialog is COMPLETED, these are only delegated back to Alexa.
+DIALOG_INTENTS = frozenset(["HowMuchIsCryptoInFiat", "HowManyCryptoCanIBuy"])
+
+def needs_quote(event):
+    """Tell from the raw event whether handling it will price something.
+
+    A Repeat does when the answer it repeats was priced and has dropped
+    out of the repeat cache, since it is then priced again.
+    """
+    # type: (Dict[str, Any]) -> bool
+    request = event.get("request") or {}
+    if request.get("type") != "IntentRequest":
+        return False
+
+    name = (request.get("intent") or {}).get("name")
+    if name == "AMAZON.RepeatIntent":
+        last = ((event.get("session") or {}).get("attributes") or {}).get("last")
+        return bool(last) and last[0] in PRICED_INTENTS and repeat_cache.get(LastAnswer(*last)) is None
+    if name in DIALOG_INTENTS:
+        return request.get("dialogState") == "COMPLETED"
+    return name in PRICED_INTENTS
+
+async def async_lambda_handler(event, context=None):
+    """Entry point for an asyncio web host.
+
+    The price fetch is the only I/O a request does, so it is awaited here,
+    through a non-blocking client and shared by every request waiting on
+    it, and the handlers then run on the loop without blocking it.
+    """
+    # type: (Dict[str, Any], Any) -> Dict[str, Any]
+    if event.get("source") == "aws.events":
+        quote = await price_cache.prefetch_async()
+        return {"fetchedAt": quote.fetched_at, "stats": dict(price_cache.stats)}
+
+    # Look at the raw event, so a needed fetch is on its way before the
+    # envelope is deserialized.
+    prefetched = None
+    if needs_quote(event) and get_local_quote() is None:
+        started = time.perf_counter()
+        quote, error, outcome = None, None, "miss"
+        try:
+            quote, outcome = await price_cache.get_async()
+        except Exception as e:
+            error = e
+        prefetched = PrefetchedQuote(quote, error, outcome, (time.perf_counter() - started) * 1000.0)
+
+    request_envelope = skill.serializer.deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
 
-lambda_handler = sb.lambda_handler()
+    # Nothing below awaits, so the thread-local context belongs to this request.
+    _request_context.prefetched = prefetched
+    try:
+        response_envelope = skill.invoke(request_envelope=request_envelope, context=context)
+    finally:
+        _request_context.prefetched = None
+    return skill.serializer.serialize(response_envelope)
+
+def build_slot_types(cryptos=None, fiats=None):
+    """Return the cryptoCoin and fiatCoin slot types for the interaction model."""
+    # type: (List[str], List[str]) -> List[Dict[str, Any]]
+    cryptos = cryptos or CRYPTO_SYMBOLS
+    fiats = fiats or FIAT_SYMBOLS
+
+    return [
+        {
+            "name": "cryptoCoin",
+            "values": [{"id": symbol, "name": {"value": CRYPTO_CURRENCIES[symbol]["name"],
+                                               "synonyms": CRYPTO_CURRENCIES[symbol]["synonyms"]}}
+                       for symbol in cryptos]
+        },
+        {
+            "name": "fiatCoin",
+            "values": [{"id": symbol, "name": {"value": symbol,
+                                               "synonyms": FIAT_CURRENCIES[symbol]["synonyms"]}}
+                       for symbol in fiats]
+        }
+    ]
+
+slot_resolver = SlotResolver.from_interaction_model(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "buybitcoin.json"))
+
+def _value_aliases(value):
+    # type: (Dict[str, Any]) -> set
+    return {_normalize(alias) for alias in [value["name"]["value"]] + value["name"].get("synonyms", [])}
+
+def merge_slot_types(deployed, generated):
+    """Add the generated slot values and synonyms to the deployed types, keeping what was edited by hand.
+
+    A generated value is matched to a deployed one by id or by any shared
+    name. Deployed names and synonyms stay as they are; missing synonyms,
+    ids and values are added.
+    """
+    # type: (List[Dict[str, Any]], List[Dict[str, Any]]) -> List[Dict[str, Any]]
+    types = OrderedDict((slot_type["name"], slot_type) for slot_type in deployed)
+    for slot_type in generated:
+        existing = types.setdefault(slot_type["name"], {"name": slot_type["name"], "values": []})
+        for value in slot_type["values"]:
+            aliases = _value_aliases(value)
+            match = next((candidate for candidate in existing["values"]
+                          if candidate.get("id") == value["id"] or aliases & _value_aliases(candidate)), None)
+            if match is None:
+                existing["values"].append(value)
+                continue
+
+            match.setdefault("id", value["id"])
+            synonyms = match["name"].setdefault("synonyms", [])
+            # Alexa matches "btc" and "b.t.c." separately, so only exact repeats are dropped.
+            known = {alias.lower() for alias in [match["name"]["value"]] + synonyms}
+            for synonym in value["name"]["synonyms"]:
+                if synonym.lower() not in known:
+                    synonyms.append(synonym)
+                    known.add(synonym.lower())
+    return list(types.values())
+
+def write_interaction_model(file_path):
+    """Merge the slot types generated from the registry into the interaction model."""
+    # type: (str) -> None
+    with open(file_path) as f:
+        model = json.load(f)
+
+    language_model = model["interactionModel"]["languageModel"]
+    language_model["types"] = merge_slot_types(language_model["types"], build_slot_types())
+
+    with open(file_path, "w", newline="\r\n") as f:
+        json.dump(model, f, indent=4)
+
+def run_quote_refresher(path=QUOTE_TABLE_PATH, interval=QUOTE_REFRESH_INTERVAL):
+    """Run as the host's quote table refresher until SIGTERM/SIGINT."""
+    # type: (str, float) -> None
+    import signal
+    from quotetable import QuoteTableWriter
+
+    if not path:
+        raise SystemExit("Set QUOTE_TABLE_PATH to the quote table file, e.g. /dev/shm/buybitcoin-quotes")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+
+    writer = QuoteTableWriter(path, CRYPTO_SYMBOLS, FIAT_SYMBOLS)
+    logger.info("Refreshing {} every {}s".format(path, interval))
+    refresh_quote_table(writer, interval, stop)
+    writer.close()
+
+USAGE = """usage: python buybitcoin.py COMMAND
+
+commands:
+  write-model     merge the currency registry into the slot types in buybitcoin.json
+  refresh-quotes  keep the quote table at QUOTE_TABLE_PATH fresh until stopped
+  apl-package     print the APL package to host at APL_PACKAGE_URL"""
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["write-model"]:
+        write_interaction_model(os.path.join(os.path.dirname(os.path.abspath(__file__)), "buybitcoin.json"))
+    elif sys.argv[1:2] == ["refresh-quotes"]:
+        logging.basicConfig()
+        run_quote_refresher()
+    elif sys.argv[1:2] == ["apl-package"]:
+        # The package to host at APL_PACKAGE_URL.
+        print(json.dumps(apl_package, separators=(",", ":")))
+    else:
+        # Rewriting the model is never the default; it replaces the slot types in place.
+        print(USAGE, file=sys.stderr)
+        sys.exit(2)
 
 #End of program
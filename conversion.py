@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Exact conversions between crypto amounts and fiat amounts.
+
+Crypto amounts are integer counts of 10**-CRYPTO_DECIMALS coins (satoshis
+for Bitcoin), fiat amounts are integer minor units (cents) and quotes are
+integer fiat units scaled by 10**PRICE_DECIMALS. Nothing goes through a
+float or a formatted string until the result is spoken.
+
+    python conversion.py --amounts 1000
+
+benchmarks batch conversion against the float and "%.8f" path it replaced.
+"""
+import argparse
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Iterable, List, Union
+
+CRYPTO_DECIMALS = 8
+FIAT_DECIMALS = 2
+PRICE_DECIMALS = 8
+
+# fiat minor units * _SCALE / price = crypto units, and back.
+_SCALE = 10 ** (CRYPTO_DECIMALS + PRICE_DECIMALS - FIAT_DECIMALS)
+
+def _div_round(numerator, denominator):
+    # type: (int, int) -> int
+    """Divide two non-negative integers, rounding half to even."""
+    quotient, remainder = divmod(numerator, denominator)
+    if remainder * 2 > denominator or (remainder * 2 == denominator and quotient & 1):
+        quotient += 1
+    return quotient
+
+def parse_amount(integer, decimal, decimals=CRYPTO_DECIMALS):
+    # type: (Union[str, None], Union[str, None], int) -> int
+    """Turn the integer and decimal slot values into 10**-decimals units.
+
+    Either part may be missing. Decimal digits past `decimals` are dropped.
+    """
+    integer = integer or "0"
+    decimal = (decimal or "")[:decimals]
+    return int(integer) * 10 ** decimals + int(decimal.ljust(decimals, "0"))
+
+def price_to_fixed(price):
+    # type: (Union[float, str, Decimal]) -> int
+    """Convert a quote to integer fiat units scaled by 10**PRICE_DECIMALS."""
+    if isinstance(price, float):
+        price = repr(price)
+    return int(Decimal(price).scaleb(PRICE_DECIMALS).to_integral_value(ROUND_HALF_EVEN))
+
+def format_fixed(units, decimals, places, strip=False):
+    # type: (int, int, int, bool) -> str
+    """Format 10**-decimals units with `places` decimal places.
+
+    With `strip`, trailing zeros and a dangling decimal point are removed.
+    """
+    if places < decimals:
+        units = _div_round(units, 10 ** (decimals - places))
+    elif places > decimals:
+        units *= 10 ** (places - decimals)
+
+    whole, fraction = divmod(units, 10 ** places)
+    if places == 0:
+        return str(whole)
+
+    text = "{}.{:0{}d}".format(whole, fraction, places)
+    if strip:
+        text = text.rstrip("0").rstrip(".")
+    return text
+
+def format_amount(units, decimals=CRYPTO_DECIMALS):
+    # type: (int, int) -> str
+    """Format units exactly, without trailing zeros."""
+    return format_fixed(units, decimals, decimals, strip=True)
+
+class QuoteConverter(object):
+    """Convert amounts against one quote.
+
+    The quote is turned into fixed point once, so converting a batch of
+    amounts is plain integer arithmetic per item.
+    """
+    __slots__ = ("price",)
+
+    def __init__(self, price):
+        # type: (Union[float, str, Decimal]) -> None
+        self.price = price_to_fixed(price)
+        if self.price <= 0:
+            raise ValueError("Quote must be positive, got {}".format(price))
+
+    def to_fiat(self, crypto_units):
+        # type: (int) -> int
+        """Return the fiat minor units the crypto amount is worth, rounded half to even."""
+        return _div_round(crypto_units * self.price, _SCALE)
+
+    def to_crypto(self, fiat_units):
+        # type: (int) -> int
+        """Return the crypto units the fiat amount buys, rounded down."""
+        return fiat_units * _SCALE // self.price
+
+    def to_fiat_many(self, crypto_amounts):
+        # type: (Iterable[int]) -> List[int]
+        price = self.price
+        return [_div_round(units * price, _SCALE) for units in crypto_amounts]
+
+    def to_crypto_many(self, fiat_amounts):
+        # type: (Iterable[int]) -> List[int]
+        price = self.price
+        return [units * _SCALE // price for units in fiat_amounts]
+
+def _float_to_crypto(fiat_amounts, price):
+    # type: (Iterable[float], float) -> List[int]
+    """The conversion this module replaced: a float quotient round-tripped through "%.8f"."""
+    return [int(float("%.8f" % (amount / price)) * 10 ** CRYPTO_DECIMALS) for amount in fiat_amounts]
+
+def benchmark(amounts, rounds=200):
+    # type: (int, int) -> Dict[str, float]
+    """Time converting `amounts` fiat amounts to crypto, the fixed-point way and the float way."""
+    import random
+
+    rng = random.Random(42)
+    price = "9000.5"
+    cents = [rng.randrange(1, 10 ** 7) for _ in range(amounts)]
+    floats = [units / 100.0 for units in cents]
+
+    began = time.perf_counter()
+    for _ in range(rounds):
+        converter = QuoteConverter(price)
+        exact = converter.to_crypto_many(cents)
+    fixed_ms = (time.perf_counter() - began) / rounds * 1000
+
+    began = time.perf_counter()
+    for _ in range(rounds):
+        rounded = _float_to_crypto(floats, float(price))
+    float_ms = (time.perf_counter() - began) / rounds * 1000
+
+    return {"amounts": amounts, "fixed_point_ms": round(fixed_ms, 3), "float_format_ms": round(float_ms, 3),
+            "differing_results": sum(1 for a, b in zip(exact, rounded) if a != b)}
+
+def main(argv=None):
+    # type: (List[str]) -> int
+    parser = argparse.ArgumentParser(description="Benchmark fixed-point amount conversion")
+    parser.add_argument("--amounts", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    for key, value in sorted(benchmark(args.amounts, args.rounds).items()):
+        print("{:>18} {}".format(key, value))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,936 @@
+# -*- coding: utf-8 -*-
+"""Replay Alexa request envelopes against lambda_handler, fully offline.
+
+CryptoCompare is replaced by a local stub server that can add latency and
+fail a share of requests. The replay reports requests per second, latency
+percentiles, allocated memory and response size per request, and can save the report as
+a baseline or compare it with an earlier one:
+
+    python loadtest.py --requests 5000 --concurrency 8 --save-baseline base.json
+    python loadtest.py --requests 5000 --concurrency 8 --compare base.json
+
+With --async the envelopes go through async_lambda_handler on one event
+loop instead, with `concurrency` requests in flight at a time. With --web N
+they are POSTed to webservice.py, started with N workers for the run.
+
+--sources 0.02,0.05,0.8 starts one stub per latency and fans the price
+fetch out to all of them (PRICE_SOURCES); add --cache-ttl 0 to fetch on
+every request and see the aggregate latency.
+
+--ticker RATE serves prices from a stub ticker feed sending RATE ticks a
+second (QUOTE_STREAM_URL), and --tick-bench N only measures how fast a
+QuoteStream applies N ticks.
+
+--render-bench N only times building and serializing one response's APL
+directive N times, with the dict literals the handlers used to build and
+with ResponseRenderer.
+
+--import-bench N imports the skill in N fresh interpreters under -X
+importtime and reports the import time and the slowest modules; with
+--import-budget MS it fails when the median is over MS, to catch an
+import creeping back into the cold start.
+
+--cold-start-modes N does the same N times for each skill builder mode
+(core, core with DynamoDB persistence, standard) and compares the median
+import time, process wall time and peak RSS.
+
+--log-sample-rates SPEC, --log-async and --log-to PATH set the request
+logging for a run, and --log-bench replays --requests envelopes with
+logging off, sampled, full and full on a background thread, in a fresh
+process each, to compare what logging costs.
+
+--portfolio-sessions N replays N portfolio sessions (set holdings, ask
+what they are worth, end the session) against a stub DynamoDB reached
+through boto3 (PERSISTENCE_ENDPOINT), and reports the store operations
+per session.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    raise SystemExit("loadtest.py needs Python 3.7+")
+
+STUB_PRICES = {
+    "BTC": {"USD": 9000.5, "EUR": 8100.25, "GBP": 7000.75},
+    "ETH": {"USD": 180.2, "EUR": 162.4, "GBP": 140.1},
+    "LTC": {"USD": 55.3, "EUR": 49.9, "GBP": 43.2},
+}
+
+class StubPriceServer(object):
+    """A local stand-in for CryptoCompare's `pricemulti` endpoint.
+
+    Every response is delayed by `latency` seconds plus up to `jitter`
+    seconds, and a `error_rate` share of requests get a 500.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, prices=None):
+        # type: (float, float, float, Dict[str, Dict[str, float]]) -> None
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.prices = prices or STUB_PRICES
+        self.stats = {"requests": 0, "errors": 0, "connections": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        # type: () -> str
+        return "http://127.0.0.1:{}".format(self._server.server_port)
+
+    def start(self):
+        # type: () -> StubPriceServer
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # type: () -> None
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, query):
+        # type: (Dict[str, List[str]]) -> Tuple[int, Dict[str, Any]]
+        with self._lock:
+            self.stats["requests"] += 1
+            failed = random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return 500, {"Response": "Error", "Message": "injected failure"}
+
+        fsyms = query.get("fsyms", [""])[0].split(",")
+        tsyms = query.get("tsyms", [""])[0].split(",")
+        return 200, {crypto: {fiat: self.prices[crypto][fiat] for fiat in tsyms if fiat in self.prices.get(crypto, {})}
+                     for crypto in fsyms if crypto in self.prices}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with stub._lock:
+                    stub.stats["connections"] += 1
+
+            def do_GET(self):
+                status, result = stub.respond(parse_qs(urlparse(self.path).query))
+                body = json.dumps(result).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+class StubTickerFeed(object):
+    """A local streaming ticker feed: chunked NDJSON ticks on any GET.
+
+    Sends `rate` ticks a second (as fast as it can if 0), random-walking
+    the stub prices, `batch` lines per chunk. After `ticks` ticks the
+    stream ends, so a client has to reconnect.
+    """
+    def __init__(self, rate=10.0, ticks=None, batch=1, prices=None):
+        # type: (float, int, int, Dict[str, Dict[str, float]]) -> None
+        self.rate = rate
+        self.ticks = ticks
+        self.batch = batch
+        self.prices = prices or STUB_PRICES
+        self.stats = {"connections": 0, "ticks": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        # type: () -> str
+        return "http://127.0.0.1:{}/stream".format(self._server.server_port)
+
+    def start(self):
+        # type: () -> StubTickerFeed
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        # type: () -> None
+        self._server.shutdown()
+        self._server.server_close()
+
+    def lines(self):
+        pairs = [(crypto, fiat, price) for crypto, quotes in self.prices.items() for fiat, price in quotes.items()]
+        rng = random.Random(7)
+        sent = 0
+        while self.ticks is None or sent < self.ticks:
+            count = self.batch if self.ticks is None else min(self.batch, self.ticks - sent)
+            chunk = []
+            for _ in range(count):
+                i = rng.randrange(len(pairs))
+                crypto, fiat, price = pairs[i]
+                price *= 1 + rng.uniform(-0.0005, 0.0005)
+                pairs[i] = (crypto, fiat, price)
+                chunk.append(json.dumps({"crypto": crypto, "fiat": fiat, "price": round(price, 2)}))
+            sent += count
+            yield ("\n".join(chunk) + "\n").encode("utf-8"), count
+
+    def _handler_class(self):
+        feed = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with feed._lock:
+                    feed.stats["connections"] += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for data, count in feed.lines():
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                        with feed._lock:
+                            feed.stats["ticks"] += count
+                        if feed.rate:
+                            time.sleep(count / feed.rate)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+class StubDynamoDb(object):
+    """A local DynamoDB stand-in, enough for ask_sdk_dynamodb's adapter.
+
+    Answers GetItem, PutItem and DeleteItem in the DynamoDB JSON protocol,
+    keeps items in memory by table and `key_name`, and counts every
+    operation. Point boto3 at `url` (PERSISTENCE_ENDPOINT) to use it; each
+    call is delayed by `latency` seconds, like a round trip to the service.
+    """
+    def __init__(self, latency=0.0, key_name="id"):
+        # type: (float, str) -> None
+        self.latency = latency
+        self.key_name = key_name
+        self.items = {}  # type: Dict[Tuple[str, str], Dict[str, Any]]
+        self.stats = {"GetItem": 0, "PutItem": 0, "DeleteItem": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        # type: () -> str
+        return "http://127.0.0.1:{}".format(self._server.server_port)
+
+    def start(self):
+        # type: () -> StubDynamoDb
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        # type: () -> None
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, operation, payload):
+        # type: (str, Dict[str, Any]) -> Tuple[int, Dict[str, Any]]
+        if operation not in self.stats:
+            return 400, {"__type": "com.amazonaws.dynamodb.v20120810#UnknownOperationException"}
+        if self.latency:
+            time.sleep(self.latency)
+
+        table = payload["TableName"]
+        key = json.dumps((payload.get("Key") or payload.get("Item"))[self.key_name], sort_keys=True)
+        with self._lock:
+            self.stats[operation] += 1
+            if operation == "GetItem":
+                item = self.items.get((table, key))
+                return 200, {"Item": item} if item is not None else {}
+            if operation == "PutItem":
+                self.items[table, key] = payload["Item"]
+            else:
+                self.items.pop((table, key), None)
+            return 200, {}
+
+    def _handler_class(self):
+        store = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                operation = self.headers.get("X-Amz-Target", "").rpartition(".")[2]
+                status, result = store.respond(operation, payload)
+                body = json.dumps(result).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-amz-json-1.0")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+def portfolio_bench(sessions, store_latency):
+    # type: (int, float) -> Dict[str, Any]
+    """Replay portfolio sessions against a stub DynamoDB and count store operations per session.
+
+    Every user has two sessions, so the second one reads back what the
+    first one saved.
+    """
+    prices = StubPriceServer().start()
+    store = StubDynamoDb(store_latency).start()
+    os.environ.update(CRYPTOCOMPARE_URL=prices.url, PERSISTENCE_TABLE="buybitcoin-loadtest", PERSISTENCE_ENDPOINT=store.url)
+    for key, value in (("AWS_ACCESS_KEY_ID", "loadtest"), ("AWS_SECRET_ACCESS_KEY", "loadtest"),
+                       ("AWS_DEFAULT_REGION", "us-east-1")):
+        os.environ.setdefault(key, value)
+    os.environ.setdefault("EMIT_METRICS", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import buybitcoin
+
+    def holding(crypto, integer, decimal=None):
+        return _intent_request("SetHoldingsIntent", (_slot("crypto", crypto.lower(), crypto), _slot("integer", integer),
+                                                     _slot("decimal", decimal)))
+
+    worth = _intent_request("PortfolioValueIntent", (_slot("fiat", "dollars", "USD"),))
+    turns = [{"type": "LaunchRequest"}, worth, holding("Bitcoin", "0", "3"), holding("Ethereum", "2"), worth,
+             holding("Bitcoin", "0", "5"), _intent_request("PortfolioValueIntent", (_slot("fiat", "euro", "EUR"),)),
+             _intent_request("AMAZON.RepeatIntent"), {"type": "SessionEndedRequest", "reason": "USER_INITIATED"}]
+
+    failures = 0
+    started = time.perf_counter()
+    for session in range(sessions):
+        user_id = "amzn1.ask.account.loadtest{}".format(session // 2)
+        attributes = {}
+        for turn, request in enumerate(turns):
+            envelope = build_envelope(request, attributes=attributes, user_id=user_id, new=turn == 0)
+            response = buybitcoin.lambda_handler(envelope, None)
+            attributes = response.get("sessionAttributes") or {}
+            speech = response["response"].get("outputSpeech", {}).get("ssml", "")
+            if "Sorry" in speech or "I didn't catch" in speech:
+                failures += 1
+    elapsed = time.perf_counter() - started
+
+    saved = {key[1]: item["attributes"]["M"]["holdings"]["M"] for key, item in store.items.items()}
+    expected = {"BTC": {"N": "50000000"}, "ETH": {"N": "200000000"}}
+    failures += sum(1 for holdings in saved.values() if holdings != expected)
+    prices.stop()
+    store.stop()
+    return {"sessions": sessions, "turns_per_session": len(turns), "users": len(saved), "errors": failures,
+            "store": dict(store.stats), "store_ops_per_session": round(sum(store.stats.values()) / float(sessions), 2),
+            "ms_per_session": round(elapsed / sessions * 1000, 2), "store_latency_ms": store_latency * 1000}
+
+def tick_bench(ticks):
+    # type: (int) -> Dict[str, Any]
+    """Measure how fast a QuoteStream applies ticks from the stub feed."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import buybitcoin
+
+    feed = StubTickerFeed(rate=0, ticks=ticks, batch=1000).start()
+    stream = buybitcoin.QuoteStream(feed.url, buybitcoin.CRYPTO_SYMBOLS, buybitcoin.FIAT_SYMBOLS)
+    stream._seed = lambda: None
+    started = time.perf_counter()
+    stream.start()
+    while stream.stats["ticks"] < ticks and time.perf_counter() - started < 120:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    stream.stop()
+
+    began = time.perf_counter()
+    for _ in range(100000):
+        stream.matrix.set("BTC", "USD", 9000.5)
+        stream.connected, stream.updated_at = True, time.time()
+        stream._version += 1
+        stream.get()
+    snapshot_us = (time.perf_counter() - began) / 100000 * 1e6
+    feed.stop()
+    return {"ticks": stream.stats["ticks"], "seconds": round(elapsed, 3),
+            "ticks_per_second": round(stream.stats["ticks"] / elapsed), "changed_quote_get_us": round(snapshot_us, 2)}
+
+def _literal_datasources(primary_text, secondary_text, hint_text):
+    # type: (str, str, str) -> Dict[str, Any]
+    """The bodyTemplate6Data literal every handler built before ResponseRenderer."""
+    background = "https://yakkie.app/wp-content/uploads/2019/09/bbback.png"
+    return {
+        "bodyTemplate6Data": {
+            "type": "object",
+            "objectId": "bt6Sample",
+            "backgroundImage": {
+                "sources": [
+                    {"url": background, "size": "small", "widthPixels": 0, "heightPixels": 0},
+                    {"url": background, "size": "large", "widthPixels": 0, "heightPixels": 0}
+                ]
+            },
+            "textContent": {
+                "primaryText": {"type": "PlainText", "text": primary_text},
+                "secondaryText": {"type": "PlainText", "text": secondary_text}
+            },
+            "logoUrl": "https://yakkie.app/wp-content/uploads/2019/09/buybitcoin.png",
+            "hintText": hint_text
+        }
+    }
+
+def render_bench(rounds):
+    # type: (int) -> Dict[str, Any]
+    """Time building and serializing the APL directive of one response, as before and with ResponseRenderer.
+
+    Before, every handler built the datasource literal and the default
+    serializer walked it and the whole document. Reports microseconds per
+    directive, and the traced memory one directive allocates at its peak
+    and still holds once serialized.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault("EMIT_METRICS", "0")
+    import buybitcoin
+    from ask_sdk_core.serialize import DefaultSerializer
+    from ask_sdk_model.interfaces.alexa.presentation.apl import RenderDocumentDirective
+
+    document = buybitcoin.apl_documents.get(buybitcoin.APL_DOCUMENT)
+    text = ("2.5 Bitcoin", "22501.25 U.S. dollars", "Try, \"How many Bitcoin can I buy with 100 dollars?\"")
+    paths = {
+        "literal": (_literal_datasources, DefaultSerializer()),
+        "renderer": (buybitcoin.renderer.datasources, buybitcoin.skill.serializer),
+    }
+
+    report = {"rounds": rounds}
+    for name, (datasources, serializer) in sorted(paths.items()):
+        def build():
+            return serializer.serialize(RenderDocumentDirective(token="pagerToken", document=document,
+                                                                datasources=datasources(*text)))
+        build()
+        began = time.perf_counter()
+        for _ in range(rounds):
+            build()
+        report[name + "_us"] = round((time.perf_counter() - began) / rounds * 1e6, 2)
+
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            directive = build()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del directive
+        report[name + "_peak_bytes"] = peak - before
+        report[name + "_retained_bytes"] = current - before
+    return report
+
+def _cold_import(environ=None):
+    # type: (Dict[str, str]) -> Dict[str, Any]
+    """Import the skill in a fresh interpreter under -X importtime.
+
+    Returns the cumulative import time of buybitcoin and the self time of
+    every module it imported, both in ms, the wall time of the whole
+    process and its peak resident set size.
+    """
+    env = dict(os.environ, EMIT_METRICS="0", **(environ or {}))
+    script = "import resource, buybitcoin; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    began = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    wall_ms = (time.perf_counter() - began) * 1000
+    modules = {}
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        own, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        modules[name] = int(own) / 1000.0
+        if name == "buybitcoin":
+            total = int(cumulative) / 1000.0
+    # ru_maxrss is in KB on Linux.
+    return {"import_ms": total, "modules": modules, "wall_ms": wall_ms, "max_rss_kb": int(result.stdout.split()[-1])}
+
+def import_bench(runs):
+    # type: (int) -> Dict[str, Any]
+    """Import the skill `runs` times in fresh interpreters and report its import time and the slowest modules."""
+    imports = [_cold_import() for _ in range(runs)]
+    times = sorted(result["import_ms"] for result in imports)
+    slowest = {}
+    for result in imports:
+        for name, ms in result["modules"].items():
+            slowest[name] = slowest.get(name, 0.0) + ms / runs
+    return {"runs": runs, "import_ms": {"p50": round(_percentile(times, 0.5), 1), "max": round(times[-1], 1)},
+            "modules": len(imports[0]["modules"]),
+            "slowest_ms": [[name, round(ms, 2)] for name, ms in sorted(slowest.items(), key=lambda item: -item[1])[:10]]}
+
+# SKILL_BUILDER_MODE and persistence settings to compare cold starts under.
+COLD_START_MODES = {
+    "core": {},
+    "core+dynamodb": {"PERSISTENCE_TABLE": "buybitcoin-loadtest"},
+    "standard": {"SKILL_BUILDER_MODE": "standard"},
+}
+
+def cold_start_bench(runs):
+    # type: (int) -> Dict[str, Any]
+    """Compare the cold start of every COLD_START_MODES entry over `runs` fresh interpreters each."""
+    # Nothing from the caller's environment may switch a mode on.
+    aws = {"AWS_ACCESS_KEY_ID": "loadtest", "AWS_SECRET_ACCESS_KEY": "loadtest", "AWS_DEFAULT_REGION": "us-east-1",
+           "SKILL_BUILDER_MODE": "core", "PERSISTENCE_TABLE": "", "PERSISTENCE_ENDPOINT": ""}
+    report = {"runs": runs}
+    for mode, environ in sorted(COLD_START_MODES.items()):
+        imports = [_cold_import(dict(aws, **environ)) for _ in range(runs)]
+        report[mode] = {key: round(_percentile(sorted(result[key] for result in imports), 0.5), 1)
+                        for key in ("import_ms", "wall_ms", "max_rss_kb")}
+        report[mode]["modules"] = len(imports[0]["modules"])
+    return report
+
+# Request logging settings to compare: name, LOG_SAMPLE_RATES, LOG_ASYNC.
+LOG_CONFIGS = (("off", "*=0", False), ("sampled", "*=0.1", False), ("full", "*=1", False),
+               ("full_async", "*=1", True))
+
+def log_bench(requests, concurrency):
+    # type: (int, int) -> Dict[str, Any]
+    """Replay `requests` envelopes once per LOG_CONFIGS entry and compare throughput and latency.
+
+    The settings are read when the skill is imported, so every replay runs
+    in a fresh process, logging to /dev/null so that records are still
+    formatted and written.
+    """
+    report = {"requests": requests, "concurrency": concurrency}
+    for name, rates, use_async in LOG_CONFIGS:
+        command = [sys.executable, os.path.abspath(__file__), "--requests", str(requests),
+                   "--concurrency", str(concurrency), "--latency", "0", "--log-sample-rates", rates,
+                   "--log-to", os.devnull]
+        if use_async:
+            command.append("--log-async")
+        output = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+        run = json.loads(output)
+        report[name] = dict(run["latency_ms"], rps=run["rps"], errors=run["errors"])
+    return report
+
+class WebService(object):
+    """webservice.py in a child process, with a client that POSTs envelopes to it.
+
+    Each replay thread keeps its own keep-alive connection.
+    """
+    def __init__(self, workers, threads, env):
+        # type: (int, int, Dict[str, str]) -> None
+        probe = socket.socket()
+        probe.bind(("127.0.0.1", 0))
+        self.port = probe.getsockname()[1]
+        probe.close()
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "webservice.py")
+        env = dict(os.environ, VERIFY_SIGNATURES="0", **env)
+        self.process = subprocess.Popen([sys.executable, script, "--host", "127.0.0.1", "--port", str(self.port),
+                                         "--workers", str(workers), "--threads", str(threads)], env=env)
+        self._local = threading.local()
+
+    def wait_ready(self, timeout=30.0):
+        # type: (float) -> None
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.request("GET", "/healthz")
+                return
+            except (OSError, http.client.HTTPException):
+                if time.time() > deadline or self.process.poll() is not None:
+                    raise
+                self._local.connection = None
+                time.sleep(0.1)
+
+    def request(self, method, path, body=None):
+        # type: (str, str, bytes) -> Dict[str, Any]
+        connection = getattr(self._local, "connection", None)
+        reused = connection is not None
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        try:
+            connection.request(method, path, body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            result = json.loads(response.read().decode("utf-8"))
+        except Exception as e:
+            connection.close()
+            self._local.connection = None
+            # The server closes keep-alive connections that sat idle; retry those on a new one.
+            if reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)):
+                return self.request(method, path, body)
+            raise
+        if response.status != 200:
+            raise ValueError("HTTP {}: {}".format(response.status, result))
+        return result
+
+    def __call__(self, envelope, context):
+        # type: (Dict[str, Any], Any) -> Dict[str, Any]
+        return self.request("POST", "/", json.dumps(envelope).encode("utf-8"))
+
+    def stop(self):
+        # type: () -> int
+        self.process.send_signal(signal.SIGTERM)
+        return self.process.wait(timeout=30)
+
+def _slot(name, value=None, resolved=None):
+    # type: (str, str, str) -> Dict[str, Any]
+    slot = {"name": name, "confirmationStatus": "NONE"}
+    if value is not None:
+        slot["value"] = value
+    if resolved is not None:
+        slot["resolutions"] = {"resolutionsPerAuthority": [{
+            "authority": "amzn1.er-authority.echo-sdk.loadtest",
+            "status": {"code": "ER_SUCCESS_MATCH"},
+            "values": [{"value": {"name": resolved, "id": resolved}}]}]}
+    return slot
+
+def _intent_request(name, slots=(), dialog_state=None):
+    # type: (str, Tuple[Dict[str, Any], ...], str) -> Dict[str, Any]
+    request = {"type": "IntentRequest", "intent": {"name": name, "confirmationStatus": "NONE",
+                                                   "slots": {slot["name"]: slot for slot in slots}}}
+    if dialog_state:
+        request["dialogState"] = dialog_state
+    return request
+
+def build_envelope(request, apl=True, attributes=None, user_id="amzn1.ask.account.loadtest", new=False):
+    # type: (Dict[str, Any], bool, Dict[str, Any], str, bool) -> Dict[str, Any]
+    """Wrap a request in a realistic envelope for an APL or a voice-only device."""
+    request = dict(request, requestId="amzn1.echo-api.request.loadtest", timestamp="2019-10-01T12:00:00Z", locale="en-US")
+    interfaces = {"Alexa.Presentation.APL": {"runtime": {"maxVersion": "1.1"}}} if apl else {}
+    return {
+        "version": "1.0",
+        "session": {"new": new, "sessionId": "amzn1.echo-api.session.loadtest",
+                    "application": {"applicationId": "amzn1.ask.skill.loadtest"},
+                    "attributes": attributes or {}, "user": {"userId": user_id}},
+        "context": {"System": {"application": {"applicationId": "amzn1.ask.skill.loadtest"},
+                               "user": {"userId": user_id},
+                               "device": {"deviceId": "amzn1.ask.device.loadtest", "supportedInterfaces": interfaces},
+                               "apiEndpoint": "https://api.amazonalexa.com",
+                               "apiAccessToken": "loadtest"}},
+        "request": request,
+    }
+
+def build_scenarios():
+    # type: () -> List[Tuple[str, Dict[str, Any]]]
+    """Return (name, envelope) pairs covering every handler on both device kinds."""
+    conversion_slots = (_slot("crypto", "bitcoin", "Bitcoin"), _slot("fiat", "dollars", "USD"),
+                        _slot("integer", "2"), _slot("decimal", "5"))
+    requests = [
+        ("LaunchRequest", {"type": "LaunchRequest"}),
+        ("HowMuchIsCryptoInFiat.STARTED", _intent_request("HowMuchIsCryptoInFiat", conversion_slots[:1], "STARTED")),
+        ("HowMuchIsCryptoInFiat.COMPLETED", _intent_request("HowMuchIsCryptoInFiat", conversion_slots, "COMPLETED")),
+        ("HowManyCryptoCanIBuy.STARTED", _intent_request("HowManyCryptoCanIBuy", conversion_slots[:1], "STARTED")),
+        ("HowManyCryptoCanIBuy.COMPLETED", _intent_request("HowManyCryptoCanIBuy", (
+            _slot("crypto", "bitcoin", "Bitcoin"), _slot("fiat", "euro", "EUR"), _slot("integer", "100"), _slot("decimal")),
+            "COMPLETED")),
+        ("AMAZON.RepeatIntent", _intent_request("AMAZON.RepeatIntent")),
+        ("AMAZON.HelpIntent", _intent_request("AMAZON.HelpIntent")),
+        ("AMAZON.FallbackIntent", _intent_request("AMAZON.FallbackIntent")),
+        ("SessionEndedRequest", {"type": "SessionEndedRequest", "reason": "USER_INITIATED"}),
+    ]
+    attributes = {"last": ["HowMuchIsCryptoInFiat", "BTC", "USD", 250000000, 1700000000000, 1700000000]}
+
+    scenarios = []
+    for apl in (True, False):
+        for name, request in requests:
+            scenarios.append(("{}{}".format(name, "" if apl else ".voice"), build_envelope(request, apl, attributes)))
+    return scenarios
+
+def _percentile(sorted_values, fraction):
+    # type: (List[float], float) -> float
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(fraction * (len(sorted_values) - 1))]
+
+def replay(handler, scenarios, total, concurrency):
+    # type: (Any, List[Tuple[str, Dict[str, Any]]], int, int) -> Dict[str, Any]
+    """Send `total` envelopes, cycling through `scenarios`, from `concurrency` threads."""
+    latencies = []
+    failures = []
+
+    def invoke(index):
+        envelope = scenarios[index % len(scenarios)][1]
+        started = time.perf_counter()
+        try:
+            result = handler(envelope, None)
+            if "response" not in result:
+                raise ValueError("no response in result")
+        except Exception as e:
+            failures.append("{}: {}".format(scenarios[index % len(scenarios)][0], e))
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(invoke, range(total)))
+    return _report(latencies, failures, total, concurrency, time.perf_counter() - started)
+
+def replay_async(handler, scenarios, total, concurrency):
+    # type: (Any, List[Tuple[str, Dict[str, Any]]], int, int) -> Dict[str, Any]
+    """Like `replay`, for a coroutine handler, with `concurrency` requests in flight on one loop."""
+    latencies = []
+    failures = []
+
+    async def invoke(index, slots):
+        async with slots:
+            envelope = scenarios[index % len(scenarios)][1]
+            started = time.perf_counter()
+            try:
+                result = await handler(envelope, None)
+                if "response" not in result:
+                    raise ValueError("no response in result")
+            except Exception as e:
+                failures.append("{}: {}".format(scenarios[index % len(scenarios)][0], e))
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    async def run():
+        slots = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*[invoke(index, slots) for index in range(total)])
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return _report(latencies, failures, total, concurrency, time.perf_counter() - started)
+
+def _report(latencies, failures, total, concurrency, elapsed):
+    # type: (List[float], List[str], int, int, float) -> Dict[str, Any]
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": len(failures),
+        "error_samples": failures[:5],
+        "rps": round(total / elapsed, 1),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50), 3),
+            "p95": round(_percentile(latencies, 0.95), 3),
+            "p99": round(_percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+    }
+
+def measure_memory(handler, scenarios, rounds=5):
+    # type: (Any, List[Tuple[str, Dict[str, Any]]], int) -> Dict[str, float]
+    """Return the mean peak and retained traced memory per request, in KB."""
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for _ in range(rounds):
+            for _, envelope in scenarios:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                handler(envelope, None)
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained.append(current - before)
+    finally:
+        tracemalloc.stop()
+
+    return {"peak_kb_per_request": round(sum(peaks) / len(peaks) / 1024.0, 2),
+            "retained_kb_per_request": round(sum(retained) / len(retained) / 1024.0, 2)}
+
+def measure_response_sizes(handler, scenarios):
+    # type: (Any, List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]
+    """Return the size in bytes of every scenario's response as JSON, with the mean on APL and voice devices."""
+    sizes = {name: len(json.dumps(handler(envelope, None)).encode("utf-8")) for name, envelope in scenarios}
+    voice = [size for name, size in sizes.items() if name.endswith(".voice")]
+    apl = [size for name, size in sizes.items() if not name.endswith(".voice")]
+    return {"mean": round(sum(sizes.values()) / float(len(sizes)), 1), "apl_mean": round(sum(apl) / float(len(apl)), 1),
+            "voice_mean": round(sum(voice) / float(len(voice)), 1), "max": max(sizes.values()), "scenarios": sizes}
+
+def compare(baseline, report):
+    # type: (Dict[str, Any], Dict[str, Any]) -> List[str]
+    """Return one line per tracked metric with its change against the baseline."""
+    metrics = [("rps", ("rps",)), ("p50 ms", ("latency_ms", "p50")), ("p95 ms", ("latency_ms", "p95")),
+               ("p99 ms", ("latency_ms", "p99")), ("peak KB/request", ("memory", "peak_kb_per_request")),
+               ("response bytes", ("response_bytes", "mean")), ("APL bytes", ("response_bytes", "apl_mean")),
+               ("errors", ("errors",))]
+    lines = []
+    for label, path in metrics:
+        old, new = baseline, report
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else None
+            new = new.get(key, {}) if isinstance(new, dict) else None
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        change = (new - old) / old * 100.0 if old else 0.0
+        lines.append("{:<18} {:>12} -> {:>12}  ({:+.1f}%)".format(label, old, new, change))
+    return lines
+
+def main(argv=None):
+    # type: (List[str]) -> int
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random stub latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub requests that fail")
+    parser.add_argument("--sources", metavar="LATENCIES", help="comma-separated latencies of several stub sources")
+    parser.add_argument("--skew", type=float, default=0.0, help="scale the first source's prices by 1 + SKEW")
+    parser.add_argument("--ticker", type=float, metavar="RATE", help="stream prices from a stub feed sending RATE ticks a second")
+    parser.add_argument("--tick-bench", type=int, metavar="TICKS", help="only measure how fast ticks are applied")
+    parser.add_argument("--render-bench", type=int, metavar="ROUNDS",
+                        help="only time building one response's APL directive, as before and with ResponseRenderer")
+    parser.add_argument("--import-bench", type=int, metavar="RUNS",
+                        help="only time importing the skill in RUNS fresh interpreters, with -X importtime")
+    parser.add_argument("--import-budget", type=float, metavar="MS",
+                        help="with --import-bench, fail when the median import takes longer than MS")
+    parser.add_argument("--cold-start-modes", type=int, metavar="RUNS",
+                        help="only compare import time, wall time and peak RSS of the skill builder modes")
+    parser.add_argument("--log-sample-rates", metavar="SPEC", help="LOG_SAMPLE_RATES for the run, e.g. '*=1'")
+    parser.add_argument("--log-async", action="store_true", help="set LOG_ASYNC=1 for the run")
+    parser.add_argument("--log-to", metavar="PATH", help="write the skill's INFO log to PATH (e.g. /dev/null)")
+    parser.add_argument("--log-bench", action="store_true",
+                        help="only compare replays with request logging off, sampled, full and full on a thread")
+    parser.add_argument("--portfolio-sessions", type=int, metavar="N",
+                        help="only replay N portfolio sessions against a stub DynamoDB and count store operations")
+    parser.add_argument("--store-latency", type=float, default=0.01, help="stub DynamoDB latency in seconds")
+    parser.add_argument("--cache-ttl", type=float, help="override PRICE_CACHE_TTL for the run")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="replay through async_lambda_handler")
+    parser.add_argument("--web", type=int, metavar="WORKERS", help="replay over HTTP against webservice.py")
+    parser.add_argument("--web-threads", type=int, default=16, help="threads per webservice.py worker")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    args = parser.parse_args(argv)
+
+    if args.tick_bench:
+        print(json.dumps(tick_bench(args.tick_bench), indent=2, sort_keys=True))
+        return 0
+
+    if args.render_bench:
+        print(json.dumps(render_bench(args.render_bench), indent=2, sort_keys=True))
+        return 0
+
+    if args.import_bench:
+        report = import_bench(args.import_bench)
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return 1 if args.import_budget and report["import_ms"]["p50"] > args.import_budget else 0
+
+    if args.cold_start_modes:
+        print(json.dumps(cold_start_bench(args.cold_start_modes), indent=2, sort_keys=True))
+        return 0
+
+    if args.log_bench:
+        report = log_bench(args.requests, args.concurrency)
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return 1 if any(report[name]["errors"] for name, _, _ in LOG_CONFIGS) else 0
+
+    if args.portfolio_sessions:
+        report = portfolio_bench(args.portfolio_sessions, args.store_latency)
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return 1 if report["errors"] else 0
+
+    latencies = [float(latency) for latency in args.sources.split(",")] if args.sources else [args.latency]
+    stubs = []
+    for i, latency in enumerate(latencies):
+        factor = 1 + args.skew if i == 0 else 1
+        prices = {crypto: {fiat: price * factor for fiat, price in quotes.items()} for crypto, quotes in STUB_PRICES.items()}
+        stubs.append(StubPriceServer(latency, args.jitter, args.error_rate, prices).start())
+    os.environ["CRYPTOCOMPARE_URL"] = stubs[0].url
+    if args.sources:
+        os.environ["PRICE_SOURCES"] = ",".join(stub.url for stub in stubs)
+    feed = None
+    if args.ticker:
+        feed = StubTickerFeed(args.ticker).start()
+        os.environ["QUOTE_STREAM_URL"] = feed.url
+    os.environ.setdefault("EMIT_METRICS", "0")
+    if args.log_sample_rates is not None:
+        os.environ["LOG_SAMPLE_RATES"] = args.log_sample_rates
+    if args.log_async:
+        os.environ["LOG_ASYNC"] = "1"
+    if args.log_to:
+        # Before the skill is imported, so LOG_ASYNC hands records to this handler.
+        logging.basicConfig(filename=args.log_to, level=logging.INFO)
+    if args.cache_ttl is not None:
+        os.environ["PRICE_CACHE_TTL"] = str(args.cache_ttl)
+
+    scenarios = build_scenarios()
+
+    if args.web:
+        service = WebService(args.web, args.web_threads, {key: os.environ[key] for key in
+                                                          ("CRYPTOCOMPARE_URL", "PRICE_SOURCES", "QUOTE_STREAM_URL",
+                                                           "EMIT_METRICS", "PRICE_CACHE_TTL", "APL_PACKAGE_URL",
+                                                           "LOG_SAMPLE_RATES", "LOG_ASYNC")
+                                                          if key in os.environ})
+        try:
+            service.wait_ready()
+            for _, envelope in scenarios:
+                service(envelope, None)
+            report = replay(service, scenarios, args.requests, args.concurrency)
+            report["price_cache"] = service.request("GET", "/healthz")["priceCache"]
+            report["response_bytes"] = measure_response_sizes(service, scenarios)
+        finally:
+            report_exit = service.stop()
+        report["web"] = {"workers": args.web, "threads": args.web_threads, "exit_status": report_exit}
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import buybitcoin
+
+        for _, envelope in scenarios:
+            buybitcoin.lambda_handler(envelope, None)
+        buybitcoin.latency_stats.reset()
+
+        if args.use_async:
+            report = replay_async(buybitcoin.async_lambda_handler, scenarios, args.requests, args.concurrency)
+        else:
+            report = replay(buybitcoin.lambda_handler, scenarios, args.requests, args.concurrency)
+        report["memory"] = measure_memory(buybitcoin.lambda_handler, scenarios)
+        report["response_bytes"] = measure_response_sizes(buybitcoin.lambda_handler, scenarios)
+        report["phases"] = buybitcoin.latency_stats.summary()
+        report["price_cache"] = dict(buybitcoin.price_cache.stats)
+        if buybitcoin.price_aggregator is not None:
+            report["aggregator"] = dict(buybitcoin.price_aggregator.stats)
+        if buybitcoin.quote_stream is not None:
+            report["stream"] = dict(buybitcoin.quote_stream.stats)
+
+    report["upstream"] = {key: sum(stub.stats[key] for stub in stubs) for key in ("requests", "errors")}
+    if args.sources:
+        report["upstream"]["sources"] = [dict(stub.stats, latency=latency) for stub, latency in zip(stubs, latencies)]
+    for stub in stubs:
+        stub.stop()
+    if feed is not None:
+        report["ticker"] = dict(feed.stats)
+        feed.stop()
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(["", "Against {}:".format(args.compare)] + compare(baseline, report)))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return 1 if report["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""Price alerts for every user, evaluated per refresh without a loop over users.
+
+The alerts of one pair and direction sit in two parallel arrays sorted by
+threshold: the thresholds and the alert ids. A move from `previous` to
+`current` crosses exactly one contiguous slice of them,
+
+    above   previous < threshold <= current
+    below   current <= threshold < previous
+
+so two binary searches find every triggered alert and one slice cut
+removes them, however many alerts are set. Alerts added since the last
+evaluation are buffered and merged in with one sort. NumPy is used for
+the arrays when it is installed, the array module otherwise.
+
+Alerts are shared between processes through a directory:
+
+    <directory>/alerts   fixed-size records, an alert's id is its index
+    <directory>/fired    int64 ids of the alerts that have fired
+    <directory>/LOCK     held by the one process that evaluates
+
+Any process may add alerts; appends are serialized with a lock on the
+alerts file. The evaluating process tails it for new ones.
+
+    python pricealerts.py --alerts 5000000
+
+benchmarks evaluation over a synthetic book.
+"""
+import argparse
+import bisect
+import heapq
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ABOVE = "above"
+BELOW = "below"
+DIRECTIONS = (ABOVE, BELOW)
+
+_LOCK_FILE = "LOCK"
+_ALERTS_FILE = "alerts"
+_FIRED_FILE = "fired"
+# threshold, direction, crypto, fiat, user id length, user id
+_RECORD = struct.Struct("<dB8s8sH256s")
+
+Alert = namedtuple("Alert", "id user_id crypto fiat direction threshold")
+
+class PriceAlertError(Exception):
+    """The alerts are evaluated by another process, or an alert does not fit a record."""
+
+def _ids(values=()):
+    # type: (Iterable[int]) -> Any
+    return numpy.array(values, dtype=numpy.int64) if numpy is not None else array("q", values)
+
+def _thresholds(values=()):
+    # type: (Iterable[float]) -> Any
+    return numpy.array(values, dtype=numpy.float64) if numpy is not None else array("d", values)
+
+class ThresholdIndex(object):
+    """The alerts of one pair and direction, sorted by threshold."""
+    def __init__(self, direction):
+        # type: (str) -> None
+        if direction not in DIRECTIONS:
+            raise ValueError("Unknown direction: {}".format(direction))
+        self.direction = direction
+        self._thresholds = _thresholds()
+        self._ids = _ids()
+        self._pending = []  # type: List[Tuple[float, int]]
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._ids) + len(self._pending)
+
+    def add(self, alert_id, threshold):
+        # type: (int, float) -> None
+        self._pending.append((threshold, alert_id))
+
+    def extend(self, alert_ids, thresholds):
+        # type: (Iterable[int], Iterable[float]) -> None
+        self._pending.extend(zip(thresholds, alert_ids))
+
+    def merge(self):
+        # type: () -> None
+        """Merge the added alerts into the sorted arrays; evaluation does it when needed."""
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = []
+
+        if numpy is not None:
+            thresholds = numpy.fromiter((t for t, _ in pending), numpy.float64, len(pending))
+            ids = numpy.fromiter((i for _, i in pending), numpy.int64, len(pending))
+            order = numpy.argsort(thresholds, kind="stable")
+            thresholds, ids = thresholds[order], ids[order]
+            positions = numpy.searchsorted(self._thresholds, thresholds, "right")
+            self._thresholds = numpy.insert(self._thresholds, positions, thresholds)
+            self._ids = numpy.insert(self._ids, positions, ids)
+            return
+
+        pending.sort()
+        if len(pending) * 64 < len(self._ids):
+            for threshold, alert_id in pending:
+                i = bisect.bisect_right(self._thresholds, threshold)
+                self._thresholds.insert(i, threshold)
+                self._ids.insert(i, alert_id)
+        else:
+            merged = list(heapq.merge(zip(self._thresholds, self._ids), pending))
+            self._thresholds = array("d", [t for t, _ in merged])
+            self._ids = array("q", [i for _, i in merged])
+
+    def _search(self, value, side):
+        # type: (float, str) -> int
+        if numpy is not None:
+            return int(numpy.searchsorted(self._thresholds, value, side))
+        return (bisect.bisect_right if side == "right" else bisect.bisect_left)(self._thresholds, value)
+
+    def take_crossed(self, previous, current):
+        # type: (float, float) -> Any
+        """Remove and return the ids of the alerts a move from `previous` to `current` crosses."""
+        self.merge()
+        if self.direction == ABOVE and current > previous:
+            lo, hi = self._search(previous, "right"), self._search(current, "right")
+        elif self.direction == BELOW and current < previous:
+            lo, hi = self._search(current, "left"), self._search(previous, "left")
+        else:
+            return _ids()
+        if lo == hi:
+            return _ids()
+
+        crossed = self._ids[lo:hi].copy() if numpy is not None else self._ids[lo:hi]
+        if numpy is not None:
+            self._thresholds = numpy.concatenate([self._thresholds[:lo], self._thresholds[hi:]])
+            self._ids = numpy.concatenate([self._ids[:lo], self._ids[hi:]])
+        else:
+            del self._thresholds[lo:hi]
+            del self._ids[lo:hi]
+        return crossed
+
+class AlertBook(object):
+    """Every alert, indexed by pair and direction.
+
+    The caller says which move to evaluate, so a price that arrives late
+    or twice is never taken for a move.
+    """
+    def __init__(self):
+        self._indexes = {}  # type: Dict[Tuple[str, str, str], ThresholdIndex]
+
+    def __len__(self):
+        # type: () -> int
+        return sum(len(index) for index in self._indexes.values())
+
+    def index(self, crypto, fiat, direction):
+        # type: (str, str, str) -> ThresholdIndex
+        index = self._indexes.get((crypto, fiat, direction))
+        if index is None:
+            index = self._indexes[crypto, fiat, direction] = ThresholdIndex(direction)
+        return index
+
+    def add(self, alert_id, crypto, fiat, direction, threshold):
+        # type: (int, str, str, str, float) -> None
+        self.index(crypto, fiat, direction).add(alert_id, threshold)
+
+    def merge(self):
+        # type: () -> None
+        for index in self._indexes.values():
+            index.merge()
+
+    def evaluate(self, crypto, fiat, previous, price):
+        # type: (str, str, float, float) -> List[int]
+        """Take the alerts of a pair crossed by a move from `previous` to `price`."""
+        if price != price or previous != previous or previous == price:
+            return []
+
+        crossed = []
+        for direction in DIRECTIONS:
+            index = self._indexes.get((crypto, fiat, direction))
+            if index is not None:
+                crossed.extend(index.take_crossed(previous, price).tolist())
+        return crossed
+
+    def evaluate_prices(self, cryptos, fiats, previous, prices):
+        # type: (List[str], List[str], array, array) -> List[int]
+        """Evaluate the move of every pair between two flat row-major price arrays."""
+        crossed = []
+        for i, crypto in enumerate(cryptos):
+            for j, fiat in enumerate(fiats):
+                k = i * len(fiats) + j
+                crossed.extend(self.evaluate(crypto, fiat, previous[k], prices[k]))
+        return crossed
+
+def _pack_symbol(symbol):
+    # type: (str) -> bytes
+    return symbol.encode("ascii").ljust(8, b"\0")
+
+def _unpack_symbol(data):
+    # type: (bytes) -> str
+    return data.rstrip(b"\0").decode("ascii")
+
+class AlertLog(object):
+    """The append-only alert records of a directory, written by any process."""
+    def __init__(self, directory):
+        # type: (str) -> None
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._fd = os.open(os.path.join(directory, _ALERTS_FILE), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._fired_fd = os.open(os.path.join(directory, _FIRED_FILE), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def append(self, user_id, crypto, fiat, direction, threshold):
+        # type: (str, str, str, str, float) -> int
+        """Add an alert and return its id."""
+        user = user_id.encode("utf-8")
+        if len(user) > 256:
+            raise PriceAlertError("User id too long for an alert record: {} bytes".format(len(user)))
+        record = _RECORD.pack(threshold, DIRECTIONS.index(direction), _pack_symbol(crypto), _pack_symbol(fiat),
+                              len(user), user)
+
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # A crash mid-write leaves a partial record; the next one starts
+            # on a record boundary regardless.
+            size = os.fstat(self._fd).st_size
+            alert_id = -(-size // _RECORD.size)
+            if size % _RECORD.size:
+                os.ftruncate(self._fd, alert_id * _RECORD.size)
+            os.write(self._fd, record)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return alert_id
+
+    def __len__(self):
+        # type: () -> int
+        return os.fstat(self._fd).st_size // _RECORD.size
+
+    def read(self, start=0, stop=None):
+        # type: (int, Union[int, None]) -> List[Alert]
+        """Return the alerts with start <= id < stop, to the last whole record by default."""
+        stop = len(self) if stop is None else stop
+        data = os.pread(self._fd, (stop - start) * _RECORD.size, start * _RECORD.size)
+        alerts = []
+        for offset, (threshold, direction, crypto, fiat, length, user) in enumerate(_RECORD.iter_unpack(data)):
+            alerts.append(Alert(start + offset, user[:length].decode("utf-8"), _unpack_symbol(crypto),
+                                _unpack_symbol(fiat), DIRECTIONS[direction], threshold))
+        return alerts
+
+    def get(self, alert_id):
+        # type: (int) -> Alert
+        return self.read(alert_id, alert_id + 1)[0]
+
+    def mark_fired(self, alert_ids):
+        # type: (Iterable[int]) -> None
+        os.write(self._fired_fd, array("q", alert_ids).tobytes())
+
+    def fired(self):
+        # type: () -> set
+        size = os.fstat(self._fired_fd).st_size // 8 * 8
+        ids = array("q")
+        ids.frombytes(os.pread(self._fired_fd, size, 0))
+        return set(ids)
+
+    def close(self):
+        # type: () -> None
+        os.close(self._fd)
+        os.close(self._fired_fd)
+
+class PriceAlertEngine(object):
+    """The single evaluator of a directory's alerts.
+
+    `evaluate` loads alerts added since the last call, fires the crossed
+    ones into `sink` and records them as fired, so a restarted engine does
+    not fire them again.
+    """
+    def __init__(self, directory, sink):
+        # type: (str, Callable[[List[Alert]], None]) -> None
+        self.log = AlertLog(directory)
+        self.sink = sink
+        self.book = AlertBook()
+        self.stats = {"alerts": 0, "fired": 0, "evaluations": 0}
+        self._loaded = 0
+
+        self._lock = os.open(os.path.join(directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(self._lock)
+                self.log.close()
+                raise PriceAlertError("{} is evaluated by another process".format(directory))
+        self._fired = self.log.fired()
+
+    def load(self):
+        # type: () -> int
+        """Index the alerts added since the last load and return how many there were."""
+        stop = len(self.log)
+        if stop == self._loaded:
+            return 0
+        alerts = self.log.read(self._loaded, stop)
+        for alert in alerts:
+            if alert.id not in self._fired:
+                self.book.add(alert.id, alert.crypto, alert.fiat, alert.direction, alert.threshold)
+        self.book.merge()
+        self._loaded = stop
+        self.stats["alerts"] += len(alerts)
+        return len(alerts)
+
+    def evaluate(self, cryptos, fiats, previous, prices):
+        # type: (List[str], List[str], array, array) -> int
+        """Fire the alerts crossed by a move from `previous` to `prices` and return how many fired."""
+        self.load()
+        crossed = self.book.evaluate_prices(cryptos, fiats, previous, prices)
+        self.stats["evaluations"] += 1
+        if not crossed:
+            return 0
+
+        self.log.mark_fired(crossed)
+        self._fired.update(crossed)
+        self.stats["fired"] += len(crossed)
+        self.sink([self.log.get(alert_id) for alert_id in crossed])
+        return len(crossed)
+
+    def close(self):
+        # type: () -> None
+        self.log.close()
+        os.close(self._lock)
+
+class NotificationBatcher(object):
+    """Collect fired alerts on a background thread and deliver them in batches.
+
+    `deliver` gets up to `batch_size` alerts at a time, at least every
+    `interval` seconds while alerts are waiting. Delivery errors are passed
+    to `on_error` and the batch is dropped.
+    """
+    def __init__(self, deliver, batch_size=100, interval=1.0, on_error=None):
+        # type: (Callable[[List[Alert]], None], int, float, Callable[[Exception], None]) -> None
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.interval = interval
+        self.on_error = on_error
+        self.stats = {"alerts": 0, "batches": 0, "errors": 0}
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def __call__(self, alerts):
+        # type: (List[Alert]) -> None
+        self._start()
+        for alert in alerts:
+            self._queue.put(alert)
+
+    def _start(self):
+        # type: () -> None
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name="alert-notifications", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        # type: () -> None
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + self.interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                try:
+                    alert = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if alert is None:
+                    stopping = True
+                    break
+                batch.append(alert)
+            self._send(batch)
+            if stopping:
+                return
+
+    def _send(self, batch):
+        # type: (List[Alert]) -> None
+        try:
+            self.deliver(batch)
+        except Exception as e:
+            self.stats["errors"] += 1
+            if self.on_error is not None:
+                self.on_error(e)
+            return
+        self.stats["batches"] += 1
+        self.stats["alerts"] += len(batch)
+
+    def close(self, timeout=None):
+        # type: (Union[float, None]) -> None
+        """Deliver what is queued, then stop the thread."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+def benchmark(alerts, moves, pairs=9):
+    # type: (int, float, int) -> Dict[str, float]
+    """Time evaluations of a book of `alerts` spread over `pairs` pairs.
+
+    Thresholds fall within 10% of the price and each refresh raises every
+    pair's price by `moves` (a fraction), so about moves/0.1 of the
+    "above" alerts fire each time.
+    """
+    import random
+
+    rng = random.Random(42)
+    symbols = [("C{}".format(i), "F") for i in range(pairs)]
+    book = AlertBook()
+
+    began = time.time()
+    per_index = alerts // (pairs * 2)
+    for crypto, fiat in symbols:
+        for direction in DIRECTIONS:
+            sign = 1 if direction == ABOVE else -1
+            book.index(crypto, fiat, direction).extend(
+                range(per_index), [100.0 * (1 + sign * rng.random() * 0.1) for _ in range(per_index)])
+    book.merge()
+    build_s = time.time() - began
+    cryptos = [crypto for crypto, _ in symbols]
+    previous = array("d", [100.0] * pairs)
+
+    # A trickle of new alerts between refreshes, as users set them.
+    began = time.perf_counter()
+    for alert_id in range(per_index, per_index + 100):
+        book.add(alert_id, "C0", "F", ABOVE, 100.0 * (1 + rng.random() * 0.1))
+    book.merge()
+    trickle_ms = (time.perf_counter() - began) * 1000
+
+    fired = []
+    times = []
+    for step in range(20):
+        prices = array("d", [100.0 * (1 + moves * (step + 1))] * pairs)
+        began = time.perf_counter()
+        fired.append(len(book.evaluate_prices(cryptos, ["F"], previous, prices)))
+        times.append(time.perf_counter() - began)
+        previous = prices
+
+    # The same refresh checking every alert in turn, timed on up to a
+    # million of them and scaled to the book.
+    naive = [(100.0 * (1 + rng.random() * 0.1), ABOVE) for _ in range(min(per_index * pairs * 2, 1000000))]
+    began = time.perf_counter()
+    [t for t, direction in naive if direction == ABOVE and 100.0 < t <= 100.0 * (1 + moves)]
+    naive_ms = (time.perf_counter() - began) * 1000 * per_index * pairs * 2 / len(naive)
+
+    times.sort()
+    return {"alerts": len(book) + sum(fired), "numpy": numpy is not None, "build_s": round(build_s, 2),
+            "refresh_p50_ms": round(times[len(times) // 2] * 1000, 3), "refresh_max_ms": round(times[-1] * 1000, 3),
+            "fired_per_refresh": sum(fired) // len(fired), "naive_loop_ms": round(naive_ms, 1),
+            "merge_100_new_ms": round(trickle_ms, 2)}
+
+def main(argv=None):
+    # type: (List[str]) -> int
+    parser = argparse.ArgumentParser(description="Benchmark price alert evaluation")
+    parser.add_argument("--alerts", type=int, default=5000000)
+    parser.add_argument("--moves", type=float, default=0.001, help="price move per refresh, as a fraction")
+    args = parser.parse_args(argv)
+
+    for key, value in sorted(benchmark(args.alerts, args.moves).items()):
+        print("{:>18} {}".format(key, value))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
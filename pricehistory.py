@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""An append-only price history, one pair of column files per symbol pair.
+
+    <directory>/BTC-USD.ts   int64 milliseconds since the epoch, ascending
+    <directory>/BTC-USD.px   float64 price at the same index
+
+Readers memory-map the columns and binary-search the timestamps in place,
+so a point or range lookup touches a few pages however long the history
+is. One process at a time may write, guarded by a lock file. It appends
+the timestamp before the price, so a sample counts once its price is on
+disk; a reader sizes the series by the shorter column, and a writer opening
+after a crash cuts the longer one back.
+
+    python pricehistory.py --samples 5000000
+
+benchmarks lookups over a synthetic series.
+"""
+import argparse
+import bisect
+import mmap
+import os
+import sys
+import time
+from array import array
+from typing import Dict, Iterable, List, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_LOCK_FILE = "LOCK"
+
+class PriceHistoryError(Exception):
+    """The history is written by another process, or its files are damaged."""
+
+def _column_paths(directory, crypto, fiat):
+    # type: (str, str, str) -> Tuple[str, str]
+    base = os.path.join(directory, "{}-{}".format(crypto, fiat))
+    return base + ".ts", base + ".px"
+
+class PriceHistoryWriter(object):
+    """The single writer of a price history directory."""
+    def __init__(self, directory):
+        # type: (str) -> None
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._lock = os.open(os.path.join(directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(self._lock)
+                raise PriceHistoryError("{} is being written by another process".format(directory))
+
+        self._columns = {}  # type: Dict[Tuple[str, str], Tuple[int, int]]
+        self._last = {}  # type: Dict[Tuple[str, str], int]
+
+    def _open(self, crypto, fiat):
+        # type: (str, str) -> Tuple[int, int]
+        columns = self._columns.get((crypto, fiat))
+        if columns is not None:
+            return columns
+
+        ts_path, px_path = _column_paths(self.directory, crypto, fiat)
+        ts_fd = os.open(ts_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        px_fd = os.open(px_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+        # Drop whatever a crash left of a half-written sample.
+        count = min(os.fstat(ts_fd).st_size, os.fstat(px_fd).st_size) // 8
+        os.ftruncate(ts_fd, count * 8)
+        os.ftruncate(px_fd, count * 8)
+
+        last = array("q")
+        if count:
+            last.frombytes(os.pread(ts_fd, 8, (count - 1) * 8))
+        self._last[crypto, fiat] = last[0] if count else -1
+        columns = self._columns[crypto, fiat] = (ts_fd, px_fd)
+        return columns
+
+    def extend(self, crypto, fiat, timestamps, prices):
+        # type: (str, str, Iterable[int], Iterable[float]) -> int
+        """Append samples with millisecond timestamps; older ones than the last are skipped.
+
+        Returns the number of samples appended.
+        """
+        ts_fd, px_fd = self._open(crypto, fiat)
+        last = self._last[crypto, fiat]
+
+        new_timestamps = array("q")
+        new_prices = array("d")
+        for timestamp, price in zip(timestamps, prices):
+            if timestamp > last and price == price:
+                new_timestamps.append(timestamp)
+                new_prices.append(price)
+                last = timestamp
+        if not new_timestamps:
+            return 0
+
+        os.write(ts_fd, new_timestamps.tobytes())
+        os.write(px_fd, new_prices.tobytes())
+        self._last[crypto, fiat] = last
+        return len(new_timestamps)
+
+    def record(self, cryptos, fiats, prices, fetched_at):
+        # type: (List[str], List[str], array, float) -> int
+        """Append one sample per pair from a flat row-major price array, skipping NaNs."""
+        timestamp = int(fetched_at * 1000)
+        appended = 0
+        for i, crypto in enumerate(cryptos):
+            for j, fiat in enumerate(fiats):
+                appended += self.extend(crypto, fiat, (timestamp,), (prices[i * len(fiats) + j],))
+        return appended
+
+    def close(self):
+        # type: () -> None
+        for ts_fd, px_fd in self._columns.values():
+            os.close(ts_fd)
+            os.close(px_fd)
+        self._columns.clear()
+        os.close(self._lock)
+
+class PriceSeries(object):
+    """A lock-free, memory-mapped reader of one pair's history.
+
+    The maps grow with the files: every lookup checks the price column's
+    size and remaps when the writer has appended. Views returned by
+    `range` stay valid while they are referenced.
+    """
+    def __init__(self, directory, crypto, fiat):
+        # type: (str, str, str) -> None
+        ts_path, px_path = _column_paths(directory, crypto, fiat)
+        self._ts_fd = os.open(ts_path, os.O_RDONLY)
+        try:
+            self._px_fd = os.open(px_path, os.O_RDONLY)
+        except OSError:
+            os.close(self._ts_fd)
+            raise
+        self._size = 0
+        self._timestamps = memoryview(b"").cast("q")
+        self._prices = memoryview(b"").cast("d")
+
+    def _refresh(self):
+        # type: () -> None
+        size = min(os.fstat(self._ts_fd).st_size, os.fstat(self._px_fd).st_size) // 8 * 8
+        if size == self._size:
+            return
+        # The old maps are left to the garbage collector, since views handed
+        # out by `range` may still point into them.
+        self._timestamps = memoryview(mmap.mmap(self._ts_fd, size, access=mmap.ACCESS_READ)).cast("q")
+        self._prices = memoryview(mmap.mmap(self._px_fd, size, access=mmap.ACCESS_READ)).cast("d")
+        self._size = size
+
+    def __len__(self):
+        # type: () -> int
+        self._refresh()
+        return len(self._timestamps)
+
+    def last(self):
+        # type: () -> Union[Tuple[int, float], None]
+        """Return the newest (timestamp, price), or None if empty."""
+        self._refresh()
+        if not self._timestamps:
+            return None
+        return self._timestamps[-1], self._prices[-1]
+
+    def at(self, timestamp):
+        # type: (int) -> Union[Tuple[int, float], None]
+        """Return the latest (timestamp, price) at or before `timestamp`, or None."""
+        self._refresh()
+        i = bisect.bisect_right(self._timestamps, timestamp)
+        if i == 0:
+            return None
+        return self._timestamps[i - 1], self._prices[i - 1]
+
+    def range(self, start, end):
+        # type: (int, int) -> Tuple[memoryview, memoryview]
+        """Return views of the timestamps and prices with start <= timestamp < end."""
+        self._refresh()
+        lo = bisect.bisect_left(self._timestamps, start)
+        hi = bisect.bisect_left(self._timestamps, end, lo)
+        return self._timestamps[lo:hi], self._prices[lo:hi]
+
+    def close(self):
+        # type: () -> None
+        os.close(self._ts_fd)
+        os.close(self._px_fd)
+
+class PriceHistory(object):
+    """Readers for every pair in a history directory, opened on first use."""
+    def __init__(self, directory):
+        # type: (str) -> None
+        self.directory = directory
+        self._series = {}  # type: Dict[Tuple[str, str], PriceSeries]
+
+    def series(self, crypto, fiat):
+        # type: (str, str) -> Union[PriceSeries, None]
+        """Return the pair's series, or None if nothing was recorded for it yet."""
+        series = self._series.get((crypto, fiat))
+        if series is None:
+            try:
+                series = self._series[crypto, fiat] = PriceSeries(self.directory, crypto, fiat)
+            except OSError:
+                return None
+        return series
+
+def benchmark(samples, lookups, directory=None):
+    # type: (int, int, Union[str, None]) -> Dict[str, float]
+    """Time point and range lookups over `samples` one-minute samples."""
+    import random
+    import shutil
+    import tempfile
+
+    scratch = directory is None
+    directory = directory or tempfile.mkdtemp(prefix="pricehistory-")
+    try:
+        writer = PriceHistoryWriter(directory)
+        start = int(time.time() * 1000) - samples * 60000
+        began = time.time()
+        for chunk in range(0, samples, 100000):
+            count = min(100000, samples - chunk)
+            writer.extend("BTC", "USD", range(start + chunk * 60000, start + (chunk + count) * 60000, 60000),
+                          [9000.0 + (chunk + i) % 1000 for i in range(count)])
+        write_s = time.time() - began
+        writer.close()
+
+        series = PriceHistory(directory).series("BTC", "USD")
+        rng = random.Random(42)
+        end = start + samples * 60000
+        points = [rng.randrange(start, end) for _ in range(lookups)]
+
+        began = time.time()
+        for timestamp in points:
+            series.at(timestamp)
+        point_us = (time.time() - began) / lookups * 1e6
+
+        began = time.time()
+        day = 24 * 3600 * 1000
+        total = 0
+        for timestamp in points:
+            timestamps, prices = series.range(timestamp, timestamp + day)
+            total += len(prices)
+        range_us = (time.time() - began) / lookups * 1e6
+
+        began = time.time()
+        for timestamp in points[:max(1, lookups // 100)]:
+            prices = series.range(timestamp, timestamp + day)[1]
+            max(prices), min(prices)
+        scan_us = (time.time() - began) / max(1, lookups // 100) * 1e6
+
+        return {"samples": len(series), "write_s": round(write_s, 3), "point_us": round(point_us, 2),
+                "day_range_us": round(range_us, 2), "day_min_max_us": round(scan_us, 1),
+                "mean_day_samples": total // lookups}
+    finally:
+        if scratch:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def main(argv=None):
+    # type: (List[str]) -> int
+    parser = argparse.ArgumentParser(description="Benchmark price history lookups")
+    parser.add_argument("--samples", type=int, default=5000000)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--directory", help="an empty directory to build the series in, a temporary one by default")
+    args = parser.parse_args(argv)
+
+    for key, value in sorted(benchmark(args.samples, args.lookups, args.directory).items()):
+        print("{:>18} {}".format(key, value))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
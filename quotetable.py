@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""A price table in a memory-mapped file, shared by every process on a host.
+
+One refresher process writes it and any number of workers read it without
+locks. The file holds a small header, the pair symbols and the flat
+row-major price array:
+
+    magic "BBQT" | cryptos u16 | fiats u16 | seq u64 | fetched_at f64
+    symbols, 8 bytes each, cryptos then fiats
+    prices, f64 per crypto/fiat pair
+
+`seq` is a sequence lock: the writer makes it odd before touching the
+prices and even again afterwards, and a reader retries whenever it saw an
+odd value or the value changed while it copied. It is read and written
+through a memoryview of native unsigned 64-bit words, which makes each
+access a single aligned load or store; going through struct copies byte
+by byte and can see half of an update. Put the file on /dev/shm to keep
+it out of the page cache writeback path.
+"""
+import mmap
+import os
+import struct
+import time
+from array import array
+from typing import List, Tuple, Union
+
+MAGIC = b"BBQT"
+_HEADER = struct.Struct("<4sHHQd")
+_FETCHED_AT = struct.Struct("<d")
+_SEQ_WORD = 1  # seq is the second 64-bit word of the header
+_FETCHED_AT_OFFSET = 16
+_SYMBOL_SIZE = 8
+
+class QuoteTableError(Exception):
+    """The file is not a quote table, or not one for these symbols."""
+
+def _layout(cryptos, fiats):
+    # type: (List[str], List[str]) -> Tuple[int, int]
+    """Return the offset of the price array and the size of the file."""
+    prices_offset = _HEADER.size + _SYMBOL_SIZE * (len(cryptos) + len(fiats))
+    return prices_offset, prices_offset + 8 * len(cryptos) * len(fiats)
+
+class QuoteTableWriter(object):
+    """The single writer of a quote table. Creates or takes over the file."""
+    def __init__(self, path, cryptos, fiats):
+        # type: (str, List[str], List[str]) -> None
+        self.path = path
+        self.cryptos = list(cryptos)
+        self.fiats = list(fiats)
+        self._prices_offset, size = _layout(self.cryptos, self.fiats)
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._words = memoryview(self._map).cast("Q")
+
+        # Keep the sequence number of a table taken over from an earlier
+        # writer, so readers never see it go back.
+        seq = 0
+        if self._map[:4] == MAGIC:
+            seq = self._words[_SEQ_WORD]
+        seq += seq & 1
+
+        _HEADER.pack_into(self._map, 0, MAGIC, len(self.cryptos), len(self.fiats), seq, 0.0)
+        for i, symbol in enumerate(self.cryptos + self.fiats):
+            self._map[_HEADER.size + i * _SYMBOL_SIZE:_HEADER.size + (i + 1) * _SYMBOL_SIZE] = \
+                symbol.encode("ascii").ljust(_SYMBOL_SIZE, b"\0")
+
+    def publish(self, prices, fetched_at):
+        # type: (array, float) -> int
+        """Replace the prices (a flat row-major array('d')) and return the new sequence number."""
+        data = prices.tobytes()
+        if len(data) != 8 * len(self.cryptos) * len(self.fiats):
+            raise ValueError("Expected {} prices, got {}".format(len(self.cryptos) * len(self.fiats), len(prices)))
+
+        seq = self._words[_SEQ_WORD]
+        self._words[_SEQ_WORD] = seq + 1
+        _FETCHED_AT.pack_into(self._map, _FETCHED_AT_OFFSET, fetched_at)
+        self._map[self._prices_offset:self._prices_offset + len(data)] = data
+        self._words[_SEQ_WORD] = seq + 2
+        return seq + 2
+
+    def close(self):
+        # type: () -> None
+        self._words.release()
+        self._map.close()
+
+class QuoteTableReader(object):
+    """A lock-free reader of a quote table written by another process."""
+    def __init__(self, path, retries=100):
+        # type: (str, int) -> None
+        self.path = path
+        self.retries = retries
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < _HEADER.size or self._map[:4] != MAGIC:
+            raise QuoteTableError("{} is not a quote table".format(path))
+        _, n_cryptos, n_fiats, _, _ = _HEADER.unpack_from(self._map, 0)
+        symbols = [self._map[_HEADER.size + i * _SYMBOL_SIZE:_HEADER.size + (i + 1) * _SYMBOL_SIZE].rstrip(b"\0").decode("ascii")
+                   for i in range(n_cryptos + n_fiats)]
+        self.cryptos = symbols[:n_cryptos]
+        self.fiats = symbols[n_cryptos:]
+        self._prices_offset, size = _layout(self.cryptos, self.fiats)
+        if len(self._map) < size:
+            raise QuoteTableError("{} is truncated".format(path))
+        self._prices_end = size
+        self._words = memoryview(self._map)[:size].cast("Q")
+
+    @property
+    def seq(self):
+        # type: () -> int
+        """The current sequence number: even when stable, 0 before the first publish."""
+        return self._words[_SEQ_WORD]
+
+    def read(self):
+        # type: () -> Union[Tuple[int, float, array], None]
+        """Return (seq, fetched_at, prices) from one consistent version, or None if never published."""
+        for _ in range(self.retries):
+            seq = self.seq
+            if seq == 0:
+                return None
+
+            if not seq & 1:
+                fetched_at = _FETCHED_AT.unpack_from(self._map, _FETCHED_AT_OFFSET)[0]
+                prices = array("d")
+                prices.frombytes(self._map[self._prices_offset:self._prices_end])
+                if self.seq == seq:
+                    return seq, fetched_at, prices
+
+            # The writer is mid-update. Let it run rather than spin, in case
+            # it was preempted on the core we are spinning on.
+            time.sleep(0)
+
+        raise QuoteTableError("{} kept changing while being read".format(self.path))
+
+    def close(self):
+        # type: () -> None
+        self._words.release()
+        self._map.close()
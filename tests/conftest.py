@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+# The skill is a set of top-level modules, not a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Nothing under test may reach the real price API.
+os.environ.setdefault("CRYPTOCOMPARE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("EMIT_METRICS", "0")
+
+@pytest.fixture
+def stub_prices(monkeypatch):
+    """Serve the load test's stub prices from the skill's price cache."""
+    import buybitcoin
+    from loadtest import STUB_PRICES
+
+    monkeypatch.setattr(buybitcoin.price_cache, "fetch", lambda: buybitcoin.QuoteMatrix.from_json(
+        STUB_PRICES, buybitcoin.CRYPTO_SYMBOLS, buybitcoin.FIAT_SYMBOLS))
+    buybitcoin.price_cache.invalidate()
+    yield STUB_PRICES
+    buybitcoin.price_cache.invalidate()
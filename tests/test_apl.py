@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import buybitcoin
+
+def test_the_package_takes_every_shared_definition():
+    document = {"type": "APL", "version": "1.1", "import": [{"name": "alexa-layouts", "version": "1.1.0"}],
+                "resources": [{"colors": {"gold": "#f7931a"}}], "styles": {"textStyleBase": {}},
+                "layouts": {"Price": {"items": []}}, "mainTemplate": {"items": []}}
+    package, slim = buybitcoin.split_apl_package(document, "buybitcoin-styles", "https://example.com/package.json")
+
+    assert package == {"type": "APL", "version": "1.1", "resources": document["resources"],
+                       "styles": document["styles"], "layouts": document["layouts"]}
+    assert sorted(slim) == ["import", "mainTemplate", "type", "version"]
+    # Imported last, so its definitions win as they did inline.
+    assert [item["name"] for item in slim["import"]] == ["alexa-layouts", "buybitcoin-styles"]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+import requests
+
+import buybitcoin
+from loadtest import StubPriceServer
+
+@pytest.fixture
+def failing_server():
+    server = StubPriceServer(error_rate=1.0).start()
+    yield server
+    server.stop()
+
+def test_the_breaker_opens_after_threshold_failures(failing_server):
+    circuit = buybitcoin.CircuitBreaker(2, 60)
+    url = failing_server.url + "/data/pricemulti?fsyms=BTC&tsyms=USD"
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            buybitcoin.http_get(url, circuit=circuit, retries=0)
+
+    with pytest.raises(buybitcoin.CircuitOpenError):
+        buybitcoin.http_get(url, circuit=circuit, retries=0)
+    assert failing_server.stats["requests"] == 2
+
+def test_a_half_open_breaker_lets_one_trial_through():
+    circuit = buybitcoin.CircuitBreaker(1, 0.05)
+    circuit.record_failure()
+    assert not circuit.allow()
+
+    time.sleep(0.06)
+    assert circuit.allow()
+    assert not circuit.allow()
+
+    # A failed trial keeps it open for another reset_after.
+    circuit.record_failure()
+    assert not circuit.allow()
+    time.sleep(0.06)
+    assert circuit.allow()
+    circuit.record_success()
+    assert circuit.allow() and circuit.allow()
+
+def test_later_fetches_reuse_the_pooled_connection():
+    server = StubPriceServer().start()
+    try:
+        url = server.url + "/data/pricemulti?fsyms=BTC&tsyms=USD"
+        for _ in range(3):
+            assert buybitcoin.http_get(url, circuit=buybitcoin.CircuitBreaker(1, 60)) == {"BTC": {"USD": 9000.5}}
+        assert server.stats["requests"] == 3
+        assert server.stats["connections"] == 1
+    finally:
+        server.stop()
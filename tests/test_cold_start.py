@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only some requests need these; importing them at cold start is paid by all.
+DEFERRED = ("requests", "aiohttp", "boto3", "ask_sdk_dynamodb", "ask_sdk.standard", "numpy", "pricealerts",
+            "pricehistory", "quotetable", "ask_sdk_model.dialog.delegate_directive",
+            "ask_sdk_model.interfaces.alexa.presentation.apl.render_document_directive")
+
+def _cold_import(**environ):
+    script = ("import json, sys, buybitcoin\n"
+              "print(json.dumps({'loaded': [name for name in %r if name in sys.modules],"
+              " 'builder': type(buybitcoin.sb).__name__,"
+              " 'persistence': buybitcoin.sb.skill_configuration.persistence_adapter is not None}))" % (DEFERRED,))
+    env = dict(os.environ, EMIT_METRICS="0", **environ)
+    for name in ("PERSISTENCE_TABLE", "SKILL_BUILDER_MODE", "PRICE_ALERTS_PATH", "PRICE_HISTORY_PATH", "QUOTE_TABLE_PATH"):
+        if name not in environ:
+            env.pop(name, None)
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=ROOT, env=env)
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+def test_optional_modules_are_not_imported_at_cold_start():
+    assert _cold_import()["loaded"] == []
+
+def test_the_default_builder_has_no_persistence():
+    result = _cold_import()
+    assert result["builder"] == "SkillBuilder"
+    assert not result["persistence"]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import random
+from decimal import ROUND_FLOOR, ROUND_HALF_EVEN, Decimal, localcontext
+
+import pytest
+
+import conversion
+from conversion import QuoteConverter, format_amount, format_fixed, parse_amount
+
+def _random_pairs(count, seed=42):
+    """Random (price, crypto units, fiat cents), the price with up to PRICE_DECIMALS decimals."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        scale = rng.choice([10 ** -8, 10 ** -2, 1, 10 ** 3, 10 ** 5])
+        price = Decimal(rng.randrange(1, 10 ** 9)) * Decimal(str(scale)) / 1000
+        price = price.quantize(Decimal(1).scaleb(-conversion.PRICE_DECIMALS), ROUND_FLOOR) or Decimal("0.00000001")
+        yield price, rng.randrange(0, 10 ** rng.randrange(1, 16)), rng.randrange(0, 10 ** rng.randrange(1, 12))
+
+def test_to_fiat_matches_a_decimal_reference():
+    with localcontext() as context:
+        context.prec = 60
+        for price, crypto_units, _ in _random_pairs(5000):
+            coins = Decimal(crypto_units).scaleb(-conversion.CRYPTO_DECIMALS)
+            expected = (coins * price).scaleb(conversion.FIAT_DECIMALS).to_integral_value(ROUND_HALF_EVEN)
+            assert QuoteConverter(str(price)).to_fiat(crypto_units) == int(expected), (price, crypto_units)
+
+def test_to_crypto_matches_a_decimal_reference():
+    with localcontext() as context:
+        context.prec = 60
+        for price, _, cents in _random_pairs(5000):
+            money = Decimal(cents).scaleb(-conversion.FIAT_DECIMALS)
+            expected = (money / price).scaleb(conversion.CRYPTO_DECIMALS).to_integral_value(ROUND_FLOOR)
+            assert QuoteConverter(str(price)).to_crypto(cents) == int(expected), (price, cents)
+
+@pytest.mark.parametrize("coins, cents", [("0.005", 0), ("0.015", 2), ("0.025", 2), ("0.0250001", 3)])
+def test_to_fiat_rounds_half_cents_to_even(coins, cents):
+    whole, _, fraction = coins.partition(".")
+    assert QuoteConverter("1.00").to_fiat(parse_amount(whole, fraction)) == cents
+
+def test_to_crypto_rounds_down():
+    converter = QuoteConverter("3")
+    assert converter.to_crypto(100) == 33333333
+    assert converter.to_crypto(200) == 66666666
+
+def test_the_batch_conversions_match_the_single_ones():
+    converter = QuoteConverter(9000.5)
+    amounts = [1, 50000000, 123456789, 250000000]
+    assert converter.to_fiat_many(amounts) == [converter.to_fiat(units) for units in amounts]
+    assert converter.to_crypto_many(amounts) == [converter.to_crypto(units) for units in amounts]
+
+def test_a_float_quote_is_taken_at_its_shortest_repr():
+    # 0.1 + 0.2 is 0.30000000000000004; the extra digits fall below a 10**-8 price unit.
+    assert QuoteConverter(0.1 + 0.2).price == QuoteConverter("0.3").price
+
+def test_formatting_is_exact():
+    assert format_fixed(125, 2, 1) == "1.2"
+    assert format_fixed(135, 2, 1) == "1.4"
+    assert format_amount(250000000) == "2.5"
+    assert parse_amount("2", "123456789") == 212345678
+
+def test_a_quote_must_be_positive():
+    with pytest.raises(ValueError):
+        QuoteConverter("0")
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+
+import buybitcoin
+from loadtest import _intent_request, _slot, build_envelope
+
+class _Lines(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+def _emitted(monkeypatch, event):
+    lines = _Lines()
+    monkeypatch.setattr(buybitcoin, "EMIT_METRICS", True)
+    buybitcoin.metrics_logger.addHandler(lines)
+    try:
+        response = buybitcoin.lambda_handler(event, None)
+    finally:
+        buybitcoin.metrics_logger.removeHandler(lines)
+    return response, [json.loads(line) for line in lines.lines]
+
+def test_requests_ending_in_an_exception_handler_emit_metrics(monkeypatch, stub_prices):
+    event = build_envelope(_intent_request("HowMuchIsCryptoInFiat", (
+        _slot("crypto", "dogecoin"), _slot("fiat", "dollars", "USD"), _slot("integer", "1")), "COMPLETED"))
+    response, records = _emitted(monkeypatch, event)
+
+    assert "can only convert" in response["response"]["outputSpeech"]["ssml"]
+    assert len(records) == 1
+    assert records[0]["Intent"] == "HowMuchIsCryptoInFiat"
+    assert records[0]["Dispatch"] >= 0
+    assert buybitcoin.current_timings() is None
+
+def test_timings_do_not_outlive_their_request(monkeypatch):
+    def fail(handler_input):
+        raise RuntimeError("dispatch failed")
+    # Even an error the exception handlers never see clears the thread's timings.
+    monkeypatch.setattr(buybitcoin.skill.request_dispatcher, "dispatch", lambda handler_input: fail(handler_input))
+    event = build_envelope(_intent_request("AMAZON.HelpIntent"))
+    try:
+        buybitcoin.lambda_handler(event, None)
+    except RuntimeError:
+        pass
+    assert buybitcoin.current_timings() is None
+
+def test_the_logged_response_is_the_one_sent(monkeypatch, stub_prices):
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    monkeypatch.setattr(buybitcoin, "should_sample", lambda name: True)
+    monkeypatch.setattr(buybitcoin, "EMIT_METRICS", True)
+    lines = _Lines()
+    buybitcoin.logger.addHandler(handler)
+    buybitcoin.metrics_logger.addHandler(lines)
+    try:
+        event = build_envelope(_intent_request("HowMuchIsCryptoInFiat", (
+            _slot("crypto", "bitcoin", "Bitcoin"), _slot("fiat", "dollars", "USD"), _slot("integer", "2")), "COMPLETED"))
+        response = buybitcoin.lambda_handler(event, None)
+    finally:
+        buybitcoin.logger.removeHandler(handler)
+        buybitcoin.metrics_logger.removeHandler(lines)
+
+    sent = len(json.dumps(response, separators=(",", ":")))
+    logged = [json.loads(record.getMessage()) for record in records if record.msg == "%s"]
+    logged = [message for message in logged if message["event"] == "response"]
+    assert len(logged) == 1
+    assert logged[0]["bytes"] == sent
+    assert logged[0]["payload"]["response"]["outputSpeech"] == response["response"]["outputSpeech"]
+    assert json.loads(lines.lines[0])["ResponseBytes"] == sent
+
+def test_quotes_from_the_shared_table_count_as_table_hits(monkeypatch, tmp_path):
+    from array import array
+    import time
+
+    from quotetable import QuoteTableWriter
+
+    path = str(tmp_path / "quotes")
+    writer = QuoteTableWriter(path, buybitcoin.CRYPTO_SYMBOLS, buybitcoin.FIAT_SYMBOLS)
+    writer.publish(array("d", [100.0] * (len(buybitcoin.CRYPTO_SYMBOLS) * len(buybitcoin.FIAT_SYMBOLS))), time.time())
+    monkeypatch.setattr(buybitcoin.price_cache, "shared", buybitcoin.SharedQuotes(path))
+
+    event = build_envelope(_intent_request("HowMuchIsCryptoInFiat", (
+        _slot("crypto", "bitcoin", "Bitcoin"), _slot("fiat", "dollars", "USD"), _slot("integer", "2")), "COMPLETED"))
+    _, records = _emitted(monkeypatch, event)
+    writer.close()
+
+    counts = {name: records[0][name] for name in ("PriceCacheHit", "PriceCacheStale", "PriceCacheMiss",
+                                                  "PriceTableHit", "PriceStreamHit")}
+    assert counts == {"PriceCacheHit": 0, "PriceCacheStale": 0, "PriceCacheMiss": 0,
+                      "PriceTableHit": 1, "PriceStreamHit": 0}
+    names = [metric["Name"] for metric in records[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"]]
+    assert "PriceTableHit" in names and "PriceStreamHit" in names
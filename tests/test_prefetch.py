@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import buybitcoin
+from loadtest import _intent_request, _slot, build_envelope
+
+CONVERSION_SLOTS = (_slot("crypto", "bitcoin", "Bitcoin"), _slot("fiat", "dollars", "USD"),
+                    _slot("integer", "2"), _slot("decimal", "5"))
+LAST = ["HowMuchIsCryptoInFiat", "BTC", "USD", 250, "q", 0.0]
+
+def _repeat(last):
+    return build_envelope(_intent_request("AMAZON.RepeatIntent"), attributes={"last": last})
+
+def test_only_completed_dialog_turns_prefetch():
+    for state, expected in (("STARTED", False), ("IN_PROGRESS", False), ("COMPLETED", True)):
+        event = build_envelope(_intent_request("HowMuchIsCryptoInFiat", CONVERSION_SLOTS, state))
+        assert buybitcoin.needs_quote(event) is expected, state
+    assert buybitcoin.needs_quote(build_envelope(_intent_request("PortfolioValueIntent")))
+
+def test_repeat_prefetches_only_when_it_would_reprice(monkeypatch):
+    monkeypatch.setattr(buybitcoin, "repeat_cache", buybitcoin.ResponseCache(8))
+    assert buybitcoin.needs_quote(_repeat(LAST))
+
+    buybitcoin.repeat_cache.put(buybitcoin.LastAnswer(*LAST), "Two and a half Bitcoin is a lot.")
+    assert not buybitcoin.needs_quote(_repeat(LAST))
+    assert not buybitcoin.needs_quote(_repeat(["AMAZON.HelpIntent", None, None, 0, None, 0.0]))
+
+def test_repeat_on_the_async_path_does_not_block(monkeypatch, stub_prices):
+    quote = buybitcoin.Quote(buybitcoin.price_cache.fetch(), time.time())
+
+    async def get_async():
+        return quote, "miss"
+
+    def get():
+        raise AssertionError("Repeat fetched on the event loop")
+
+    monkeypatch.setattr(buybitcoin, "repeat_cache", buybitcoin.ResponseCache(8))
+    monkeypatch.setattr(buybitcoin.price_cache, "get_async", get_async)
+    monkeypatch.setattr(buybitcoin.price_cache, "get", get)
+
+    response = asyncio.run(buybitcoin.async_lambda_handler(_repeat(LAST)))
+    assert "Bitcoin" in response["response"]["outputSpeech"]["ssml"]
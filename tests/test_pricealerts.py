@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+import pytest
+
+import buybitcoin
+from pricealerts import ABOVE, BELOW, AlertLog
+
+def _quote(price, fetched_at):
+    return buybitcoin.Quote(buybitcoin.QuoteMatrix(["BTC"], ["USD"], array("d", [price])), fetched_at, "refresher")
+
+@pytest.fixture
+def alerts(tmp_path):
+    log = AlertLog(str(tmp_path))
+    fired = []
+    evaluator = buybitcoin.PriceAlertEvaluator(str(tmp_path), sink=fired.extend)
+
+    def run(*quotes):
+        for quote in quotes:
+            evaluator(quote)
+        evaluator.close(5)
+        return sorted(alert.id for alert in fired)
+
+    yield log, run
+    log.close()
+
+def test_a_rise_fires_the_above_alerts_it_crosses(alerts):
+    log, run = alerts
+    crossed = log.append("amzn1.ask.account.a", "BTC", "USD", ABOVE, 105.0)
+    log.append("amzn1.ask.account.b", "BTC", "USD", ABOVE, 120.0)
+    log.append("amzn1.ask.account.c", "BTC", "USD", BELOW, 95.0)
+
+    assert run(_quote(100.0, 1.0), _quote(110.0, 2.0)) == [crossed]
+
+def test_a_fall_fires_the_below_alerts_it_crosses(alerts):
+    log, run = alerts
+    log.append("amzn1.ask.account.a", "BTC", "USD", ABOVE, 105.0)
+    crossed = log.append("amzn1.ask.account.c", "BTC", "USD", BELOW, 95.0)
+
+    assert run(_quote(100.0, 1.0), _quote(90.0, 2.0)) == [crossed]
+
+def test_a_late_quote_is_not_taken_for_a_move(alerts):
+    log, run = alerts
+    log.append("amzn1.ask.account.a", "BTC", "USD", ABOVE, 105.0)
+    log.append("amzn1.ask.account.c", "BTC", "USD", BELOW, 95.0)
+
+    # A refresh started before the last one finished after it; going back
+    # to its price and forward again is not a crossing.
+    assert run(_quote(100.0, 1.0), _quote(101.0, 3.0), _quote(90.0, 2.0), _quote(101.5, 4.0)) == []
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from array import array
+
+import pytest
+
+from pricehistory import PriceHistory, PriceHistoryError, PriceHistoryWriter
+
+@pytest.fixture
+def history(tmp_path):
+    writer = PriceHistoryWriter(str(tmp_path))
+    writer.extend("BTC", "USD", [1000, 2000, 3000, 4000], [10.0, 20.0, 30.0, 40.0])
+    reader = PriceHistory(str(tmp_path))
+    yield writer, reader
+    writer.close()
+
+def test_at_finds_the_latest_sample_at_or_before(history):
+    _, reader = history
+    series = reader.series("BTC", "USD")
+    assert series.at(999) is None
+    assert series.at(1000) == (1000, 10.0)
+    assert series.at(2999) == (2000, 20.0)
+    assert series.at(10000) == (4000, 40.0)
+
+def test_range_is_half_open(history):
+    _, reader = history
+    timestamps, prices = reader.series("BTC", "USD").range(2000, 4000)
+    assert list(timestamps) == [2000, 3000]
+    assert list(prices) == [20.0, 30.0]
+    assert len(reader.series("BTC", "USD").range(4001, 5000)[0]) == 0
+
+def test_a_reader_sees_later_appends(history):
+    writer, reader = history
+    series = reader.series("BTC", "USD")
+    assert series.last() == (4000, 40.0)
+
+    writer.record(["BTC"], ["USD"], array("d", [50.0]), 5.0)
+    assert len(series) == 5
+    assert series.at(5000) == (5000, 50.0)
+
+def test_out_of_order_and_missing_samples_are_skipped(history):
+    writer, reader = history
+    assert writer.extend("BTC", "USD", [3500, 6000, 7000], [35.0, float("nan"), 70.0]) == 1
+    assert reader.series("BTC", "USD").at(6500) == (4000, 40.0)
+    assert reader.series("ETH", "USD") is None
+
+def test_one_writer_per_directory(history, tmp_path):
+    with pytest.raises(PriceHistoryError):
+        PriceHistoryWriter(str(tmp_path))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from array import array
+
+import pytest
+
+import buybitcoin
+from quotetable import QuoteTableError, QuoteTableReader, QuoteTableWriter
+
+CRYPTOS = ["BTC", "ETH"]
+FIATS = ["USD", "EUR"]
+
+def test_the_price_cache_serves_an_injected_shared_table(tmp_path, monkeypatch):
+    path = str(tmp_path / "quotes")
+    writer = QuoteTableWriter(path, CRYPTOS, FIATS)
+    writer.publish(array("d", [100.0, 90.0, 10.0, 9.0]), time.time())
+
+    monkeypatch.setattr(buybitcoin.price_cache, "shared", buybitcoin.SharedQuotes(path))
+    quote = buybitcoin.get_local_quote()
+    assert quote.origin == "table"
+    assert quote.price("ETH", "EUR") == 9.0
+
+    monkeypatch.setattr(buybitcoin.price_cache, "shared", None)
+    assert buybitcoin.get_table_quote() is None
+    writer.close()
+
+def test_a_reader_only_returns_whole_versions(tmp_path):
+    path = str(tmp_path / "quotes")
+    writer = QuoteTableWriter(path, CRYPTOS, FIATS)
+    reader = QuoteTableReader(path)
+    assert reader.read() is None
+
+    stop = threading.Event()
+
+    def publish():
+        version = 0
+        while not stop.is_set():
+            version += 1
+            writer.publish(array("d", [float(version)] * 4), float(version))
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    try:
+        for _ in range(2000):
+            result = reader.read()
+            if result is None:
+                continue
+            seq, fetched_at, prices = result
+            assert seq % 2 == 0
+            assert set(prices) == {fetched_at}
+    finally:
+        stop.set()
+        thread.join()
+    reader.close()
+    writer.close()
+
+def test_a_reader_gives_up_on_a_writer_stuck_mid_update(tmp_path):
+    path = str(tmp_path / "quotes")
+    writer = QuoteTableWriter(path, CRYPTOS, FIATS)
+    writer.publish(array("d", [1.0] * 4), 1.0)
+    # What a writer that died between the two sequence stores leaves behind.
+    writer._words[1] += 1
+
+    reader = QuoteTableReader(path, retries=3)
+    with pytest.raises(QuoteTableError):
+        reader.read()
+    reader.close()
+    writer.close()
+
+def test_a_new_writer_never_moves_the_sequence_back(tmp_path):
+    path = str(tmp_path / "quotes")
+    writer = QuoteTableWriter(path, CRYPTOS, FIATS)
+    seq = writer.publish(array("d", [1.0] * 4), 1.0)
+    writer._words[1] += 1
+    writer.close()
+
+    writer = QuoteTableWriter(path, CRYPTOS, FIATS)
+    assert writer.publish(array("d", [2.0] * 4), 2.0) > seq
+    writer.close()
+
+def test_a_table_stuck_mid_update_falls_back_to_the_price_cache(tmp_path, monkeypatch, stub_prices):
+    path = str(tmp_path / "quotes")
+    writer = QuoteTableWriter(path, CRYPTOS, FIATS)
+    writer.publish(array("d", [100.0, 90.0, 10.0, 9.0]), time.time())
+    monkeypatch.setattr(buybitcoin.price_cache, "shared", buybitcoin.SharedQuotes(path))
+    assert buybitcoin.get_table_quote().origin == "table"
+
+    # The refresher died between the two sequence stores.
+    writer.publish(array("d", [101.0, 91.0, 11.0, 10.0]), time.time())
+    writer._words[1] += 1
+    for _ in range(2):
+        assert buybitcoin.get_table_quote() is None
+        assert buybitcoin.get_quote().origin != "table"
+    writer.close()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import buybitcoin
+from loadtest import _intent_request, _slot, build_envelope
+
+def _ask(request, user_id, attributes):
+    return buybitcoin.lambda_handler(build_envelope(request, apl=False, attributes=attributes, user_id=user_id), None)
+
+def test_a_repeated_portfolio_is_the_users_own(monkeypatch, stub_prices):
+    monkeypatch.setattr(buybitcoin, "repeat_cache", buybitcoin.ResponseCache(8))
+    monkeypatch.setattr(buybitcoin.time, "time", lambda: 1700000000.0)
+    worth = _intent_request("PortfolioValueIntent", (_slot("fiat", "dollars", "USD"),))
+    sessions = {}
+    for user_id, units in (("amzn1.ask.account.a", 100000000), ("amzn1.ask.account.b", 500000000)):
+        response = _ask(worth, user_id, {"holdings": {"BTC": units}})
+        sessions[user_id] = response["sessionAttributes"]
+    assert sessions["amzn1.ask.account.a"]["last"] == sessions["amzn1.ask.account.b"]["last"]
+
+    for user_id, said in (("amzn1.ask.account.a", "Your 1 Bitcoin"), ("amzn1.ask.account.b", "Your 5 Bitcoin")):
+        response = _ask(_intent_request("AMAZON.RepeatIntent"), user_id, sessions[user_id])
+        assert said in response["response"]["outputSpeech"]["ssml"]
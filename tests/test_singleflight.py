@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+import pytest
+
+import buybitcoin
+
+def test_concurrent_calls_share_one_call():
+    flights = buybitcoin.SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "quote"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("prices", fetch, 5))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while flights.stats["calls"] + flights.stats["shared"] < 8:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["quote"] * 8
+    assert flights.stats == {"calls": 1, "shared": 7, "timeouts": 0}
+
+def test_a_waiter_gives_up_without_cancelling_the_call():
+    flights = buybitcoin.SingleFlight()
+    release = threading.Event()
+    assert flights.start("prices", lambda: release.wait(5) and "quote")
+
+    with pytest.raises(buybitcoin.SingleFlightTimeout):
+        flights.do("prices", lambda: "second call", 0.01)
+    release.set()
+    assert flights.stats["timeouts"] == 1
+
+def test_the_leaders_error_reaches_every_waiter():
+    flights = buybitcoin.SingleFlight()
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        raise buybitcoin.CircuitOpenError("open")
+
+    flights.start("prices", fetch)
+    errors = []
+
+    def wait():
+        try:
+            flights.do("prices", lambda: None, 5)
+        except buybitcoin.CircuitOpenError as e:
+            errors.append(e)
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while flights.stats["shared"] < 1:
+        time.sleep(0.001)
+    release.set()
+    waiter.join()
+    assert len(errors) == 1
+
+def test_async_calls_share_one_task():
+    flights = buybitcoin.AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "quote"
+
+    async def main():
+        return await asyncio.gather(*[flights.do("prices", fetch, 5) for _ in range(8)])
+
+    assert asyncio.run(main()) == ["quote"] * 8
+    assert calls == [1]
+    assert flights.stats == {"calls": 1, "shared": 7, "timeouts": 0}
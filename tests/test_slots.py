@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from ask_sdk_model import Intent, Slot
+from ask_sdk_model.slu.entityresolution import Resolution, Resolutions, Status, StatusCode, Value, ValueWrapper
+
+import buybitcoin
+from buybitcoin import SlotResolver, build_slot_types, merge_slot_types
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "buybitcoin.json")
+
+def _model_types():
+    with open(MODEL_PATH) as f:
+        return json.load(f)["interactionModel"]["languageModel"]["types"]
+
+def _write_model(tmp_path, types):
+    path = tmp_path / "model.json"
+    path.write_text(json.dumps({"interactionModel": {"languageModel": {"types": types}}}))
+    return str(path)
+
+def _matched(name, value, resolved_name, resolved_id):
+    status = Status(code=StatusCode.ER_SUCCESS_MATCH)
+    return Slot(name=name, value=value, resolutions=Resolutions(resolutions_per_authority=[
+        Resolution(authority="amzn1.er-authority.echo-sdk.test", status=status,
+                   values=[ValueWrapper(value=Value(name=resolved_name, id=resolved_id))])]))
+
+def test_every_model_synonym_resolves():
+    resolver = SlotResolver.from_interaction_model(MODEL_PATH)
+    for slot_type in _model_types():
+        slot_name = {"cryptoCoin": "crypto", "fiatCoin": "fiat"}.get(slot_type["name"])
+        if slot_name is None:
+            continue
+        for value in slot_type["values"]:
+            for spoken in [value["name"]["value"]] + value["name"]["synonyms"]:
+                assert resolver.lookup(slot_name, Slot(name=slot_name, value=spoken)) == value["id"], spoken
+
+def test_model_synonyms_survive_the_registry(tmp_path):
+    types = build_slot_types(["BTC"], ["USD"])
+    types[0]["values"][0]["name"]["synonyms"].append("digital gold")
+    resolver = SlotResolver.from_interaction_model(_write_model(tmp_path, types))
+
+    assert resolver.lookup("crypto", Slot(name="crypto", value="digital gold")) == "BTC"
+    # The registry still fills in what the model leaves out.
+    assert resolver.lookup("crypto", Slot(name="crypto", value="ether")) == "ETH"
+
+def test_model_values_without_ids_take_the_registry_symbol(tmp_path):
+    types = [{"name": "cryptoCoin", "values": [{"name": {"value": "Bitcoin", "synonyms": ["digital gold"]}}]}]
+    resolver = SlotResolver.from_interaction_model(_write_model(tmp_path, types))
+
+    assert resolver.lookup("crypto", Slot(name="crypto", value="digital gold")) == "BTC"
+    assert resolver.canonical["BTC"] == "Bitcoin"
+
+def test_canonicalize_leaves_resolved_slots_alone():
+    resolver = SlotResolver.from_interaction_model(MODEL_PATH)
+    resolved = _matched("crypto", "bit coin", "Bitcoin", "BTC")
+    spoken = Slot(name="fiat", value="U.S.D.")
+    intent = resolver.canonicalize(Intent(name="HowMuchIsCryptoInFiat", slots={"crypto": resolved, "fiat": spoken}))
+
+    assert intent.slots["crypto"].value == "bit coin"
+    assert intent.slots["fiat"].value == "USD"
+
+def test_merge_keeps_hand_edited_synonyms():
+    deployed = [{"name": "cryptoCoin", "values": [{"name": {"value": "Bitcoin", "synonyms": ["digital gold"]}}]}]
+    merged = merge_slot_types(deployed, build_slot_types(["BTC", "ETH"], ["USD"]))
+    crypto = next(slot_type for slot_type in merged if slot_type["name"] == "cryptoCoin")
+
+    bitcoin = crypto["values"][0]
+    assert bitcoin["id"] == "BTC"
+    assert bitcoin["name"]["synonyms"][0] == "digital gold"
+    assert set(buybitcoin.CRYPTO_CURRENCIES["BTC"]["synonyms"]) <= set(bitcoin["name"]["synonyms"])
+    assert [value["id"] for value in crypto["values"]] == ["BTC", "ETH"]
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""Serve the skill over HTTP from our own boxes instead of Lambda.
+
+    python webservice.py --port 8080 --workers 4 --threads 16
+
+Every worker is a forked process with its own thread pool, and all of them
+accept on one listening socket. With more than one worker, a refresher
+process keeps a memory-mapped quote table fresh and the workers read their
+prices from it, so the host makes one upstream call per refresh however
+many workers it runs; with QUOTE_STREAM_URL set, it streams ticks into
+the table instead. When QUOTE_TABLE_PATH is set the table is left to an
+external `python buybitcoin.py refresh-quotes`. SIGTERM or SIGINT stops
+accepting, lets in-flight requests finish and exits.
+
+Requests must carry a valid Alexa signature and a recent timestamp, which
+ask_sdk_webservice_support checks. VERIFY_SIGNATURES=0 turns that off for
+local load tests.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    raise SystemExit("webservice.py needs Python 3")
+
+import buybitcoin
+
+WEB_HOST = os.environ.get("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.environ.get("WEB_PORT", "8080"))
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", str(os.cpu_count() or 1)))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "16"))
+WEB_KEEPALIVE = float(os.environ.get("WEB_KEEPALIVE", "5"))
+WEB_MAX_BODY = int(os.environ.get("WEB_MAX_BODY", "131072"))
+VERIFY_SIGNATURES = os.environ.get("VERIFY_SIGNATURES", "1") != "0"
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+def _dispatch_unverified(headers, body):
+    # type: (Dict[str, str], str) -> Dict[str, Any]
+    skill = buybitcoin.skill
+    request_envelope = skill.serializer.deserialize(payload=body, obj_type=buybitcoin.RequestEnvelope)
+    response_envelope = skill.invoke(request_envelope=request_envelope, context=None)
+    return skill.serializer.serialize(response_envelope)
+
+def create_dispatcher(verify=True):
+    # type: (bool) -> Callable[[Dict[str, str], str], Dict[str, Any]]
+    """Return a function that turns request headers and body into a response envelope."""
+    if not verify:
+        return _dispatch_unverified
+
+    try:
+        from ask_sdk_webservice_support.webservice_handler import WebserviceSkillHandler
+    except ImportError:
+        raise SystemExit("Signature verification needs ask-sdk-webservice-support; "
+                         "install it or set VERIFY_SIGNATURES=0")
+    handler = WebserviceSkillHandler(skill=buybitcoin.skill, verify_signature=True, verify_timestamp=True)
+    return handler.verify_request_and_dispatch
+
+class SkillRequestHandler(BaseHTTPRequestHandler):
+    """POST an envelope to any path to invoke the skill; GET /healthz for status."""
+    protocol_version = "HTTP/1.1"
+    timeout = WEB_KEEPALIVE
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body go out in separate writes; don't let Nagle hold the body back.
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        from ask_sdk_core.exceptions import AskSdkException
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > WEB_MAX_BODY:
+            self.close_connection = True
+            return self._send(413, {"error": "Request body too large"})
+
+        body = self.rfile.read(length).decode("utf-8")
+        try:
+            result = self.server.dispatch(dict(self.headers), body)
+        except (AskSdkException, ValueError) as e:
+            logger.warning("Rejected request from {}: {}".format(self.client_address[0], e))
+            return self._send(400, {"error": str(e)})
+        self._send(200, result)
+
+    def do_GET(self):
+        if self.path != "/healthz":
+            return self._send(404, {"error": "Not found"})
+        self._send(200, {"status": "stopping" if self.server.stopping else "ok", "pid": os.getpid(),
+                         "priceCache": dict(buybitcoin.price_cache.stats)})
+
+    def _send(self, status, result):
+        # type: (int, Dict[str, Any]) -> None
+        body = json.dumps(result, separators=(",", ":")).encode("utf-8")
+        if self.server.stopping:
+            self.close_connection = True
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class PooledHTTPServer(HTTPServer):
+    """An HTTPServer that handles connections on a fixed pool of threads.
+
+    A keep-alive connection holds its thread until it goes idle for
+    WEB_KEEPALIVE seconds, so `threads` bounds concurrent connections.
+    On `stop` the read side of every open connection is shut, so idle ones
+    close at once and busy ones close after their response.
+    """
+    def __init__(self, listener, threads, dispatch):
+        # type: (socket.socket, int, Callable[[Dict[str, str], str], Dict[str, Any]]) -> None
+        HTTPServer.__init__(self, listener.getsockname()[:2], SkillRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+        self.dispatch = dispatch
+        self.stopping = False
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="skill")
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+            self.shutdown_request(request)
+
+    def stop(self):
+        # type: () -> None
+        """Stop accepting, then wait for requests in flight. Safe to call from a signal handler."""
+        self.stopping = True
+        threading.Thread(target=self._drain, daemon=True).start()
+
+    def _drain(self):
+        # type: () -> None
+        self.shutdown()
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.shutdown(wait=True)
+
+def _reset_after_fork():
+    # type: () -> None
+    # Pooled upstream connections and the log listener thread do not survive a fork.
+    buybitcoin._session = None
+    if buybitcoin.LOG_ASYNC:
+        from logging.handlers import QueueHandler
+        for handler in list(buybitcoin.logger.handlers):
+            if isinstance(handler, QueueHandler):
+                buybitcoin.logger.removeHandler(handler)
+        buybitcoin.enable_async_logging()
+
+def run_worker(listener, threads, dispatch):
+    # type: (socket.socket, int, Callable[[Dict[str, str], str], Dict[str, Any]]) -> None
+    server = PooledHTTPServer(listener, threads, dispatch)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: server.stop())
+
+    server.serve_forever()
+    server.server_close()
+    logger.info("Worker {} stopped".format(os.getpid()))
+
+def _default_table_path():
+    # type: () -> str
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "buybitcoin-quotes-{}".format(os.getpid()))
+
+def start_quote_table(path):
+    # type: (str) -> Any
+    """Create the quote table and fill it once, so workers have prices from the start."""
+    from quotetable import QuoteTableWriter
+
+    writer = QuoteTableWriter(path, buybitcoin.CRYPTO_SYMBOLS, buybitcoin.FIAT_SYMBOLS)
+    try:
+        writer.publish(buybitcoin.fetch_prices().prices, time.time())
+    except Exception as e:
+        logger.warning("First quote table refresh failed, workers will fetch on their own: {}".format(e))
+    return writer
+
+def run_refresher(writer):
+    # type: (Any) -> None
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+
+    # The parent filled the table just before forking us, so a polling
+    # refresher can wait an interval; a streaming one connects at once.
+    if buybitcoin.QUOTE_STREAM_URL or not stop.wait(buybitcoin.QUOTE_REFRESH_INTERVAL):
+        buybitcoin.refresh_quote_table(writer, buybitcoin.QUOTE_REFRESH_INTERVAL, stop)
+    writer.close()
+    logger.info("Refresher {} stopped".format(os.getpid()))
+
+def serve(host=WEB_HOST, port=WEB_PORT, workers=WEB_WORKERS, threads=WEB_THREADS, verify=VERIFY_SIGNATURES):
+    # type: (str, int, int, int, bool) -> None
+    """Serve the skill until SIGTERM/SIGINT, forking `workers` processes if more than one."""
+    dispatch = create_dispatcher(verify)
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    # Every worker wakes up for a new connection but only one gets it; the
+    # others must go back to waiting instead of blocking in accept().
+    listener.setblocking(False)
+    logger.info("Serving on {}:{} with {} worker(s) x {} threads".format(
+        host, listener.getsockname()[1], workers, threads))
+
+    if workers <= 1:
+        run_worker(listener, threads, dispatch)
+        listener.close()
+        return
+
+    stopping = []
+    children = {}  # pid -> what the process runs
+
+    def spawn(target):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _reset_after_fork()
+                target()
+            except BaseException:
+                logger.exception("Process {} crashed".format(os.getpid()))
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        children[pid] = target
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    table_path = None
+    if not buybitcoin.QUOTE_TABLE_PATH:
+        table_path = _default_table_path()
+        writer = start_quote_table(table_path)
+        spawn(lambda: run_refresher(writer))
+    buybitcoin.price_cache.shared = buybitcoin.SharedQuotes(table_path or buybitcoin.QUOTE_TABLE_PATH)
+
+    for _ in range(workers):
+        spawn(lambda: run_worker(listener, threads, dispatch))
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        target = children.pop(pid, None)
+        if not stopping and target is not None:
+            logger.warning("Process {} exited with status {}, restarting it".format(pid, status))
+            spawn(target)
+
+    listener.close()
+    if table_path:
+        os.unlink(table_path)
+    logger.info("All workers stopped")
+
+def main(argv=None):
+    # type: (List[str]) -> int
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="processes to fork")
+    parser.add_argument("--threads", type=int, default=WEB_THREADS, help="threads per process")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    serve(args.host, args.port, args.workers, args.threads)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())